@@ -1,8 +1,17 @@
 #!/usr/bin/env python
 
 """
-An untested script which (should) clear all notebook cells and execution
-counts.
+Clear the outputs and execution counts of all notebook cells.
+
+With ``-i``, any number of notebooks (and directories containing them) are
+cleared in place, optionally across several processes with ``-j``.
+
+Instead of clearing every output, the ``--max-output-bytes``,
+``--keep-mime``, ``--drop-mime`` and ``--max-stream-bytes`` options only
+remove the heavy parts (see ``RetentionPolicy``).
+
+Notebooks are written with a 4-space indent, or in Jupyter's own layout with
+``--nbformat``, using ``orjson`` if it is installed (see ``Serializer``).
 
 Should work in both Python 2 and Python 3.
 """
@@ -12,35 +21,815 @@ from __future__ import (absolute_import, division, print_function,
 
 import sys
 import argparse
-import json
+import codecs
 import copy
+import filecmp
+import fnmatch
+import functools
+import io
+import json
+import multiprocessing
 import os
+import re
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+from json.encoder import encode_basestring_ascii
+
+
+# Matches a non-empty ``outputs`` list or a non-null ``execution_count``
+_DIRTY_RE = re.compile(br'"outputs"\s*:\s*\[\s*[^\s\]]|"execution_count"\s*:\s*[-\d]')
+_DIRTY_WIDGETS_RE = re.compile(_DIRTY_RE.pattern + br'|"widgets"\s*:')
+# Last line of a stream output truncated by ``--max-stream-bytes``
+_TRUNCATED_MARKER = '[... {} bytes truncated]\n'
+_TRUNCATED_RE = re.compile(br'(?:^|(?<=\n))\[\.\.\. (\d+) bytes truncated\]\n\Z')
+_replace = getattr(os, 'replace', os.rename)
+
+
+class JsonStream(object):
+    """Minimal pull-based scanner over a JSON text file, which reads it in
+    chunks of ``chunk_size`` characters. Values can be skipped (without
+    keeping more than one chunk in memory, however large they are) or
+    decoded, and objects / arrays can be iterated over one item at a time.
+    """
+    _WHITESPACE_RE = re.compile(r'\s*')
+    _STRING_RE = re.compile(r'["\\]')
+    _CONTAINER_RE = re.compile(r'["\[\]{}]')
+    _SCALAR_RE = re.compile(r'[^\s,\]}]*')
+
+    def __init__(self, fp, chunk_size=1 << 16, loads=json.loads):
+        self._fp = fp
+        self._loads = loads
+        self._chunk_size = chunk_size
+        self._buf = ''
+        self._pos = 0
+        # Number of characters dropped from the front of the buffer so far
+        self._dropped = 0
+        # Start of the value being decoded, which must stay in the buffer
+        self._keep_from = None
+
+    def _fill(self):
+        """Read another chunk into the buffer, dropping what has been
+        consumed. Return False at the end of the file.
+        """
+        chunk = self._fp.read(self._chunk_size)
+        if not chunk:
+            return False
+        drop = self._pos if self._keep_from is None else self._keep_from
+        self._buf = self._buf[drop:] + chunk
+        self._pos -= drop
+        self._dropped += drop
+        if self._keep_from is not None:
+            self._keep_from = 0
+        return True
+
+    def _fill_or_fail(self):
+        if not self._fill():
+            raise ValueError('Unexpected end of JSON input')
+
+    def peek(self):
+        """Skip whitespace and return the next character, without consuming
+        it.
+        """
+        while True:
+            self._pos = self._WHITESPACE_RE.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            self._fill_or_fail()
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError('Expected "{}" in JSON input, got "{}"'.format(
+                char, self._buf[self._pos]))
+        self._pos += 1
+
+    def _skip_string(self):
+        self._pos += 1
+        while True:
+            match = self._STRING_RE.search(self._buf, self._pos)
+            if match is None:
+                self._pos = len(self._buf)
+                self._fill_or_fail()
+                continue
+            self._pos = match.end()
+            if match.group() == '"':
+                return
+            # Skip the escaped character
+            while self._pos >= len(self._buf):
+                self._fill_or_fail()
+            self._pos += 1
+
+    def skip(self):
+        """Consume the next value, and return its length in characters.
+        """
+        char = self.peek()
+        start = self._dropped + self._pos
+        if char == '"':
+            self._skip_string()
+        elif char in '[{':
+            self._pos += 1
+            depth = 1
+            while depth:
+                match = self._CONTAINER_RE.search(self._buf, self._pos)
+                if match is None:
+                    self._pos = len(self._buf)
+                    self._fill_or_fail()
+                    continue
+                char = match.group()
+                if char == '"':
+                    self._pos = match.start()
+                    self._skip_string()
+                else:
+                    depth += 1 if char in '[{' else -1
+                    self._pos = match.end()
+        else:
+            match = self._SCALAR_RE.match(self._buf, self._pos)
+            while match.end() == len(self._buf) and self._fill():
+                match = self._SCALAR_RE.match(self._buf, self._pos)
+            self._pos = match.end()
+        return self._dropped + self._pos - start
+
+    def _measure_string(self):
+        self._pos += 1
+        size = len('""')
+        while True:
+            match = self._STRING_RE.search(self._buf, self._pos)
+            end = len(self._buf) if match is None else match.start()
+            size += len(encode_basestring_ascii(self._buf[self._pos:end])) - 2
+            self._pos = end
+            if match is None:
+                self._fill_or_fail()
+                continue
+            if match.group() == '"':
+                self._pos += 1
+                return size
+            # An escaped character, or a \uXXXX escape (each half of a
+            # surrogate pair is escaped on its own by json too)
+            while self._pos + 2 > len(self._buf):
+                self._fill_or_fail()
+            length = 6 if self._buf[self._pos + 1] == 'u' else 2
+            while self._pos + length > len(self._buf):
+                self._fill_or_fail()
+            char = json.loads('"{}"'.format(self._buf[self._pos:self._pos + length]))
+            size += len(encode_basestring_ascii(char)) - 2
+            self._pos += length
+
+    def measure(self):
+        """Consume the next value, and return the length of ``json.dumps()``
+        of its decoded value (with the default options), without decoding
+        it: only one chunk of it is kept in memory, as with ``skip()``.
+        """
+        size = 0
+        depth = 0
+        while True:
+            char = self.peek()
+            if char == '"':
+                size += self._measure_string()
+            elif char in '[{]}':
+                depth += 1 if char in '[{' else -1
+                size += 1
+                self._pos += 1
+            elif char in ',:':
+                # Written as ", " and ": "
+                size += 2
+                self._pos += 1
+                continue
+            else:
+                match = self._SCALAR_RE.match(self._buf, self._pos)
+                while match.end() == len(self._buf) and self._fill():
+                    match = self._SCALAR_RE.match(self._buf, self._pos)
+                # Numbers are written as json writes them once decoded
+                size += len(json.dumps(self._loads(self._buf[self._pos:match.end()])))
+                self._pos = match.end()
+            if depth == 0:
+                return size
+
+    def value(self):
+        """Consume and return the next (decoded) value.
+        """
+        self.peek()
+        self._keep_from = self._pos
+        try:
+            self.skip()
+            return self._loads(self._buf[self._keep_from:self._pos])
+        finally:
+            self._keep_from = None
+
+    def iter_object(self):
+        """Iterate over the keys of the next object. The caller must consume
+        the value after each key (e.g. with ``value()`` or ``skip()``).
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            if self.peek() != '"':
+                raise ValueError('Expected an object key in JSON input')
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.peek() == ',':
+                self._pos += 1
+            else:
+                self.expect('}')
+                return
+
+    def iter_array(self):
+        """Iterate over the items of the next array, yielding their indices.
+        The caller must consume each item.
+        """
+        self.expect('[')
+        if self.peek() == ']':
+            self._pos += 1
+            return
+        index = 0
+        while True:
+            yield index
+            index += 1
+            if self.peek() == ',':
+                self._pos += 1
+            else:
+                self.expect(']')
+                return
+
+
+def clear_cell(cell):
+    """Clear the outputs and execution count of notebook ``cell``, in place.
+    """
+    if 'execution_count' in cell or cell['cell_type'] == 'code':
+        cell['execution_count'] = None
+    if 'outputs' in cell or cell['cell_type'] == 'code':
+        cell['outputs'] = []
+
+
+def _json_size(obj):
+    return len(json.dumps(obj))
+
+
+def _split_lines(text):
+    """Split ``text`` into a list of lines, each keeping its newline, as
+    nbformat stores multi-line strings.
+    """
+    lines = [line + '\n' for line in text.split('\n')]
+    lines[-1] = lines[-1][:-1]
+    return lines if lines[-1] else lines[:-1]
+
+
+class RetentionPolicy(object):
+    """Which parts of the notebook to keep when clearing it.
+
+    By default all outputs are removed. If any of ``max_output_bytes``,
+    ``keep_mimes``, ``drop_mimes`` or ``max_stream_bytes`` is given, outputs
+    are kept except for:
+
+    - ``display_data`` / ``execute_result`` representations whose MIME type
+      does not match one of the ``keep_mimes`` patterns (if any), or matches
+      one of the ``drop_mimes`` patterns (``fnmatch`` syntax, e.g.
+      ``image/*``). Outputs left with no representation are removed.
+    - the end of ``stream`` outputs longer than ``max_stream_bytes``, which
+      is replaced by a ``[... N bytes truncated]`` line (counted in the
+      budget).
+    - outputs still larger than ``max_output_bytes`` (as JSON).
+
+    With ``strip_widgets``, the ``metadata.widgets`` entry (the saved state
+    of Jupyter widgets) is also removed.
+
+    The number of bytes removed is added to the ``removed`` mapping passed to
+    each method, under the category ``outputs``, ``mime``, ``stream``,
+    ``size`` or ``widgets``.
+    """
+
+    def __init__(self, max_output_bytes=None, keep_mimes=(), drop_mimes=(),
+                 max_stream_bytes=None, strip_widgets=False):
+        self.max_output_bytes = max_output_bytes
+        self.keep_mimes = tuple(keep_mimes)
+        self.drop_mimes = tuple(drop_mimes)
+        self.max_stream_bytes = max_stream_bytes
+        self.strip_widgets = strip_widgets
+
+    @property
+    def keeps_outputs(self):
+        return (self.max_output_bytes is not None or self.max_stream_bytes is not None or
+                bool(self.keep_mimes) or bool(self.drop_mimes))
+
+    @property
+    def dirty_re(self):
+        """Regex (over the raw bytes of a notebook) which matches if it may
+        have anything to remove.
+        """
+        return _DIRTY_WIDGETS_RE if self.strip_widgets else _DIRTY_RE
+
+    def _keeps_mime(self, mime):
+        if self.keep_mimes and not any(fnmatch.fnmatchcase(mime, pattern)
+                                       for pattern in self.keep_mimes):
+            return False
+        return not any(fnmatch.fnmatchcase(mime, pattern)
+                       for pattern in self.drop_mimes)
+
+    def _apply_output(self, output, removed):
+        """Return ``output`` with the unwanted parts removed, or None if none
+        of it should be kept.
+        """
+        data = output.get('data')
+        if data is not None and (self.keep_mimes or self.drop_mimes):
+            for mime in list(data):
+                if not self._keeps_mime(mime):
+                    removed['mime'] += _json_size(data.pop(mime))
+                    output.get('metadata', {}).pop(mime, None)
+            if not data:
+                removed['mime'] += _json_size(output)
+                return None
+
+        if (output.get('output_type') == 'stream' and
+                self.max_stream_bytes is not None):
+            text = output.get('text', '')
+            joined = ''.join(text) if isinstance(text, list) else text
+            encoded = joined.encode('utf-8')
+            if len(encoded) > self.max_stream_bytes:
+                # Text truncated by an earlier run is truncated further, and
+                # the bytes lost then still counted in the marker
+                body, lost = encoded, 0
+                match = _TRUNCATED_RE.search(encoded)
+                if match is not None:
+                    # (along with the newline added before the marker)
+                    body, lost = encoded[:match.start()], int(match.group(1))
+                    if body.endswith(b'\n'):
+                        body = body[:-1]
+                # Leave room for a newline and the marker, so that the result
+                # fits in the budget and is left as it is by later runs
+                budget = self.max_stream_bytes - 1 - len(
+                    _TRUNCATED_MARKER.format(lost + len(body)))
+                kept = body[:max(budget, 0)].decode('utf-8', 'ignore')
+                truncated = len(body) - len(kept.encode('utf-8'))
+                if truncated:
+                    removed['stream'] += truncated
+                if kept and not kept.endswith('\n'):
+                    kept += '\n'
+                kept += _TRUNCATED_MARKER.format(lost + truncated)
+                output['text'] = _split_lines(kept) if isinstance(text, list) else kept
+
+        if self.max_output_bytes is not None:
+            size = _json_size(output)
+            if size > self.max_output_bytes:
+                removed['size'] += size
+                return None
+        return output
+
+    def apply_cell(self, cell, removed, outputs_size=None):
+        """Remove the unwanted outputs of notebook ``cell`` (and its
+        execution count), in place. If the outputs have been replaced by a
+        placeholder, ``outputs_size`` gives their size as JSON.
+        """
+        if not self.keeps_outputs:
+            if outputs_size is None and cell.get('outputs'):
+                outputs_size = _json_size(cell['outputs'])
+            if outputs_size is not None:
+                removed['outputs'] += outputs_size
+            clear_cell(cell)
+            return
+        outputs = cell.get('outputs') or []
+        clear_cell(cell)
+        for output in outputs:
+            output = self._apply_output(output, removed)
+            if output is not None:
+                cell['outputs'].append(output)
+
+    def apply_metadata(self, metadata, removed):
+        """Remove the unwanted parts of the notebook ``metadata``, in place.
+        """
+        if self.strip_widgets and 'widgets' in metadata:
+            removed['widgets'] += _json_size(metadata.pop('widgets'))
+
+
+def print_removed(removed):
+    """Print the bytes removed in each category to STDERR.
+    """
+    if not removed:
+        return
+    print('Removed:', file=sys.stderr)
+    for category in sorted(removed, key=removed.get, reverse=True):
+        print('  {:<10}{:>14,d} bytes'.format(category, removed[category]),
+              file=sys.stderr)
+
+
+def _load_orjson():
+    """Return the ``orjson`` module, or None if it is not installed.
+    """
+    try:
+        import orjson
+    except ImportError:
+        return None
+    return orjson
+
+
+class _Float(float):
+    """Floats loaded by ``Serializer.loads()``, which ``orjson`` refuses to
+    serialize (it formats some of them differently from Python).
+    """
+    __slots__ = ()
+
+
+def _escape_non_ascii(exc):
+    """Codec error handler, which escapes non-ASCII characters as JSON does.
+    """
+    return encode_basestring_ascii(exc.object[exc.start:exc.end])[1:-1], exc.end
+
+
+codecs.register_error('clear_nb_output.json_escape', _escape_non_ascii)
+
+
+class Serializer(object):
+    """Reads and writes notebooks as JSON, in one of the ``LAYOUTS``:
+
+    - ``indent4``: the historical layout of this script (4-space indent,
+      keys in their original order, non-ASCII characters escaped).
+    - ``nbformat``: what Jupyter itself writes (1-space indent, sorted keys,
+      UTF-8 and a trailing newline), which keeps diffs against notebooks
+      saved from Jupyter minimal.
+
+    ``backend`` is ``json``, ``orjson`` (faster), or ``auto`` for ``orjson``
+    if it is installed. Both give byte-for-byte identical output: ``orjson``
+    results are re-indented, and documents with floats (as loaded by
+    ``loads()``) or very large integers, which ``orjson`` cannot write the
+    same way, go through ``json``.
+    """
+    LAYOUTS = {
+        'indent4': dict(indent=4, sort_keys=False, ensure_ascii=True),
+        'nbformat': dict(indent=1, sort_keys=True, ensure_ascii=False),
+    }
+    BACKENDS = ('auto', 'json', 'orjson')
+
+    def __init__(self, layout='indent4', backend='auto'):
+        if layout not in self.LAYOUTS:
+            raise ValueError('Unknown layout "{}"'.format(layout))
+        if backend not in self.BACKENDS:
+            raise ValueError('Unknown backend "{}"'.format(backend))
+        if backend == 'orjson' and _load_orjson() is None:
+            raise ValueError('orjson is not installed')
+        self.layout = layout
+        self.backend = backend
+        self._options = self.LAYOUTS[layout]
+
+    @property
+    def trailing_newline(self):
+        return self.layout == 'nbformat'
+
+    def loads(self, text):
+        return json.loads(text, parse_float=_Float)
+
+    def load(self, fp):
+        return json.load(fp, parse_float=_Float)
+
+    def _orjson_dumps(self, orjson, obj):
+        option = orjson.OPT_INDENT_2
+        if self._options['sort_keys']:
+            option |= orjson.OPT_SORT_KEYS
+        data = orjson.dumps(obj, option=option)
+
+        # Lines are indented by 2 spaces per level, and never start with a
+        # space otherwise: re-indent them from the deepest level up, through
+        # a placeholder character (control characters are always escaped)
+        depth = 0
+        while b'\n' + b'  ' * (depth + 1) in data:
+            depth += 1
+        for level in range(depth, 0, -1):
+            data = data.replace(b'\n' + b'  ' * level, b'\n' + b'\x00' * level)
+        data = data.replace(b'\x00', b' ' * self._options['indent'])
+
+        if self._options['ensure_ascii']:
+            # DEL is ASCII, so the error handler does not see it, but json
+            # escapes it too
+            data = data.decode('utf-8').encode('ascii', 'clear_nb_output.json_escape')
+            data = data.replace(b'\x7f', b'\\u007f')
+        return data.decode('utf-8')
+
+    def dumps(self, obj, level=0):
+        """Return ``obj`` as JSON, formatted as it would be at nesting depth
+        ``level`` of a notebook.
+        """
+        orjson = _load_orjson() if self.backend != 'json' else None
+        text = None
+        if orjson is not None:
+            try:
+                text = self._orjson_dumps(orjson, obj)
+            except TypeError:
+                pass
+        if text is None:
+            text = json.dumps(obj, allow_nan=False, **self._options)
+            if isinstance(text, bytes):
+                # Python 2 returns str when ensure_ascii is set
+                text = text.decode('ascii')
+        if level:
+            text = text.replace('\n', '\n' + ' ' * (self._options['indent'] * level))
+        return text
+
+
+def clear_notebook_stream(src_fp, dest_fp, policy=None, removed=None,
+                          serializer=None, chunk_size=1 << 16):
+    """Copy the notebook in text file ``src_fp`` to ``dest_fp`` with all cell
+    outputs and execution counts cleared (or those not kept by the
+    ``RetentionPolicy``), writing each cell as soon as it is read. Unless the
+    policy keeps some outputs, they are skipped without being decoded, so
+    memory use is bounded by the largest cell without its outputs, rather
+    than by the notebook.
+
+    The result, and the bytes counted in ``removed``, are identical to those
+    of ``clear_notebook()``, but only the ``indent4`` layout of the
+    ``Serializer`` is supported, since the ``nbformat`` one sorts keys.
+    """
+    serializer = serializer or Serializer()
+    if serializer.layout != 'indent4':
+        raise ValueError('Only the "indent4" layout can be streamed')
+    policy = policy or RetentionPolicy()
+    removed = removed if removed is not None else defaultdict(int)
+    stream = JsonStream(src_fp, chunk_size, serializer.loads)
+    dest_fp.write('{')
+    n_keys = 0
+    for key in stream.iter_object():
+        dest_fp.write('{}\n    {}: '.format(',' if n_keys else '', json.dumps(key)))
+        n_keys += 1
+        if key != 'cells' or stream.peek() != '[':
+            value = stream.value()
+            if key == 'metadata' and isinstance(value, dict):
+                policy.apply_metadata(value, removed)
+            dest_fp.write(serializer.dumps(value, 1))
+            continue
+
+        dest_fp.write('[')
+        n_cells = 0
+        for _ in stream.iter_array():
+            cell = {}
+            outputs_size = None
+            for cell_key in stream.iter_object():
+                if cell_key == 'execution_count':
+                    stream.skip()
+                    cell[cell_key] = None
+                elif cell_key == 'outputs' and not policy.keeps_outputs:
+                    # Counted as in clear_notebook()
+                    size = stream.measure()
+                    cell[cell_key] = None
+                    if size > len('[]'):
+                        outputs_size = size
+                else:
+                    cell[cell_key] = stream.value()
+            policy.apply_cell(cell, removed, outputs_size)
+            dest_fp.write('{}\n        {}'.format(',' if n_cells else '',
+                                                  serializer.dumps(cell, 2)))
+            n_cells += 1
+        dest_fp.write('\n    ]' if n_cells else ']')
+    dest_fp.write('\n}' if n_keys else '}')
+
+
+def clear_notebook(src_fp, dest_fp, policy=None, removed=None,
+                   serializer=None):
+    """Load the notebook in text file ``src_fp``, and write it to ``dest_fp``
+    with all cell outputs and execution counts cleared (or those not kept by
+    the ``RetentionPolicy``), with the ``Serializer``.
+    """
+    serializer = serializer or Serializer()
+    policy = policy or RetentionPolicy()
+    removed = removed if removed is not None else defaultdict(int)
+    nb_json = serializer.load(src_fp)
+    policy.apply_metadata(nb_json.get('metadata', {}), removed)
+    for cell in nb_json['cells']:
+        policy.apply_cell(cell, removed)
+    dest_fp.write(serializer.dumps(nb_json))
+    if serializer.trailing_newline:
+        dest_fp.write('\n')
+
+
+def needs_clearing(fpath, dirty_re=_DIRTY_RE, chunk_size=1 << 20):
+    """Return whether the notebook at ``fpath`` has any outputs or execution
+    counts (or other matches for ``dirty_re``), using a byte scan rather than
+    parsing it. Chunks overlap, so that a match straddling two of them is
+    still found.
+    """
+    tail = b''
+    with open(fpath, 'rb') as fp:
+        while True:
+            chunk = fp.read(chunk_size)
+            if not chunk:
+                return False
+            data = tail + chunk
+            if dirty_re.search(data):
+                return True
+            tail = data[-64:]
+
+
+def clear_file(fpath, stream=False, policy=None, serializer=None):
+    """Clear the notebook at ``fpath`` in place, by writing it to a temporary
+    file next to it and renaming that over the original. Notebooks that are
+    already clear (or would be unchanged) are left untouched.
+
+    Return the size of the file before and after, and the bytes removed in
+    each category (see ``RetentionPolicy``). The size after is None if the
+    notebook was skipped.
+    """
+    policy = policy or RetentionPolicy()
+    removed = defaultdict(int)
+    size = os.path.getsize(fpath)
+    if not needs_clearing(fpath, policy.dirty_re):
+        return size, None, removed
+
+    clear = clear_notebook_stream if stream else clear_notebook
+    fd, tmp_fpath = tempfile.mkstemp(
+        prefix='.{}.'.format(os.path.basename(fpath)), suffix='.tmp',
+        dir=os.path.dirname(os.path.abspath(fpath)))
+    try:
+        with io.open(fd, 'w', encoding='utf-8') as dest_fp:
+            with io.open(fpath, 'r', encoding='utf-8') as src_fp:
+                clear(src_fp, dest_fp, policy, removed, serializer)
+        if filecmp.cmp(fpath, tmp_fpath, shallow=False):
+            os.remove(tmp_fpath)
+            return size, None, removed
+        shutil.copymode(fpath, tmp_fpath)
+        _replace(tmp_fpath, fpath)
+    except BaseException:
+        os.remove(tmp_fpath)
+        raise
+    return size, os.path.getsize(fpath), removed
+
+
+def _clear_file_job(fpath, stream=False, policy=None, serializer=None):
+    try:
+        return (fpath,) + clear_file(fpath, stream, policy, serializer) + (None,)
+    except (ValueError, KeyError, IOError, OSError) as err:
+        return fpath, None, None, None, '{}: {}'.format(type(err).__name__, err)
+
+
+def clear_files(fpaths, jobs=1, stream=False, policy=None, serializer=None):
+    """Clear the notebooks ``fpaths`` in place on ``jobs`` processes, yielding
+    ``(fpath, size_before, size_after, removed, error)`` for each one as it
+    finishes.
+    """
+    job = functools.partial(_clear_file_job, stream=stream, policy=policy,
+                            serializer=serializer)
+    if jobs <= 1:
+        for fpath in fpaths:
+            yield job(fpath)
+        return
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for result in pool.imap_unordered(job, fpaths, chunksize=4):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def iter_notebooks(paths):
+    """Yield the notebook files in ``paths``, recursing into directories (but
+    not hidden ones, such as ``.ipynb_checkpoints`` or ``.git``).
+    """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, dirnames, filenames in os.walk(path):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+            for filename in sorted(filenames):
+                if filename.endswith('.ipynb'):
+                    yield os.path.join(root, filename)
+
+
+def clear_in_place(paths, jobs=1, stream=False, policy=None, serializer=None):
+    """Clear every notebook in ``paths`` in place, and print summary
+    statistics to STDERR. Return the number of notebooks that failed.
+    """
+    start = time.time()
+    n_cleared = n_skipped = 0
+    bytes_before = bytes_after = 0
+    total_removed = defaultdict(int)
+    errors = []
+    for fpath, size_before, size_after, removed, error in clear_files(
+            iter_notebooks(paths), jobs, stream, policy, serializer):
+        if error is not None:
+            errors.append(error)
+            print('Failed to clear "{}": {}'.format(fpath, error),
+                  file=sys.stderr)
+            continue
+        bytes_before += size_before
+        for category, n_bytes in removed.items():
+            total_removed[category] += n_bytes
+        if size_after is None:
+            n_skipped += 1
+            bytes_after += size_before
+        else:
+            n_cleared += 1
+            bytes_after += size_after
+    elapsed = time.time() - start
+
+    print('Cleared {} of {} notebooks ({} already clear, {} failed) in '
+          '{:.2f}s ({:.1f} MB/s)'.format(
+              n_cleared, n_cleared + n_skipped + len(errors), n_skipped,
+              len(errors), elapsed, bytes_before / 1e6 / max(elapsed, 1e-9)),
+          file=sys.stderr)
+    print('Saved {:.2f} MB ({:.2f} MB -> {:.2f} MB)'.format(
+              (bytes_before - bytes_after) / 1e6, bytes_before / 1e6,
+              bytes_after / 1e6),
+          file=sys.stderr)
+    print_removed(total_removed)
+    return len(errors)
+
+
+def benchmark_serializers(fpaths):
+    """Time each ``Serializer`` backend, in each layout, on the notebooks in
+    ``fpaths`` (both as they are and cleared), check that the results agree,
+    and print a summary.
+    """
+    serializer = Serializer()
+    notebooks = []
+    n_bytes = 0
+    for fpath in fpaths:
+        with io.open(fpath, 'r', encoding='utf-8') as fp:
+            notebooks.append(serializer.load(fp))
+        n_bytes += os.path.getsize(fpath)
+    cleared = copy.deepcopy(notebooks)
+    for nb_json in cleared:
+        for cell in nb_json['cells']:
+            clear_cell(cell)
+    backends = ['json'] + (['orjson'] if _load_orjson() is not None else [])
+
+    print('Notebooks: {}, size: {} bytes'.format(len(notebooks), n_bytes))
+    n_mismatches = 0
+    for name, nb_jsons in (('as is', notebooks), ('cleared', cleared)):
+        print('  {}:'.format(name))
+        for layout in sorted(Serializer.LAYOUTS):
+            reference = None
+            for backend in backends:
+                serializer = Serializer(layout, backend)
+                start = time.time()
+                results = [serializer.dumps(nb_json) for nb_json in nb_jsons]
+                elapsed = max(time.time() - start, 1e-9)
+                out_bytes = sum(len(text.encode('utf-8')) for text in results)
+                print('    {:8} {:6} {:8.3f}s {:8.2f} MB/s {:12} bytes'.format(
+                    layout, backend, elapsed, out_bytes / elapsed / 1e6,
+                    out_bytes))
+                if reference is None:
+                    reference = results
+                else:
+                    n_mismatches += sum(a != b for a, b in zip(reference, results))
+    print('{} results differ between backends'.format(n_mismatches))
 
 
 def main(argv):
     parser = argparse.ArgumentParser()
-    parser.add_argument('src_fpath', help='File path to notebook file (.ipynb) to be cleared.')
+    parser.add_argument('src_fpaths', nargs='+', metavar='src_fpath', help='File path to notebook file (.ipynb) to be cleared. Several files, or directories to search for notebooks, may be given with -i.')
     parser.add_argument('-o', '--output', help='Output file to write resulting notebook. If not provided, output will be writen to STDOUT.')
+    parser.add_argument('-s', '--stream', action='store_true', help='Stream the notebook through instead of loading it whole, so that memory use is bounded by the largest cell (without its outputs).')
+    parser.add_argument('-i', '--in-place', action='store_true', help='Clear the notebooks in place (atomically), skipping those that are already clear, and print summary statistics to STDERR.')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of processes used to clear notebooks with -i (default: %(default)s)')
+    parser.add_argument('--max-output-bytes', type=int, help='Keep outputs, except those larger than this many bytes (as JSON).')
+    parser.add_argument('--keep-mime', action='append', default=[], metavar='PATTERN', help='Keep outputs, but only their representations whose MIME type matches PATTERN (e.g. "text/*"). May be given several times.')
+    parser.add_argument('--drop-mime', action='append', default=[], metavar='PATTERN', help='Keep outputs, except their representations whose MIME type matches PATTERN (e.g. "image/*"). May be given several times.')
+    parser.add_argument('--max-stream-bytes', type=int, help='Keep outputs, but truncate stream outputs (e.g. STDOUT) to this many bytes.')
+    parser.add_argument('--strip-widgets', action='store_true', help='Also remove the saved widget state in metadata.widgets.')
+    parser.add_argument('--nbformat', action='store_true', help='Write notebooks in the layout Jupyter uses (1-space indent, sorted keys, UTF-8), rather than with a 4-space indent. Cannot be used with -s.')
+    parser.add_argument('--backend', choices=Serializer.BACKENDS, default='auto', help='JSON library used to write notebooks; "auto" uses orjson if it is installed. The output is the same with all of them. (default: %(default)s)')
+    parser.add_argument('-b', '--benchmark', action='store_true', help='Benchmark the JSON backends on the given notebooks, instead of clearing them.')
     args = parser.parse_args()
 
-    with open(args.src_fpath, 'rb') as src_fp:
-        src_json = json.load(src_fp)
-    dest_json = copy.deepcopy(src_json)
+    if args.benchmark:
+        benchmark_serializers(list(iter_notebooks(args.src_fpaths)))
+        return
+    if args.nbformat and args.stream:
+        parser.error('--nbformat cannot be used with -s')
+    try:
+        serializer = Serializer('nbformat' if args.nbformat else 'indent4', args.backend)
+    except ValueError as err:
+        parser.error(str(err))
+    policy = RetentionPolicy(args.max_output_bytes, args.keep_mime, args.drop_mime,
+                             args.max_stream_bytes, args.strip_widgets)
 
-    for cell in dest_json['cells']:
-        if 'execution_count' in cell or cell['cell_type'] == 'code':
-            cell['execution_count'] = None
-        if 'outputs' in cell or cell['cell_type'] == 'code':
-            cell['outputs'] = []
+    if args.in_place:
+        if args.output is not None:
+            parser.error('-o cannot be used with -i')
+        n_errors = clear_in_place(args.src_fpaths, args.jobs, args.stream,
+                                  policy, serializer)
+        return 1 if n_errors else 0
+    if len(args.src_fpaths) > 1 or os.path.isdir(args.src_fpaths[0]):
+        parser.error('several notebooks, or directories, can only be cleared with -i')
+    src_fpath = args.src_fpaths[0]
 
     if args.output is not None:
         parent_dpath = os.path.dirname(args.output)
-        if not os.path.isdir(parent_dpath):
+        if parent_dpath and not os.path.isdir(parent_dpath):
             os.makedirs(parent_dpath)
-        with open(args.output, 'w') as dest_fp:
-            json.dump(dest_json, dest_fp, indent=4, allow_nan=False)
-    else:
-        print(json.dumps(dest_json, indent=4, allow_nan=False))
+
+    clear = clear_notebook_stream if args.stream else clear_notebook
+    removed = defaultdict(int)
+    with io.open(src_fpath, 'r', encoding='utf-8') as src_fp:
+        if args.output is not None:
+            with io.open(args.output, 'w', encoding='utf-8') as dest_fp:
+                clear(src_fp, dest_fp, policy, removed, serializer)
+        else:
+            clear(src_fp, sys.stdout, policy, removed, serializer)
+            if not serializer.trailing_newline:
+                print()
+    if policy.keeps_outputs or policy.strip_widgets:
+        print_removed(removed)
 
 
 if __name__ == '__main__':
@@ -7,23 +7,145 @@ Currently, this script does one thing:
     code and/or Jupyter notebooks that reside in given file / directory
     path(s). If a module appears to be optional, its location information is
     printed next to it (filepath, line number, column number). Modules that are
-    already installed can be excluded from the output with the ``-x`` flag.
+    already installed can be excluded from the output with the ``-x`` flag,
+    and builtin / standard library modules with the ``-B`` flag.
 
 Future improvements might include:
-  - Filtering out builtin modules
   - Detecting whether a module is truly optional or required (instead of printing its metadata)
 """
 
 import argparse
+from array import array
 import ast
-from collections import defaultdict
-import copy
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import hashlib
 import json
 import logging
 import os
 import pkgutil
 import re
+import subprocess
 import sys
+import tempfile
+import time
+
+
+# Directories pruned by ``get_filepaths``, in ``.gitignore`` syntax
+DEFAULT_EXCLUDES = (
+    '.git/', '.hg/', '.svn/', 'node_modules/', '__pycache__/', '.tox/',
+    '.nox/', '.venv/', 'venv/', 'build/', 'dist/', '.eggs/', '*.egg-info/',
+    '.mypy_cache/', '.pytest_cache/',
+)
+
+
+
+class ImportStore(object):
+    """Compact, columnar store of import occurrences. Module names and
+    filepaths are interned, and each occurrence is one row of the
+    ``COLUMNS`` (module ID, path ID, line number, column offset), kept in
+    ``array.array`` columns rather than as Python tuples.
+    """
+    COLUMNS = ('module_id', 'path_id', 'lineno', 'col_offset')
+
+    def __init__(self):
+        self.modules = []
+        self.paths = []
+        self._module_ids = {}
+        self._path_ids = {}
+        self._columns = dict((name, array('I')) for name in self.COLUMNS)
+
+    def __len__(self):
+        return len(self._columns['module_id'])
+
+    def _intern(self, ids, names, name):
+        name_id = ids.get(name)
+        if name_id is None:
+            name_id = ids[name] = len(names)
+            names.append(name)
+        return name_id
+
+    def add(self, module, filepath, lineno, col_offset):
+        self._columns['module_id'].append(
+            self._intern(self._module_ids, self.modules, module))
+        self._columns['path_id'].append(
+            self._intern(self._path_ids, self.paths, filepath))
+        self._columns['lineno'].append(lineno)
+        self._columns['col_offset'].append(col_offset)
+
+    def add_file_imports(self, filepath, file_imports):
+        """Store the ``(module, lineno, col_offset)`` tuples found in
+        ``filepath`` (e.g. by ``scan_file``).
+        """
+        path_id = self._intern(self._path_ids, self.paths, filepath)
+        for mod, lineno, col_offset in file_imports:
+            self._columns['module_id'].append(
+                self._intern(self._module_ids, self.modules, mod))
+            self._columns['path_id'].append(path_id)
+            self._columns['lineno'].append(lineno)
+            self._columns['col_offset'].append(col_offset)
+
+    def column(self, name):
+        """Return a read-only view of column ``name`` (no copy is made; the
+        store can't grow while the view is alive).
+        """
+        return memoryview(self._columns[name]).toreadonly()
+
+    def rows(self):
+        """Iterate over ``(module, filepath, lineno, col_offset)`` tuples, in
+        the order they were added.
+        """
+        modules, paths = self.modules, self.paths
+        for module_id, path_id, lineno, col_offset in zip(
+                *[self._columns[name] for name in self.COLUMNS]):
+            yield modules[module_id], paths[path_id], lineno, col_offset
+
+    def to_json(self, fp):
+        """Write the store to the text file ``fp`` as columnar JSON.
+        """
+        data = {'modules': self.modules, 'paths': self.paths}
+        for name in self.COLUMNS:
+            data[name] = self._columns[name].tolist()
+        json.dump(data, fp)
+
+    def to_csv(self, fp):
+        """Write one CSV row per import occurrence to the text file ``fp``.
+        """
+        writer = csv.writer(fp)
+        writer.writerow(('module', 'filepath', 'lineno', 'col_offset'))
+        writer.writerows(self.rows())
+
+    def to_parquet(self, path):
+        """Write the store to a Parquet file at ``path``, with the module and
+        filepath columns dictionary-encoded. Requires pyarrow.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        ids = dict((name, pa.array(self._columns[name], type=pa.uint32()))
+                   for name in self.COLUMNS)
+        table = pa.table({
+            'module': pa.DictionaryArray.from_arrays(
+                ids['module_id'], pa.array(self.modules, type=pa.string())),
+            'filepath': pa.DictionaryArray.from_arrays(
+                ids['path_id'], pa.array(self.paths, type=pa.string())),
+            'lineno': ids['lineno'],
+            'col_offset': ids['col_offset'],
+        })
+        pq.write_table(table, path)
+
+    def export(self, path):
+        """Write the store to ``path``, in the format given by its extension
+        (``.json``, ``.csv`` or ``.parquet``).
+        """
+        ext = os.path.splitext(path.lower())[-1]
+        if ext == '.parquet':
+            self.to_parquet(path)
+        elif ext in ('.json', '.csv'):
+            with open(path, 'w', encoding='utf-8', newline='') as fp:
+                (self.to_json if ext == '.json' else self.to_csv)(fp)
+        else:
+            raise ValueError('Unsupported export format "{}"'.format(ext))
 
 
 
@@ -33,46 +155,553 @@ class ImportLister(ast.NodeVisitor):
     the filepath, line number, and column offset.
     """
     def __init__(self):
-        self.filename = None
-        self._imports = defaultdict(list)
+        self.filepath = None
+        self._imports = ImportStore()
 
     @property
     def imports(self):
-        """Dictionary mapping (imported) module names to their metadata.
+        """``ImportStore`` of the (imported) module names and their metadata.
         """
-        return copy.deepcopy(self._imports)
+        return self._imports
 
     def visit_Import(self, node):
         for name in node.names:
-            if '.' in name.name:
-                # Only keep the module name before the first period
-                mod = name.name.split('.', 1)[0]
-                self._imports[mod].append((self.filepath, node.lineno, node.col_offset))
-            else:
-                mod = name.name
-                self._imports[mod].append((self.filepath, node.lineno, node.col_offset))
+            # Only keep the module name before the first period
+            mod = name.name.split('.', 1)[0]
+            self._imports.add(mod, self.filepath, node.lineno, node.col_offset)
         self.generic_visit(node)
 
     def visit_ImportFrom(self, node):
         # Skip relative imports
         if node.level == 0:
-            if '.' in node.module:
-                # Only keep the module name before the first period
-                mod = node.module.split('.', 1)[0]
-                self._imports[mod].append((self.filepath, node.lineno, node.col_offset))
-            else:
-                mod = node.module
-                self._imports[mod].append((self.filepath, node.lineno, node.col_offset))
+            # Only keep the module name before the first period
+            mod = node.module.split('.', 1)[0]
+            self._imports.add(mod, self.filepath, node.lineno, node.col_offset)
         self.generic_visit(node)
 
+    def add_file_imports(self, filepath, file_imports):
+        """Store the ``(module, lineno, col_offset)`` tuples found in
+        ``filepath`` (e.g. by ``scan_file``).
+        """
+        self._imports.add_file_imports(filepath, file_imports)
+
+
+
+class ImportCache(object):
+    """On-disk (JSON) cache of the imports (and, for ``ImportGraph``, the
+    dependencies) found in each file, keyed by filepath. A file is not read
+    again while its mtime and size are unchanged, and not parsed again while
+    its content hash is unchanged.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self._entries = {}
+        if os.path.isfile(path):
+            with open(path, 'r', encoding='utf-8') as fp:
+                self._entries = json.load(fp)
+
+    @staticmethod
+    def _key(filepath):
+        return os.path.abspath(filepath)
+
+    @staticmethod
+    def _unpack(entry):
+        deps = entry.get('deps')
+        if deps is not None:
+            deps = [tuple(dep) for dep in deps]
+        return [tuple(imp) for imp in entry['imports']], deps
+
+    def _entry(self, filepath, deps):
+        entry = self._entries.get(self._key(filepath))
+        if entry is None or (deps and entry.get('deps') is None):
+            return None
+        return entry
+
+    def get(self, filepath, stat, deps=False):
+        """Return the cached ``(imports, deps)`` of ``filepath`` if its
+        ``os.stat()`` result matches the cache entry (and, if ``deps``, the
+        entry has dependencies), or None.
+        """
+        entry = self._entry(filepath, deps)
+        if (entry is not None and entry['mtime_ns'] == stat.st_mtime_ns and
+                entry['size'] == stat.st_size):
+            self.hits += 1
+            return self._unpack(entry)
+        return None
+
+    def digest(self, filepath, deps=False):
+        """Return the content hash stored for ``filepath`` (if, when
+        ``deps``, the entry has dependencies), or None.
+        """
+        entry = self._entry(filepath, deps)
+        return entry['digest'] if entry is not None else None
+
+    def put(self, filepath, stat, digest, file_imports, file_deps=None):
+        """Store the results of ``scan_file`` for ``filepath`` and return
+        them as ``(imports, deps)``.
+        """
+        old_entry = self._entries.get(self._key(filepath), {})
+        if file_imports is None:
+            # Content is unchanged; only the stat result needs refreshing
+            self.hits += 1
+            file_imports = old_entry['imports']
+            file_deps = old_entry.get('deps')
+        self._entries[self._key(filepath)] = {
+            'mtime_ns': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'digest': digest,
+            'imports': file_imports,
+            'deps': file_deps,
+        }
+        return self._unpack(self._entries[self._key(filepath)])
+
+    def save(self):
+        # A temporary file of our own, as other runs may be saving the cache
+        fd, tmp_path = tempfile.mkstemp(
+            suffix='.tmp', dir=os.path.dirname(os.path.abspath(self.path)))
+        with open(fd, 'w', encoding='utf-8') as fp:
+            json.dump(self._entries, fp)
+        os.replace(tmp_path, self.path)
+
+
+
+def read_source(filepath, data):
+    """Return the Python source code in ``data`` (the bytes of the file at
+    ``filepath``), extracting code cells from Jupyter notebooks and dropping
+    IPython magics / shell commands.
+    """
+    contents = ''
+    if filepath.lower().endswith('.ipynb'):
+        nb_json = json.loads(data.decode('utf-8'))
+        for cell in nb_json['cells']:
+            if cell['cell_type'] == 'code':
+                cell_src = ''.join([s for s in cell['source']
+                                    if s[0] not in ('!', '%', '?')])
+                if not cell_src.startswith('%%'):
+                    contents += cell_src + '\n'
+    else:
+        contents = data.decode('utf-8')
+    # Remove lines that start with '%' or '!'
+    if re.search(r'\n\s*%[a-zA-Z]', contents):
+        contents = re.sub(r'\n\s*%[a-zA-Z][^\n]*', '', contents)
+    if re.search(r'\n\s*!', contents):
+        contents = re.sub(r'\n\s*![^\n]*', '', contents)
+    return contents
+
+
+
+# Comments, strings, line continuations and import keywords, in the order the
+# fast extractor needs to tell them apart (no named groups, which slow it down)
+_TOKEN_RE = re.compile(r'''
+    \#[^\n]*
+  | """[^"\\]*(?:(?:\\[\s\S]|"(?!""))[^"\\]*)*"""
+  | \'\'\'[^'\\]*(?:(?:\\[\s\S]|'(?!''))[^'\\]*)*\'\'\'
+  | "[^"\\\n]*(?:\\[\s\S][^"\\\n]*)*"
+  | '[^'\\\n]*(?:\\[\s\S][^'\\\n]*)*'
+  | \\\n
+  | (?:import|from)\b
+''', re.VERBOSE)
+_IMPORT_RE = re.compile(r'import[ \t]+([\w. \t,]+?)[ \t]*(?:#[^\n]*)?$', re.M)
+_IMPORT_NAME_RE = re.compile(r'([\w.]+)(?:[ \t]+as[ \t]+\w+)?$')
+_FROM_RE = re.compile(r'from[ \t]+(\.*)[ \t]*([\w.]*)[ \t]+import\b')
+
+
+
+def extract_imports_fast(contents):
+    """Return the ``(module, lineno, col_offset)`` tuples of the imports in
+    Python source ``contents``, in source order like the ``ImportLister``
+    path, by scanning it with regular expressions instead of building an AST.
+
+    Return None if the source has constructs the scanner does not handle
+    (e.g. imports after ``;`` or ``:``, or split over several lines), in
+    which case the AST path should be used. Unlike the AST path, syntax
+    errors elsewhere in the file are not detected.
+    """
+    if 'import' not in contents:
+        return []
+    if '\r' in contents:
+        return None
+    found = []
+    depth = 0
+    pending_from = False
+    continued_pos = -1
+    lineno, lineno_pos = 1, 0
+    code_pos = 0
+    for match in _TOKEN_RE.finditer(contents):
+        # Track bracket depth in the code between strings and comments
+        code = contents[code_pos:match.start()]
+        code_pos = match.end()
+        depth += (code.count('(') + code.count('[') + code.count('{') -
+                  code.count(')') - code.count(']') - code.count('}'))
+        first = match.group()[0]
+        if first == '\\':
+            continued_pos = match.end()
+        elif first in 'if':
+            pos = match.start()
+            if pos and (contents[pos - 1].isalnum() or
+                        contents[pos - 1] in '_.'):
+                # Part of a longer name, e.g. ``reimport``
+                continue
+            line_start = contents.rfind('\n', 0, pos) + 1
+            at_start = (depth == 0 and line_start != continued_pos and
+                        not contents[line_start:pos].strip())
+            keyword = match.group()
+            if keyword == 'from' and not at_start:
+                # e.g. ``yield from``/``raise ... from``
+                continue
+            if keyword == 'import' and pending_from:
+                pending_from = False
+                continue
+            if not at_start:
+                return None
+
+            lineno += contents.count('\n', lineno_pos, pos)
+            lineno_pos = pos
+            col_offset = pos - line_start
+            if keyword == 'from':
+                stmt = _FROM_RE.match(contents, pos)
+                if stmt is None:
+                    return None
+                pending_from = True
+                level, module = stmt.groups()
+                if not level:
+                    if not module:
+                        return None
+                    found.append((module.split('.', 1)[0], lineno, col_offset))
+            else:
+                stmt = _IMPORT_RE.match(contents, pos)
+                if stmt is None:
+                    return None
+                for name in stmt.group(1).split(','):
+                    name = _IMPORT_NAME_RE.match(name.strip())
+                    if name is None:
+                        return None
+                    found.append((name.group(1).split('.', 1)[0], lineno,
+                                  col_offset))
+    return found
+
+
+
+def parse_source(contents):
+    """Return the AST of Python source ``contents``, or None if it has syntax
+    errors.
+    """
+    try:
+        return ast.parse(contents)
+    except SyntaxError as err:
+        logging.debug('%s: %s', err.__class__.__name__, err.msg)
+        return None
+
+
+
+def extract_imports(contents, tree=None):
+    """Return the ``(module, lineno, col_offset)`` tuples of the imports in
+    Python source ``contents`` (or its already parsed AST, ``tree``), found by
+    visiting its AST with an ``ImportLister``. Source with syntax errors has
+    no imports.
+    """
+    import_lister = ImportLister()
+    if tree is None:
+        tree = parse_source(contents)
+    if tree is not None:
+        import_lister.visit(tree)
+    return [(mod, lineno, col_offset)
+            for mod, _, lineno, col_offset in import_lister.imports.rows()]
+
+
+
+def extract_dependencies(tree):
+    """Return a ``(module, level, names)`` tuple for each import statement in
+    the AST ``tree``, with the full module name (empty for ``from . import
+    x``), the relative import level (0 for absolute imports) and, for
+    ``from`` imports, the imported names.
+    """
+    deps = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            deps.extend((alias.name, 0, []) for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            deps.append((node.module or '', node.level,
+                         [alias.name for alias in node.names]))
+    return deps
+
+
+
+def scan_file(filepath, known_digest=None, fast=False, deps=False):
+    """Return ``(digest, imports, deps)`` for the file at ``filepath``, where
+    ``imports`` is a list of ``(module, lineno, col_offset)`` tuples and, if
+    ``deps`` is true, ``deps`` is as returned by ``extract_dependencies``
+    (else None). If the content hash equals ``known_digest``, the file is not
+    parsed and ``imports`` is None. If ``fast`` (and not ``deps``), try
+    ``extract_imports_fast`` first.
+    """
+    with open(filepath, 'rb') as fp:
+        data = fp.read()
+    digest = hashlib.sha1(data).hexdigest()
+    if digest == known_digest:
+        return digest, None, None
+
+    logging.debug('Parsing %s', filepath)
+    contents = read_source(filepath, data)
+    file_imports = extract_imports_fast(contents) if fast and not deps else None
+    file_deps = None
+    if file_imports is None:
+        tree = parse_source(contents)
+        file_imports = extract_imports(contents, tree)
+        if deps:
+            file_deps = extract_dependencies(tree) if tree is not None else []
+    return digest, file_imports, file_deps
+
+
+
+def _scan_batch(batch):
+    return [scan_file(*args) for args in batch]
+
+
+
+def _iter_scan_results(filepaths, cache=None, jobs=1, fast=False, deps=False,
+                       batch_size=16):
+    """Yield ``(filepath, imports, deps)`` for each existing file in
+    ``filepaths`` (any iterable), in order, as soon as its imports are known
+    (see ``scan_file`` for the arguments and results). With
+    ``jobs > 1``, uncached files are sent to a process pool in batches of
+    up to ``batch_size`` (a cached file ends the current batch) while
+    ``filepaths`` is still being consumed, with at most ``4 * jobs`` batches
+    in flight.
+    """
+    executor = ProcessPoolExecutor(jobs) if jobs > 1 else None
+    # Entries are [filepaths, stats, results] (as returned by ``scan_file``,
+    # with a digest of None if cached) or [filepaths, stats, scan_file
+    # arguments, future]
+    pending = deque()
+    open_batch = None
+    n_in_flight = 0
+
+    def finish(entry):
+        filepaths, stats, results = entry[:3]
+        if len(entry) == 4:
+            results = entry[3].result()
+        for filepath, stat, (digest, file_imports, file_deps) in zip(
+                filepaths, stats, results):
+            if digest is not None and cache is not None:
+                file_imports, file_deps = cache.put(filepath, stat, digest,
+                                                    file_imports, file_deps)
+            yield filepath, file_imports, file_deps
+
+    try:
+        for filepath in filepaths:
+            if not os.path.isfile(filepath):
+                continue
+            stat = cached = known_digest = None
+            if cache is not None:
+                stat = os.stat(filepath)
+                cached = cache.get(filepath, stat, deps)
+                known_digest = cache.digest(filepath, deps)
+            if cached is not None:
+                if open_batch is not None:
+                    # Later files must not be added to a batch queued
+                    # before this one
+                    open_batch.append(executor.submit(_scan_batch, open_batch[2]))
+                    open_batch = None
+                    n_in_flight += 1
+                pending.append([[filepath], [stat], [(None,) + cached]])
+            elif executor is None:
+                pending.append([[filepath], [stat],
+                                [scan_file(filepath, known_digest, fast, deps)]])
+            else:
+                if open_batch is None:
+                    open_batch = [[], [], []]
+                    pending.append(open_batch)
+                open_batch[0].append(filepath)
+                open_batch[1].append(stat)
+                open_batch[2].append((filepath, known_digest, fast, deps))
+                if len(open_batch[0]) == batch_size:
+                    open_batch.append(executor.submit(_scan_batch, open_batch[2]))
+                    open_batch = None
+                    n_in_flight += 1
+
+            while pending and pending[0] is not open_batch:
+                entry = pending[0]
+                if len(entry) == 4:
+                    if not entry[3].done() and n_in_flight <= 4 * jobs:
+                        break
+                    n_in_flight -= 1
+                pending.popleft()
+                for res in finish(entry):
+                    yield res
+
+        if open_batch is not None:
+            open_batch.append(executor.submit(_scan_batch, open_batch[2]))
+        while pending:
+            for res in finish(pending.popleft()):
+                yield res
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+
+def scan_files(filepaths, import_lister, cache=None, jobs=1, fast=False,
+               graph=None):
+    """Collect the imports of every file in ``filepaths`` (any iterable, e.g.
+    the ``get_filepaths`` generator) into ``import_lister``, in order,
+    reusing ``cache`` (an ``ImportCache``) entries for unchanged files and
+    parsing the others on ``jobs`` processes (with
+    ``scan_file(..., fast=fast)``). If ``graph`` (an ``ImportGraph``) is
+    given, also add each file's dependencies to it. Return the number of
+    files scanned.
+    """
+    n_files = 0
+    for filepath, file_imports, file_deps in _iter_scan_results(
+            filepaths, cache, jobs, fast, deps=graph is not None):
+        import_lister.add_file_imports(filepath, file_imports)
+        if graph is not None:
+            graph.add_file(filepath, file_deps)
+        n_files += 1
+    return n_files
+
+
+
+def _gitignore_regex(pattern):
+    """Return a compiled regex matching the paths (relative to the directory
+    of the ``.gitignore`` file) that gitignore ``pattern`` matches: ``*`` and
+    ``?`` do not match ``/``, while ``**/`` matches any number of
+    directories and a trailing ``/**`` everything inside a directory.
+    """
+    parts = []
+    i, n = 0, len(pattern)
+    while i < n:
+        if pattern.startswith('**/', i) and (i == 0 or pattern[i - 1] == '/'):
+            parts.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('**', i) and i + 2 == n and (i == 0 or pattern[i - 1] == '/'):
+            parts.append('.*')
+            i += 2
+        elif pattern[i] == '*':
+            parts.append('[^/]*')
+            i += 1
+        elif pattern[i] == '?':
+            parts.append('[^/]')
+            i += 1
+        elif pattern[i] == '\\' and i + 1 < n:
+            parts.append(re.escape(pattern[i + 1]))
+            i += 2
+        elif pattern[i] == '[':
+            # A "]" right after "[", "[!" or "[^" is part of the set
+            end = i + 2 if pattern.startswith(('[!', '[^'), i) else i + 1
+            end = pattern.find(']', end + 1 if pattern.startswith(']', end) else end)
+            if end < 0:
+                parts.append(re.escape('['))
+                i += 1
+                continue
+            chars = pattern[i + 1:end].replace('\\', '\\\\').replace('[', '\\[')
+            if chars.startswith(('!', '^')):
+                chars = '^' + chars[1:]
+            parts.append('(?!/)[' + chars + ']')
+            i = end + 1
+        else:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+    return re.compile('(?s:' + ''.join(parts) + r')\Z')
+
 
 
-def get_filepaths(files_or_directories):
-    """Return a list of file paths which represent all Python scripts and
-    Jupyter notebooks that reside in given list of files/directories,
-    ``files_or_directories``.
+class IgnoreRules(object):
+    """Ordered gitignore-style patterns, each relative to the directory it
+    came from. The last pattern that matches a path decides whether it is
+    ignored (patterns starting with ``!`` un-ignore).
+    """
+    def __init__(self, rules=()):
+        self._rules = tuple(rules)
+
+    def extended(self, base_dpath, lines):
+        """Return new ``IgnoreRules`` with ``lines`` (in ``.gitignore``
+        syntax, relative to ``base_dpath``) appended.
+        """
+        rules = list(self._rules)
+        for line in lines:
+            line = line.rstrip('\n')
+            if not line.strip() or line.startswith('#'):
+                continue
+            negate = line.startswith('!')
+            pattern = line[1:] if negate else line
+            dir_only = pattern.endswith('/')
+            pattern = pattern.rstrip('/')
+            if pattern.startswith('**/') and '/' not in pattern[3:]:
+                pattern = pattern[3:]
+            anchored = '/' in pattern
+            rules.append((base_dpath, _gitignore_regex(pattern.lstrip('/')),
+                          negate, dir_only, anchored))
+        return IgnoreRules(rules)
+
+    def extended_from_file(self, dpath):
+        """Return new ``IgnoreRules`` with the patterns of ``dpath``'s
+        ``.gitignore`` appended, if it has one.
+        """
+        gitignore_fpath = os.path.join(dpath, '.gitignore')
+        if not os.path.isfile(gitignore_fpath):
+            return self
+        with open(gitignore_fpath, 'r', encoding='utf-8', errors='replace') as fp:
+            return self.extended(dpath, fp)
+
+    def is_ignored(self, path, is_dir):
+        ignored = False
+        name = os.path.basename(path)
+        for base_dpath, regex, negate, dir_only, anchored in self._rules:
+            if ignored == (not negate) or (dir_only and not is_dir):
+                continue
+            if anchored:
+                rel_path = os.path.relpath(path, base_dpath).replace(os.sep, '/')
+                matched = regex.match(rel_path)
+            else:
+                matched = regex.match(name)
+            if matched:
+                ignored = not negate
+        return ignored
+
+
+
+def _is_environment(dpath):
+    """Return whether ``dpath`` is a virtualenv or conda environment.
+    """
+    return (os.path.isfile(os.path.join(dpath, 'pyvenv.cfg')) or
+            os.path.isdir(os.path.join(dpath, 'conda-meta')))
+
+
+
+def _ancestor_rules(dpath, rules):
+    """Return ``rules`` extended with the ``.gitignore`` files of the
+    ancestors of ``dpath``, up to the root of its git repository (if any).
+    """
+    ancestors = []
+    parent_dpath = os.path.abspath(dpath)
+    while True:
+        if os.path.exists(os.path.join(parent_dpath, '.git')):
+            break
+        next_dpath = os.path.dirname(parent_dpath)
+        if next_dpath == parent_dpath:
+            # Not in a git repository
+            return rules
+        parent_dpath = next_dpath
+        ancestors.append(parent_dpath)
+    for ancestor_dpath in reversed(ancestors):
+        rules = rules.extended_from_file(ancestor_dpath)
+    return rules
+
+
+
+def get_filepaths(files_or_directories, excludes=(), use_ignores=True):
+    """Yield the file paths of all Python scripts and Jupyter notebooks that
+    reside in given list of files/directories, ``files_or_directories``, as
+    they are found.
+
+    Directories are scanned with ``os.scandir`` (in ``os.walk`` order), and
+    paths matching ``excludes`` (gitignore-style patterns, relative to each
+    directory given) are pruned. If ``use_ignores``, also prune
+    ``DEFAULT_EXCLUDES``, virtualenvs / conda environments, and paths
+    ignored by ``.gitignore`` files.
     """
-    filepaths = []
     for thing in files_or_directories:
         isfile = os.path.isfile(thing)
         assert isfile or os.path.isdir(thing), (
@@ -80,39 +709,373 @@ def get_filepaths(files_or_directories):
         )
 
         if isfile:
-            filepaths.append(thing)
-        else:
-            for root, _, filenames in os.walk(thing):
-                for filename in filenames:
-                    ext = os.path.splitext(filename.lower())[-1]
-                    if ext in ('.py', '.ipynb'):
-                        filepaths.append(os.path.join(root, filename))
+            yield thing
+            continue
+
+        rules = IgnoreRules()
+        if use_ignores:
+            rules = _ancestor_rules(thing, rules.extended(thing, DEFAULT_EXCLUDES))
+        rules = rules.extended(thing, excludes)
+        stack = [(thing, rules)]
+        while stack:
+            dpath, rules = stack.pop()
+            try:
+                entries = list(os.scandir(dpath))
+            except OSError as err:
+                logging.debug('%s: %s', err.__class__.__name__, err)
+                continue
+            if use_ignores and any(entry.name == '.gitignore' for entry in entries):
+                rules = rules.extended_from_file(dpath)
+            subdirs = []
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if rules.is_ignored(entry.path, is_dir):
+                    continue
+                if is_dir:
+                    if not entry.is_symlink() and not (
+                            use_ignores and _is_environment(entry.path)):
+                        subdirs.append(entry.path)
+                    continue
+                ext = os.path.splitext(entry.name.lower())[-1]
+                if ext in ('.py', '.ipynb'):
+                    yield entry.path
+            stack.extend((subdir, rules) for subdir in reversed(subdirs))
+
+
+
+class ModuleIndex(object):
+    """Index of the top-level modules importable from each ``sys.path`` entry,
+    persisted as JSON (by default in the user's cache directory, one file
+    per ``sys.prefix``). An entry is only rescanned when its mtime changes,
+    e.g. when a package is installed into or removed from it.
+    """
+    # Builtin and standard library modules (the latter from Python 3.10)
+    STDLIB_MODULES = frozenset(sys.builtin_module_names).union(
+        getattr(sys, 'stdlib_module_names', ()))
+
+    def __init__(self, path=None):
+        self.path = path or self.default_path()
+        self.n_rescanned = 0
+        self._entries = self._load()
+        self._modules = set(sys.builtin_module_names)
+        self._update()
+
+    @staticmethod
+    def default_path():
+        cache_dpath = (os.environ.get('XDG_CACHE_HOME') or
+                       os.path.join(os.path.expanduser('~'), '.cache'))
+        prefix_hash = hashlib.sha1(sys.prefix.encode('utf-8')).hexdigest()[:12]
+        return os.path.join(cache_dpath, 'import_utils',
+                            'modules-{}.json'.format(prefix_hash))
+
+    @property
+    def modules(self):
+        """Set of the top-level module names that can be imported.
+        """
+        return self._modules
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as fp:
+                data = json.load(fp)
+        except (OSError, ValueError):
+            return {}
+        if data.get('prefix') != sys.prefix:
+            return {}
+        return data['entries']
+
+    def _save(self):
+        try:
+            dpath = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(dpath, exist_ok=True)
+            # A temporary file of our own, as other runs may be saving the
+            # index
+            fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=dpath)
+            with open(fd, 'w', encoding='utf-8') as fp:
+                json.dump({'prefix': sys.prefix, 'entries': self._entries}, fp)
+            os.replace(tmp_path, self.path)
+        except OSError as err:
+            logging.debug('Could not save module index: %s', err)
+
+    @staticmethod
+    def _mtime(entry):
+        try:
+            return os.stat(entry or os.curdir).st_mtime_ns
+        except OSError:
+            return None
+
+    @staticmethod
+    def _scan_entry(entry):
+        return sorted(name for _, name, _ in pkgutil.iter_modules([entry]))
+
+    def _update(self):
+        entries = {}
+        for entry in sys.path:
+            mtime = self._mtime(entry)
+            cached = self._entries.get(entry)
+            if cached is None or cached['mtime_ns'] != mtime:
+                logging.debug('Indexing modules in "%s"', entry)
+                self.n_rescanned += 1
+                cached = {
+                    'mtime_ns': mtime,
+                    'modules': self._scan_entry(entry) if mtime is not None else [],
+                }
+            entries[entry] = cached
+        if self.n_rescanned or set(entries) != set(self._entries):
+            self._entries = entries
+            self._save()
+        for entry in entries.values():
+            self._modules.update(entry['modules'])
+
+
+
+class ImportGraph(object):
+    """Graph of the modules in the scanned tree, with an edge from each
+    module to every module (in the tree) that it imports. Module names are
+    derived from filepaths by walking up through packages (directories with
+    an ``__init__.py``); relative imports are resolved against them.
+    """
+    def __init__(self):
+        self.files = {}
+        self.roots = {}
+        self._packages = {}
+        self._deps = {}
+        self._edges = None
+
+    def _is_package(self, dpath):
+        if dpath not in self._packages:
+            self._packages[dpath] = os.path.isfile(os.path.join(dpath, '__init__.py'))
+        return self._packages[dpath]
+
+    def module_name(self, filepath):
+        """Return ``(module, is_package, root)``: the dotted module name of
+        ``filepath``, whether it is a package's ``__init__``, and the
+        directory it can be imported from.
+        """
+        dpath, filename = os.path.split(os.path.abspath(filepath))
+        stem = os.path.splitext(filename)[0]
+        is_package = stem == '__init__'
+        parts = [] if is_package else [stem]
+        while self._is_package(dpath):
+            parts.insert(0, os.path.basename(dpath))
+            dpath = os.path.dirname(dpath)
+        return '.'.join(parts), is_package, dpath
+
+    def add_file(self, filepath, file_deps):
+        """Add the module at ``filepath``, with its dependencies as returned
+        by ``extract_dependencies``.
+        """
+        module, is_package, root = self.module_name(filepath)
+        if module in self.files:
+            logging.debug('Module %s found at both %s and %s', module,
+                          self.files[module], filepath)
+        self.files[module] = filepath
+        self.roots[module] = root
+        self._deps[module] = (is_package, file_deps)
+        self._edges = None
+
+    def _resolve(self, module, is_package, dep):
+        """Return the modules in the tree that are imported by ``dep`` (a
+        ``(module, level, names)`` tuple) in ``module``.
+        """
+        name, level, names = dep
+        if level:
+            base = module.split('.')
+            if not is_package:
+                base.pop()
+            if level - 1 > len(base):
+                return []
+            base = base[:len(base) - (level - 1)]
+            name = '.'.join(base + ([name] if name else []))
+        targets = []
+        parts = name.split('.')
+        # Importing a submodule imports its parent packages too
+        for i in range(1, len(parts) + 1):
+            prefix = '.'.join(parts[:i])
+            if prefix in self.files:
+                targets.append(prefix)
+        for imported in names:
+            submodule = name + '.' + imported if name else imported
+            if submodule in self.files:
+                targets.append(submodule)
+        return targets
+
+    @property
+    def edges(self):
+        """Dict mapping each module to the set of modules it imports.
+        """
+        if self._edges is None:
+            self._edges = {}
+            for module, (is_package, file_deps) in self._deps.items():
+                targets = set()
+                for dep in file_deps:
+                    targets.update(self._resolve(module, is_package, dep))
+                targets.discard(module)
+                self._edges[module] = targets
+        return self._edges
+
+    def importers(self, module):
+        """Return the set of modules that (transitively) import ``module``.
+        """
+        reverse = dict((mod, []) for mod in self.edges)
+        for mod, targets in self.edges.items():
+            for target in targets:
+                reverse[target].append(mod)
+        found = set()
+        stack = [module]
+        while stack:
+            for importer in reverse.get(stack.pop(), ()):
+                if importer not in found:
+                    found.add(importer)
+                    stack.append(importer)
+        found.discard(module)
+        return found
 
-    return filepaths
+    def _components(self, start):
+        """Return the strongly connected components reachable from ``start``
+        (Tarjan's algorithm, iteratively), in reverse topological order.
+        """
+        edges = self.edges
+        index = {}
+        lowlink = {}
+        on_stack = set()
+        scc_stack = []
+        components = []
+        work = [(start, iter(sorted(edges.get(start, ()))))]
+        index[start] = lowlink[start] = 0
+        scc_stack.append(start)
+        on_stack.add(start)
+        while work:
+            node, children = work[-1]
+            for child in children:
+                if child not in index:
+                    index[child] = lowlink[child] = len(index)
+                    scc_stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(sorted(edges.get(child, ())))))
+                    break
+                if child in on_stack:
+                    lowlink[node] = min(lowlink[node], index[child])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = scc_stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(sorted(component))
+        return components
+
+    def critical_path(self, module, costs=None):
+        """Return the chain of imports starting at ``module`` with the largest
+        total cost, as a list of ``(modules, cost)`` tuples, where ``modules``
+        lists the members of an import cycle (usually just one module) and
+        ``cost`` sums their ``costs`` (a dict; 1 per module by default).
+        """
+        components = self._components(module)
+        component_of = {}
+        for i, component in enumerate(components):
+            for member in component:
+                component_of[member] = i
+        cost_of = lambda mod: costs.get(mod, 0) if costs is not None else 1
+        best = [0] * len(components)
+        next_component = [None] * len(components)
+        # Successors come before their importers in ``components``
+        for i, component in enumerate(components):
+            successors = set(component_of[target] for member in component
+                             for target in self.edges.get(member, ())) - {i}
+            if successors:
+                next_component[i] = max(successors, key=lambda j: best[j])
+                best[i] = best[next_component[i]]
+            best[i] += sum(cost_of(member) for member in component)
+
+        path = []
+        i = component_of[module]
+        while i is not None:
+            path.append((components[i],
+                         sum(cost_of(member) for member in components[i])))
+            i = next_component[i]
+        return path
 
+    def import_times(self, module):
+        """Import ``module`` in a subprocess with ``python -X importtime`` and
+        return a dict mapping each module imported to its cost (in
+        microseconds): its own import time, plus the cumulative time of the
+        modules outside the tree that it imported first.
+        """
+        proc = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+            cwd=self.roots[module], stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE, universal_newlines=True)
+        costs = {}
+        # Children are printed before their parent, indented one level more
+        children = defaultdict(list)
+        for line in proc.stderr.splitlines():
+            match = re.match(r'import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$', line)
+            if match is None:
+                continue
+            self_us, cumulative_us, indent, name = match.groups()
+            depth = len(indent) // 2
+            cost = int(self_us)
+            for child, child_cumulative in children.pop(depth + 1, ()):
+                if child not in self.files:
+                    cost += child_cumulative
+            costs[name] = cost
+            children[depth].append((name, int(cumulative_us)))
+        if proc.returncode != 0:
+            logging.warning('Importing %s failed:\n%s', module, proc.stderr[-2000:])
+        return costs
 
 
-def collect_non_builtins(imports, exclude_installable):
-    """Return a subset of the given ``imports`` dict, optionally excluding
-    the modules that are already installed in the environment, and containing
-    a smaller amount of metadata (suitable for printing on STDOUT).
 
-    TODO: At some point, this function should also have a way to exclude
-    builtin modules.
+def collect_non_builtins(imports, exclude_installable, exclude_builtins=False,
+                         module_index=None):
+    """Return a dict mapping the module names in the given ``imports`` (an
+    ``ImportStore``) to a smaller amount of metadata (suitable for printing on
+    STDOUT), optionally excluding the modules that are already installed in
+    the environment (according to ``module_index``, a ``ModuleIndex`` which
+    is created if not given), and/or builtin and standard library modules.
     """
     non_builtin_mods = {}
-    installable_modules = set(list(sys.builtin_module_names) +
-                              [mod[1] for mod in pkgutil.iter_modules()])
+    excluded_modules = set()
+    if exclude_installable:
+        if module_index is None:
+            module_index = ModuleIndex()
+        excluded_modules |= module_index.modules
+    if exclude_builtins:
+        excluded_modules |= ModuleIndex.STDLIB_MODULES
 
-    for mod_import, metadata in imports.items():
-        if exclude_installable and mod_import in installable_modules:
-            continue
+    optional = {}
+    with imports.column('module_id') as module_ids, \
+            imports.column('path_id') as path_ids, \
+            imports.column('lineno') as linenos, \
+            imports.column('col_offset') as col_offsets:
+        for module_id, col_offset in zip(module_ids, col_offsets):
+            if col_offset == 0:
+                optional[module_id] = False
+            else:
+                optional.setdefault(module_id, True)
 
-        required = any(map(lambda meta: meta[2] == 0, metadata))
-        if required:
-            non_builtin_mods[mod_import] = {}
-        else:
-            non_builtin_mods[mod_import] = filter(lambda meta: meta[2] > 0, metadata)
+        for module_id, is_optional in optional.items():
+            mod_import = imports.modules[module_id]
+            if mod_import in excluded_modules:
+                continue
+            non_builtin_mods[mod_import] = [] if is_optional else {}
+
+        for module_id, path_id, lineno, col_offset in zip(
+                module_ids, path_ids, linenos, col_offsets):
+            metadata = non_builtin_mods.get(imports.modules[module_id])
+            if isinstance(metadata, list):
+                metadata.append((imports.paths[path_id], lineno, col_offset))
 
     return non_builtin_mods
 
@@ -130,6 +1093,74 @@ def display_imports(mods_to_display):
 
 
 
+def display_graph(graph, args):
+    """Print the parts of ``graph`` (an ``ImportGraph``) requested by the
+    ``-g``, ``--importers`` and ``--critical-path`` command-line ``args``.
+    The ``--critical-path`` module must be in ``graph``.
+    """
+    if args.graph:
+        print('Import graph ({} modules):'.format(len(graph.edges)))
+        for module in sorted(graph.edges):
+            print('    {} -> {}'.format(module, ', '.join(sorted(graph.edges[module]))))
+
+    if args.importers:
+        importers = graph.importers(args.importers)
+        print('Modules importing {} ({}):'.format(args.importers, len(importers)))
+        for module in sorted(importers):
+            print('    {}'.format(module))
+
+    if args.critical_path:
+        costs = None
+        unit = 'modules'
+        if args.importtime:
+            costs = graph.import_times(args.critical_path)
+            unit = 'us'
+        path = graph.critical_path(args.critical_path, costs)
+        print('Critical path from {} ({} {}):'.format(
+            args.critical_path, sum(cost for _, cost in path), unit))
+        cumulative = 0
+        for modules, cost in path:
+            cumulative += cost
+            print('    {:>10} {:>10}  {}'.format(cost, cumulative, ' <-> '.join(modules)))
+
+
+
+def benchmark_extractors(filepaths):
+    """Time ``extract_imports`` against ``extract_imports_fast`` on the files
+    in ``filepaths``, check that their results agree, and print a summary.
+    Results can only differ for files with syntax errors.
+    """
+    sources = []
+    for filepath in filepaths:
+        with open(filepath, 'rb') as fp:
+            sources.append(read_source(filepath, fp.read()))
+
+    start = time.time()
+    ast_results = [extract_imports(contents) for contents in sources]
+    ast_time = time.time() - start
+
+    start = time.time()
+    fast_results = [extract_imports_fast(contents) for contents in sources]
+    n_fallbacks = sum(res is None for res in fast_results)
+    fast_results = [extract_imports(contents) if res is None else res
+                    for contents, res in zip(sources, fast_results)]
+    fast_time = time.time() - start
+
+    n_mismatches = 0
+    for filepath, ast_res, fast_res in zip(filepaths, ast_results, fast_results):
+        if ast_res != fast_res:
+            n_mismatches += 1
+            logging.warning('Results differ for %s', filepath)
+    n_bytes = sum(map(len, sources))
+    print('Files: {}, source size: {} bytes'.format(len(sources), n_bytes))
+    for name, elapsed in (('ast', ast_time), ('fast', fast_time)):
+        print('    {:5} {:8.3f}s {:10.0f} files/s {:8.2f} MB/s'.format(
+            name, elapsed, len(sources) / elapsed, n_bytes / elapsed / 1e6))
+    print('Fast path fell back to AST for {} files; {} results differ'.format(
+        n_fallbacks, n_mismatches))
+
+
+
 def main(argv):
     """Main function.
     """
@@ -141,6 +1172,55 @@ def main(argv):
         'Exclude installed libraries / all modules which can already be '
         'imported'
     ))
+    parser.add_argument('-B', '--exclude-builtins', action='store_true', help=(
+        'Exclude builtin and standard library modules'
+    ))
+    parser.add_argument('--module-index', help=(
+        'JSON file in which to cache the index of installed modules used by '
+        '-x (default: {})'.format(ModuleIndex.default_path())
+    ))
+    parser.add_argument('-e', '--exclude', action='append', default=[], help=(
+        'Skip files/directories matching this .gitignore-style pattern '
+        '(can be repeated)'
+    ))
+    parser.add_argument('--no-ignore', action='store_true', help=(
+        'Do not skip .gitignore\'d paths, virtualenvs, or the usual VCS / '
+        'build / cache directories'
+    ))
+    parser.add_argument('-j', '--jobs', type=int, default=1, help=(
+        'Number of processes used to parse files (default: %(default)s)'
+    ))
+    parser.add_argument('-c', '--cache', help=(
+        'JSON file in which to cache the imports found in each file, so '
+        'that unchanged files are not parsed again'
+    ))
+    parser.add_argument('-f', '--fast', action='store_true', help=(
+        'Find imports with a regular-expression scanner, only building an '
+        'AST for files it cannot handle'
+    ))
+    parser.add_argument('-o', '--output', help=(
+        'Also export every import occurrence found to this file (.json, '
+        '.csv, or .parquet, which requires pyarrow)'
+    ))
+    parser.add_argument('-g', '--graph', action='store_true', help=(
+        'Print the import graph between the modules found (resolving '
+        'absolute and relative imports) instead of listing imports'
+    ))
+    parser.add_argument('--importers', metavar='MODULE', help=(
+        'Print the modules found that (transitively) import MODULE'
+    ))
+    parser.add_argument('--critical-path', metavar='MODULE', help=(
+        'Print the chain of imports from MODULE that is the deepest, or the '
+        'slowest with --importtime'
+    ))
+    parser.add_argument('--importtime', action='store_true', help=(
+        'Measure the cost of each module for --critical-path by importing '
+        'MODULE with "python -X importtime" in a subprocess'
+    ))
+    parser.add_argument('-b', '--benchmark', action='store_true', help=(
+        'Compare the speed and results of the AST and fast (-f) import '
+        'extractors instead of listing imports'
+    ))
     parser.add_argument('-d', '--debug', action='store_true', help=(
         'Print debugging statements'
     ))
@@ -149,43 +1229,47 @@ def main(argv):
     # Set logging level
     logging.basicConfig(level=(logging.DEBUG if args.debug else logging.INFO))
 
-    filepaths = get_filepaths(args.file_or_directory)
+    filepaths = get_filepaths(args.file_or_directory, excludes=args.exclude,
+                              use_ignores=not args.no_ignore)
 
-    logging.debug('Parsing {} files...'.format(len(filepaths)))
+    if args.benchmark:
+        benchmark_extractors([fp for fp in filepaths if os.path.isfile(fp)])
+        return
 
+    cache = ImportCache(args.cache) if args.cache else None
     import_lister = ImportLister()
-    for filepath in filepaths:
-        import_lister.filepath = filepath
-        if not os.path.isfile(filepath):
-            continue
-        with open(filepath, 'rU', encoding='utf-8') as fp:
-            logging.debug('Parsing %s', filepath)
-            contents = ''
-            if filepath.lower().endswith('.ipynb'):
-                nb_json = json.load(fp)
-                for cell in nb_json['cells']:
-                    if cell['cell_type'] == 'code':
-                        cell_src = ''.join([s for s in cell['source']
-                                            if s[0] not in ('!', '%', '?')])
-                        if not cell_src.startswith('%%'):
-                            contents += cell_src + '\n'
-            else:
-                contents = fp.read()
-            # Remove lines that start with '%' or '!'
-            if re.search(r'\n\s*%[a-zA-Z]', contents):
-                contents = re.sub(r'\n\s*%[a-zA-Z][^\n]*', '', contents)
-            if re.search(r'\n\s*!', contents):
-                contents = re.sub(r'\n\s*![^\n]*', '', contents)
-            try:
-                tree = ast.parse(contents)
-            except SyntaxError as err:
-                logging.debug('%s: %s', err.__class__.__name__, err.msg)
-            import_lister.visit(tree)
+    graph = None
+    if args.graph or args.importers or args.critical_path:
+        graph = ImportGraph()
+    start = time.time()
+    n_files = scan_files(filepaths, import_lister, cache=cache, jobs=args.jobs,
+                         fast=args.fast, graph=graph)
+    if cache is not None:
+        cache.save()
+    logging.info('Scanned {} files ({} cached) in {:.3f}s'.format(
+        n_files, cache.hits if cache is not None else 0, time.time() - start))
+
+    if graph is not None:
+        if args.critical_path and args.critical_path not in graph.files:
+            parser.error('module "{}" was not found in the files scanned'.format(
+                args.critical_path))
+        display_graph(graph, args)
+        return
 
     imports = import_lister.imports
-    logging.debug('Found {} imports...'.format(sum(map(len, imports.values()))))
+    logging.debug('Found {} imports...'.format(len(imports)))
+    if args.output is not None:
+        imports.export(args.output)
 
-    mods_to_display = collect_non_builtins(imports, args.exclude_installed)
+    module_index = None
+    if args.exclude_installed:
+        start = time.time()
+        module_index = ModuleIndex(args.module_index)
+        logging.debug('Indexed installed modules ({} sys.path entries '
+                      'rescanned) in {:.3f}s'.format(module_index.n_rescanned,
+                                                     time.time() - start))
+    mods_to_display = collect_non_builtins(imports, args.exclude_installed,
+                                           args.exclude_builtins, module_index)
 
     if mods_to_display:
         display_imports(mods_to_display)
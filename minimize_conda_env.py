@@ -14,11 +14,31 @@ from __future__ import (absolute_import, division, print_function,
 import sys
 import os
 import argparse
+import glob
+import hashlib
+import io
+import json
+import multiprocessing
+import re
 import subprocess
-from collections import defaultdict
+import tempfile
+from collections import Counter, defaultdict, deque
 
 import yaml
-import graphviz as gv
+
+
+CACHE_DPATH = os.path.join(os.path.expanduser('~'), '.cache', 'minimize_conda_env')
+# Formats of the dependency graph: DOT and JSON are written directly, the
+# others are rendered by graphviz
+GRAPH_FORMATS = ('dot', 'json', 'png', 'svg', 'pdf')
+# link.source and url in a conda-meta file, whose keys are sorted: "url" is
+# always among the last ones, and so is "link" unless it is followed by the
+# long "paths_data" list
+LINK_SOURCE_RE = re.compile(br'"link":\s*\{[^{}]*?"source":\s*("(?:[^"\\]|\\.)*")')
+URL_RE = re.compile(br'"url":\s*("(?:[^"\\]|\\.)*")')
+CONDA_META_TAIL_SIZE = 1 << 12
+# Channels which "defaults" stands for
+DEFAULT_CHANNELS = ('pkgs/main', 'pkgs/r', 'pkgs/msys2', 'pkgs/free', 'pkgs/pro')
 
 
 class PackageSpec(object):
@@ -26,6 +46,8 @@ class PackageSpec(object):
         self.name = name
         self.version = version
         self.from_pip = from_pip
+        self._path = None
+        self._channel = None
         self._deps = None
 
     @property
@@ -67,6 +89,27 @@ class PackageSpec(object):
                 constraints = dep[1:]
             self._deps[name] = tuple(constraints)
 
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'version': self.version,
+            'from_pip': self.from_pip,
+            'path': self._path,
+            'channel': self._channel,
+            'deps': self._deps,
+        }
+
+    @classmethod
+    def from_dict(cls, spec_dict):
+        pkgspec = cls(spec_dict['name'], spec_dict['version'],
+                      from_pip=spec_dict['from_pip'])
+        pkgspec._path = spec_dict['path']
+        pkgspec._channel = spec_dict['channel']
+        if spec_dict['deps'] is not None:
+            pkgspec._deps = dict((name, tuple(constraints)) for name, constraints
+                                 in spec_dict['deps'].items())
+        return pkgspec
+
     def __repr__(self):
         return ('PackageSpec<'
                 'name: "{}", '
@@ -86,10 +129,9 @@ def parse_deps(env):
         env_name = pkgs['name']
     else:
         env_name = env
-        out_fd = subprocess.Popen(['conda', 'env', 'export', '-n', env_name],
-                                  universal_newlines=True,
-                                  stdout=subprocess.PIPE)
-        pkgs = yaml.safe_load(out_fd.stdout)
+        out = subprocess.check_output(['conda', 'env', 'export', '-n', env_name],
+                                      universal_newlines=True)
+        pkgs = yaml.safe_load(out)
     deps = pkgs['dependencies']
     channels = pkgs['channels']
     conda_meta_dpath = os.path.join(pkgs['prefix'], 'conda-meta')
@@ -113,75 +155,847 @@ def parse_deps(env):
     return all_deps, conda_meta_dpath, channels, env_name
 
 
-def update_deps_with_conda_meta(env_name, conda_meta_dpath, all_deps):
+def conda_root_prefix():
+    """Prefix of the base environment, or None if it cannot be found without
+    running conda.
+    """
+    if os.environ.get('CONDA_ROOT'):
+        return os.environ['CONDA_ROOT']
+    for var in ('CONDA_EXE', 'CONDA_PYTHON_EXE'):
+        if os.environ.get(var):
+            return os.path.dirname(os.path.dirname(os.environ[var]))
+    # conda is either in bin/ (Scripts\ on Windows) or condabin/ of the prefix
+    for dpath in os.environ.get('PATH', '').split(os.pathsep):
+        for filename in ('conda', 'conda.exe', 'conda.bat'):
+            if os.path.isfile(os.path.join(dpath, filename)):
+                return os.path.dirname(os.path.abspath(dpath))
+    prefix = sys.prefix
+    if os.path.basename(os.path.dirname(prefix)) == 'envs':
+        prefix = os.path.dirname(os.path.dirname(prefix))
+    if os.path.isdir(os.path.join(prefix, 'conda-meta')):
+        return prefix
+    return None
+
+
+def read_condarc(root_prefix=None):
+    """Merge the lists set in the .condarc files which apply to the current
+    user, highest priority first.
+    """
+    fpaths = [os.environ.get('CONDARC', ''),
+              os.path.join(os.path.expanduser('~'), '.condarc'),
+              os.path.join(os.path.expanduser('~'), '.config', 'conda', '.condarc')]
+    if root_prefix is not None:
+        fpaths.append(os.path.join(root_prefix, '.condarc'))
+    config = defaultdict(list)
+    for fpath in fpaths:
+        if not os.path.isfile(fpath):
+            continue
+        with open(fpath, 'r') as fp:
+            condarc = yaml.safe_load(fp) or {}
+        for key, value in condarc.items():
+            if isinstance(value, list):
+                config[key].extend(item for item in value
+                                   if item not in config[key])
+    return config
+
+
+def env_prefix(env, root_prefix=None, condarc=None):
+    """Find the prefix of the environment named ``env`` the way conda does:
+    in the envs directories, then in ~/.conda/environments.txt. ``env`` may
+    also be the prefix itself.
+    """
+    if os.path.isdir(os.path.join(env, 'conda-meta')):
+        return os.path.abspath(env)
+    if root_prefix is None:
+        root_prefix = conda_root_prefix()
+    if condarc is None:
+        condarc = read_condarc(root_prefix)
+    if env == 'base' and root_prefix is not None:
+        return root_prefix
+    envs_dpaths = [os.path.expanduser(dpath) for dpath in condarc['envs_dirs']]
+    for var in ('CONDA_ENVS_PATH', 'CONDA_ENVS_DIRS'):
+        envs_dpaths.extend(dpath for dpath in os.environ.get(var, '').split(os.pathsep)
+                           if dpath)
+    if root_prefix is not None:
+        envs_dpaths.append(os.path.join(root_prefix, 'envs'))
+    envs_dpaths.append(os.path.join(os.path.expanduser('~'), '.conda', 'envs'))
+    for envs_dpath in envs_dpaths:
+        prefix = os.path.join(envs_dpath, env)
+        if os.path.isdir(os.path.join(prefix, 'conda-meta')):
+            return prefix
+    environments_fpath = os.path.join(os.path.expanduser('~'), '.conda',
+                                      'environments.txt')
+    if os.path.isfile(environments_fpath):
+        with open(environments_fpath, 'r') as fp:
+            for line in fp:
+                prefix = line.strip()
+                if (os.path.basename(prefix) == env and
+                        os.path.isdir(os.path.join(prefix, 'conda-meta'))):
+                    return prefix
+    raise ValueError('Could not find conda environment "{}"'.format(env))
+
+
+def canonical_name(name):
+    """Name of a Python package as pip compares them (PEP 503), which is also
+    how conda names them in most cases.
+    """
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def read_pip_packages(prefix):
+    """Names, versions and *.dist-info directories of the packages installed
+    in the site-packages of ``prefix`` by pip rather than by conda.
+    """
+    pip_pkgs = []
+    for dist_info_dpath in sorted(
+            glob.glob(os.path.join(prefix, 'lib', 'python*', 'site-packages', '*.dist-info')) +
+            glob.glob(os.path.join(prefix, 'Lib', 'site-packages', '*.dist-info'))):
+        try:
+            with open(os.path.join(dist_info_dpath, 'INSTALLER'), 'r') as fp:
+                installer = fp.read().strip()
+        except (IOError, OSError):
+            installer = ''
+        if installer == 'conda':
+            continue
+        dirname = os.path.basename(dist_info_dpath)[:-len('.dist-info')]
+        name, _, version = dirname.partition('-')
+        pip_pkgs.append((canonical_name(name), version, dist_info_dpath))
+    return pip_pkgs
+
+
+def marker_holds(marker, environment=None):
+    """Whether the environment marker of a requirement (e.g.
+    ``sys_platform == "win32"``) holds on this machine, with the values of
+    ``environment`` (e.g. the Python version of the environment) overriding
+    those of the running interpreter. Requirements of extras do not hold.
+
+    A marker which cannot be evaluated (``packaging`` is not installed, or
+    the marker is invalid) does not hold either: leaving out a requirement
+    can only keep an extra package in the minimized environment, whereas
+    wrongly keeping it can leave out a package that is needed.
+    """
+    try:
+        from packaging.markers import Marker
+    except ImportError:
+        return False
+    try:
+        return Marker(marker).evaluate(dict(environment or {}, extra=''))
+    except Exception:
+        return False
+
+
+def read_requires_dist(dist_info_dpath, environment=None):
+    """Requirements of a pip package, in the "<name> <constraints>" format of
+    conda-meta, leaving out those whose marker does not hold in
+    ``environment`` (see ``marker_holds``).
+    """
+    requires = []
+    try:
+        fp = open(os.path.join(dist_info_dpath, 'METADATA'), 'rb')
+    except (IOError, OSError):
+        return requires
+    with fp:
+        for line in fp:
+            line = line.decode('utf-8', 'replace').rstrip()
+            if not line:
+                # the headers end at the first empty line
+                break
+            if not line.startswith('Requires-Dist:'):
+                continue
+            req, _, marker = line[len('Requires-Dist:'):].partition(';')
+            if marker.strip() and not marker_holds(marker, environment):
+                continue
+            match = re.match(r'\s*([A-Za-z0-9._-]+)\s*(?:\[[^\]]*\])?\s*\(?([^)]*)\)?', req)
+            if match is None:
+                continue
+            name, constraints = match.group(1), match.group(2).replace(' ', '')
+            requires.append(name + (' ' + constraints if constraints else ''))
+    return requires
+
+
+def update_deps_with_pip_meta(prefix, all_deps):
+    """Set the dependencies of the pip packages in ``all_deps`` from their
+    *.dist-info directories in ``prefix``.
+    """
+    dist_info_dpaths = dict((name, dist_info_dpath) for name, _, dist_info_dpath
+                            in read_pip_packages(prefix))
+    # markers are about the Python of the environment, not the one running
+    # this script
+    environment = {}
+    python = all_deps.get('python')
+    python_version = python.version.partition('=')[0] if python is not None else ''
+    if python_version and not python.from_pip:
+        environment['python_full_version'] = python_version
+        environment['python_version'] = '.'.join(python_version.split('.')[:2])
+    for pkgspec in all_deps.values():
+        dist_info_dpath = dist_info_dpaths.get(canonical_name(pkgspec.name))
+        if pkgspec.from_pip and dist_info_dpath is not None:
+            pkgspec.deps = read_requires_dist(dist_info_dpath, environment)
+
+
+def list_env(env):
+    """Find the environment ``env`` (a name or a prefix) and list its conda
+    and pip packages, without reading their metadata. Also return the
+    channels configured in .condarc.
+    """
+    root_prefix = conda_root_prefix()
+    condarc = read_condarc(root_prefix)
+    prefix = env_prefix(env, root_prefix, condarc)
+    env_name = env if os.path.basename(env) == env else os.path.basename(prefix)
+    conda_meta_dpath = os.path.join(prefix, 'conda-meta')
+
+    all_deps = {}
+    for filename in sorted(os.listdir(conda_meta_dpath)):
+        if filename.endswith('.json'):
+            name, version, build = filename[:-len('.json')].rsplit('-', 2)
+            all_deps[name] = PackageSpec(name, '{}={}'.format(version, build))
+    for name, version, _ in read_pip_packages(prefix):
+        if name not in all_deps:
+            all_deps[name] = PackageSpec(name, version, from_pip=True)
+    return all_deps, conda_meta_dpath, condarc['channels'] or ['defaults'], env_name
+
+
+def env_channels(all_deps, config_channels):
+    """Channels of the conda packages in ``all_deps``, then those of
+    ``config_channels`` not already listed, which is close to what conda
+    lists but not always in the same order.
+    """
+    channels = []
+    for pkgspec in all_deps.values():
+        if pkgspec.from_pip:
+            continue
+        channel = pkgspec.channel
+        if channel in DEFAULT_CHANNELS:
+            channel = 'defaults'
+        if channel not in channels:
+            channels.append(channel)
+    channels.extend(channel for channel in config_channels
+                    if channel not in channels)
+    return channels
+
+
+def read_env(env, meta_cache=None, jobs=1):
+    """Same as ``parse_deps`` followed by ``update_deps_with_conda_meta``,
+    but reading the conda-meta and site-packages directories of the
+    environment instead of running ``conda env export``.
+    """
+    all_deps, conda_meta_dpath, config_channels, env_name = list_env(env)
+    update_deps_with_conda_meta(env_name, conda_meta_dpath, all_deps,
+                                meta_cache=meta_cache, jobs=jobs)
+    update_deps_with_pip_meta(os.path.dirname(conda_meta_dpath), all_deps)
+    return (all_deps, conda_meta_dpath, env_channels(all_deps, config_channels),
+            env_name)
+
+
+def read_conda_meta(fpath):
+    """Read the fields we use from the conda-meta file at ``fpath``.
+    """
+    # conda-meta files are JSON, which the json module parses much faster
+    # than yaml does
+    with io.open(fpath, 'r', encoding='utf-8') as fp:
+        pkg_meta = json.load(fp)
+    return {
+        'name': pkg_meta['name'],
+        'source': pkg_meta['link']['source'],
+        'schannel': pkg_meta['schannel'],
+        'depends': pkg_meta['depends'],
+    }
+
+
+def read_package_key(fpath, tail_size=CONDA_META_TAIL_SIZE):
+    """Identify the package build of the conda-meta file at ``fpath`` by its
+    link.source (the directory of the package in the package cache) or,
+    failing that, the URL it was downloaded from, reading only the last
+    ``tail_size`` bytes of the file. Return None if neither is there.
+    """
+    with open(fpath, 'rb') as fp:
+        fp.seek(0, os.SEEK_END)
+        fp.seek(max(0, fp.tell() - tail_size))
+        tail = fp.read()
+    for regex in (LINK_SOURCE_RE, URL_RE):
+        match = regex.search(tail)
+        if match is not None:
+            return json.loads(match.group(1).decode('utf-8'))
+    return None
+
+
+def apply_conda_meta(all_deps, pkg_metas):
+    """Set the path, channel and dependencies of the packages in ``all_deps``
+    from what ``read_conda_meta`` returned for them.
+    """
     addl_deps = set()
+    for pkg_meta in pkg_metas:
+        pkg_name = pkg_meta['name']
+        if pkg_name not in all_deps:
+            continue
+        pkgspec = all_deps[pkg_name]
+        pkgspec.path = pkg_meta['source']
+        pkgspec.channel = pkg_meta['schannel']
+        pkgspec.deps = pkg_meta['depends']
+        all_deps[pkg_name] = pkgspec
+        addl_deps.update(pkgspec.deps.keys())
+    return addl_deps
+
+
+def update_deps_with_conda_meta(env_name, conda_meta_dpath, all_deps,
+                                meta_cache=None, jobs=1):
+    """Set the path, channel and dependencies of the packages in ``all_deps``
+    from their conda-meta files, which are named
+    "<name>-<version>-<build>.json": the files of other packages are not
+    read. ``meta_cache`` optionally maps the names of these files to their
+    mtime and what ``read_conda_meta`` returned for them: files with the
+    same mtime are not read again, and the others are added to it. The
+    files are parsed by ``jobs`` processes.
+    """
+    pkg_metas = []
+    # positions in pkg_metas, paths and mtimes of the files to parse
+    pending = []
     for root, dirnames, filenames in os.walk(conda_meta_dpath):
         for filename in filenames:
-            if filename.endswith('.json'):
-                with open(os.path.join(root, filename), 'r') as fp:
-                    pkg_meta = yaml.safe_load(fp)
-                pkg_name = pkg_meta['name']
-                if pkg_name not in all_deps:
+            if not filename.endswith('.json'):
+                continue
+            if filename[:-len('.json')].rsplit('-', 2)[0] not in all_deps:
+                continue
+            fpath = os.path.join(root, filename)
+            mtime = None
+            if meta_cache is not None:
+                mtime = os.path.getmtime(fpath)
+                if filename in meta_cache and meta_cache[filename][0] == mtime:
+                    pkg_metas.append(meta_cache[filename][1])
                     continue
-                pkgspec = all_deps[pkg_name]
-                pkgspec.path = pkg_meta['link']['source']
-                pkgspec.channel = pkg_meta['schannel']
-                pkgspec.deps = pkg_meta['depends']
-                all_deps[pkg_name] = pkgspec
-                addl_deps.update(pkgspec.deps.keys())
-    return addl_deps
+            pending.append((len(pkg_metas), fpath, mtime))
+            pkg_metas.append(None)
+    fpaths = [fpath for _, fpath, _ in pending]
+    if jobs > 1 and len(fpaths) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(fpaths)))
+        try:
+            parsed = pool.map(read_conda_meta, fpaths, chunksize=16)
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        parsed = [read_conda_meta(fpath) for fpath in fpaths]
+    for (i, fpath, mtime), pkg_meta in zip(pending, parsed):
+        pkg_metas[i] = pkg_meta
+        if meta_cache is not None:
+            meta_cache[os.path.basename(fpath)] = [mtime, pkg_meta]
+    return apply_conda_meta(all_deps, pkg_metas)
 
 
-def render_deps_graph(all_deps, out_fname, ext):
-    dg = gv.Digraph(filename=out_fname, format=ext)
-    parent_map = defaultdict(int)
-    for dep_name, dep_spec in all_deps.items():
+def scan_env(env):
+    """List the packages of ``env`` for ``minimize_envs``, with the path of
+    their conda-meta files and the key of their package builds.
+    """
+    if os.path.isfile(env):
+        all_deps, conda_meta_dpath, channels, env_name = parse_deps(env)
+    else:
+        all_deps, conda_meta_dpath, channels, env_name = list_env(env)
+    sources = []
+    for filename in sorted(os.listdir(conda_meta_dpath)):
+        if filename.endswith('.json'):
+            fpath = os.path.join(conda_meta_dpath, filename)
+            sources.append((fpath, read_package_key(fpath) or fpath))
+    update_deps_with_pip_meta(os.path.dirname(conda_meta_dpath), all_deps)
+    return all_deps, channels, env_name, sources
+
+
+def minimize_envs(envs, jobs=1):
+    """Read the packages of several environments, parsing the conda-meta file
+    of each package build only once across all of them: the files of the
+    same package linked from the same package cache (same link.source), or
+    downloaded from the same URL, only differ by what we do not use. In the
+    latter case, the path of the package may be that of the same build in
+    another package cache.
+
+    Return, for each environment, its package specs, channels, name and
+    DepGraph, and the numbers of conda-meta files and of those parsed.
+    """
+    pool = multiprocessing.Pool(jobs) if jobs > 1 else None
+    try:
+        if pool is not None:
+            scanned = pool.map(scan_env, envs)
+        else:
+            scanned = [scan_env(env) for env in envs]
+        source_fpaths = {}
+        for _, _, _, sources in scanned:
+            for fpath, source in sources:
+                source_fpaths.setdefault(source, fpath)
+        unique_sources = list(source_fpaths)
+        fpaths = [source_fpaths[source] for source in unique_sources]
+        if pool is not None:
+            pkg_metas = pool.map(read_conda_meta, fpaths, chunksize=16)
+        else:
+            pkg_metas = [read_conda_meta(fpath) for fpath in fpaths]
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    source_metas = dict(zip(unique_sources, pkg_metas))
+
+    results = []
+    n_files = 0
+    for env, (all_deps, channels, env_name, sources) in zip(envs, scanned):
+        n_files += len(sources)
+        apply_conda_meta(all_deps, [source_metas[source] for _, source in sources])
+        if not os.path.isfile(env):
+            channels = env_channels(all_deps, channels)
+        results.append((all_deps, channels, env_name, DepGraph(all_deps)))
+    return results, n_files, len(unique_sources)
+
+
+class EnvSnapshot(object):
+    """Snapshot of what ``parse_deps`` and ``update_deps_with_conda_meta``
+    found for ``env``, cached as JSON in ``dpath``.
+
+    It is valid as long as the environment has the same conda-meta files,
+    with the same mtimes, and its site-packages directories (where pip
+    installs packages) and environment.yml file (if any) have not been
+    modified. The parsed contents of the conda-meta files are kept as well,
+    so that only those which changed need to be read again otherwise.
+    """
+    def __init__(self, dpath, env, direct=False):
+        self.dpath = dpath
+        self.env = env
+        key = os.path.abspath(env) if os.path.isfile(env) else env
+        if direct:
+            key = 'direct:' + key
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        self.fpath = os.path.join(dpath, digest + '.json')
+        self.meta_cache = {}
+        self._snapshot = None
+        try:
+            with open(self.fpath, 'r') as fp:
+                self._snapshot = json.load(fp)
+            self.meta_cache = self._snapshot['conda_meta']
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+
+    def env_state(self, conda_meta_dpath):
+        prefix = os.path.dirname(conda_meta_dpath)
+        state = {}
+        for dpath in ([conda_meta_dpath] +
+                      glob.glob(os.path.join(prefix, 'lib', 'python*', 'site-packages')) +
+                      glob.glob(os.path.join(prefix, 'Lib', 'site-packages'))):
+            state[dpath] = os.path.getmtime(dpath)
+        for entry in os.listdir(conda_meta_dpath):
+            state[entry] = os.path.getmtime(os.path.join(conda_meta_dpath, entry))
+        if os.path.isfile(self.env):
+            state[self.env] = os.path.getmtime(self.env)
+        return state
+
+    def load(self):
+        """Return the cached results of ``parse_deps`` (with the package specs
+        updated from conda-meta), or None if they are missing or outdated.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            return None
+        try:
+            if self.env_state(snapshot['conda_meta_dpath']) != snapshot['state']:
+                return None
+        except OSError:
+            return None
+        all_deps = {}
+        for spec_dict in snapshot['deps']:
+            all_deps[spec_dict['name']] = PackageSpec.from_dict(spec_dict)
+        return (all_deps, snapshot['conda_meta_dpath'], snapshot['channels'],
+                snapshot['env_name'])
+
+    def save(self, all_deps, conda_meta_dpath, channels, env_name):
+        try:
+            os.makedirs(self.dpath)
+        except OSError:
+            if not os.path.isdir(self.dpath):
+                raise
+        state = self.env_state(conda_meta_dpath)
+        # forget packages that have since been removed from the environment
+        meta_cache = dict((filename, entry) for filename, entry
+                          in self.meta_cache.items() if filename in state)
+        snapshot = {
+            'state': state,
+            'deps': [pkgspec.to_dict() for pkgspec in all_deps.values()],
+            'conda_meta_dpath': conda_meta_dpath,
+            'channels': channels,
+            'env_name': env_name,
+            'conda_meta': meta_cache,
+        }
+        # a temporary file of our own, as other jobs may be saving the same
+        # snapshot
+        fd, tmp_fpath = tempfile.mkstemp(suffix='.tmp', dir=self.dpath)
+        with os.fdopen(fd, 'w') as fp:
+            json.dump(snapshot, fp, separators=(',', ':'))
+        getattr(os, 'replace', os.rename)(tmp_fpath, self.fpath)
+
+
+class DepGraph(object):
+    """Dependency graph of the packages in ``all_deps``.
+
+    Packages are numbered in the order of ``all_deps`` and the dependencies
+    of package ``i`` are ``targets[offsets[i]:offsets[i + 1]]``, with their
+    version constraints at the same positions in ``constraints``. Only
+    installed dependencies are kept (not e.g. virtual packages such as
+    __glibc), and pip names are matched to conda names as pip compares them.
+
+    Cycles are collapsed into strongly connected components, numbered so
+    that the dependencies of a component come before it. Everything but the
+    reachability bitsets, which are computed on first use, takes linear
+    time.
+    """
+    def __init__(self, all_deps):
+        self.names = list(all_deps)
+        self.index = dict((name, i) for i, name in enumerate(self.names))
+        canonical_index = {}
+        for i, name in enumerate(self.names):
+            canonical_index.setdefault(canonical_name(name), i)
+        self.offsets = [0]
+        self.targets = []
+        self.constraints = []
+        for i, name in enumerate(self.names):
+            deps = all_deps[name].deps
+            seen = set()
+            for dep_name in deps:
+                j = self.index.get(dep_name)
+                if j is None:
+                    j = canonical_index.get(canonical_name(dep_name))
+                if j is None or j == i or j in seen:
+                    continue
+                seen.add(j)
+                self.targets.append(j)
+                self.constraints.append(deps[dep_name])
+            self.offsets.append(len(self.targets))
+        self._find_components()
+        self._reach = None
+
+    def _find_components(self):
+        # Tarjan's algorithm, without recursion
+        offsets, targets = self.offsets, self.targets
+        n = len(self.names)
+        order = [-1] * n
+        lowlink = [0] * n
+        on_stack = bytearray(n)
+        stack = []
+        self.component = [-1] * n
+        self.components = []
+        counter = 0
+        for start in range(n):
+            if order[start] != -1:
+                continue
+            order[start] = lowlink[start] = counter
+            counter += 1
+            stack.append(start)
+            on_stack[start] = 1
+            work = [[start, offsets[start]]]
+            while work:
+                frame = work[-1]
+                v, pos = frame
+                if pos < offsets[v + 1]:
+                    frame[1] += 1
+                    w = targets[pos]
+                    if order[w] == -1:
+                        order[w] = lowlink[w] = counter
+                        counter += 1
+                        stack.append(w)
+                        on_stack[w] = 1
+                        work.append([w, offsets[w]])
+                    elif on_stack[w] and order[w] < lowlink[v]:
+                        lowlink[v] = order[w]
+                    continue
+                work.pop()
+                if work and lowlink[v] < lowlink[work[-1][0]]:
+                    lowlink[work[-1][0]] = lowlink[v]
+                if lowlink[v] == order[v]:
+                    members = []
+                    while True:
+                        w = stack.pop()
+                        on_stack[w] = 0
+                        self.component[w] = len(self.components)
+                        members.append(w)
+                        if w == v:
+                            break
+                    self.components.append(sorted(members))
+
+    @property
+    def reach(self):
+        """For each component, a bitset (as an int) of the packages which it
+        depends on, directly or not, including its own.
+        """
+        if self._reach is None:
+            offsets, targets, component = self.offsets, self.targets, self.component
+            self._reach = []
+            for c, members in enumerate(self.components):
+                bits = 0
+                for v in members:
+                    bits |= 1 << v
+                for v in members:
+                    for pos in range(offsets[v], offsets[v + 1]):
+                        d = component[targets[pos]]
+                        if d != c:
+                            bits |= self._reach[d]
+                self._reach.append(bits)
+        return self._reach
+
+    def cycles(self):
+        return [[self.names[v] for v in members] for members in self.components
+                if len(members) > 1]
+
+    def adjacency(self):
+        """Names of the installed dependencies of each package."""
+        return dict((name, [self.names[w] for w in
+                            self.targets[self.offsets[v]:self.offsets[v + 1]]])
+                    for v, name in enumerate(self.names))
+
+    def roots(self):
+        """Smallest set of packages from which all the others are installed as
+        dependencies: the packages which nothing depends on, plus one package
+        (the first in ``all_deps``) of each cycle which nothing outside of it
+        depends on.
+        """
+        offsets, targets, component = self.offsets, self.targets, self.component
+        has_parent = bytearray(len(self.components))
+        for v in range(len(self.names)):
+            for pos in range(offsets[v], offsets[v + 1]):
+                if component[targets[pos]] != component[v]:
+                    has_parent[component[targets[pos]]] = 1
+        return [self.names[v] for v in sorted(
+            members[0] for c, members in enumerate(self.components)
+            if not has_parent[c])]
+
+    def reduced_deps(self):
+        """Dependencies of each package which are not also dependencies of
+        its other dependencies (transitive reduction), with at most one edge
+        to each cycle.
+        """
+        offsets, targets, component = self.offsets, self.targets, self.component
+        reach = self.reach
+        reduced = {}
+        for v, name in enumerate(self.names):
+            first_target = {}
+            for pos in range(offsets[v], offsets[v + 1]):
+                first_target.setdefault(component[targets[pos]], targets[pos])
+            first_target.pop(component[v], None)
+            # a dependency can only depend on those of lower components
+            covered = 0
+            reduced[name] = []
+            for c in sorted(first_target, reverse=True):
+                if not covered >> self.components[c][0] & 1:
+                    reduced[name].append(self.names[first_target[c]])
+                    covered |= reach[c]
+        return reduced
+
+    def path(self, src_name, dest_name):
+        """Shortest chain of dependencies from ``src_name`` to ``dest_name``,
+        as (name, version constraints) pairs, or None.
+        """
+        src, dest = self.index[src_name], self.index[dest_name]
+        reach, component = self.reach, self.component
+        if not reach[component[src]] >> dest & 1:
+            return None
+        parent_pos = {src: None}
+        queue = deque([src])
+        while dest not in parent_pos:
+            v = queue.popleft()
+            for pos in range(self.offsets[v], self.offsets[v + 1]):
+                w = self.targets[pos]
+                # only follow dependencies which lead to dest
+                if w not in parent_pos and reach[component[w]] >> dest & 1:
+                    parent_pos[w] = (v, pos)
+                    queue.append(w)
+        path = []
+        v = dest
+        while parent_pos[v] is not None:
+            parent, pos = parent_pos[v]
+            path.append((self.names[v], self.constraints[pos]))
+            v = parent
+        path.append((self.names[src], ()))
+        return path[::-1]
+
+    def why(self, name):
+        """Chains of dependencies (see ``path``) from the root packages to
+        ``name``, which is a single one-package chain if ``name`` is a root.
+        """
+        paths = []
+        for root in self.roots():
+            if root == name:
+                return [[(name, ())]]
+            path = self.path(root, name)
+            if path is not None:
+                paths.append(path)
+        return paths
+
+
+def format_path(path):
+    return ' -> '.join(' '.join((name,) + tuple(constraints))
+                       for name, constraints in path)
+
+
+def render_deps_graph(deps, out_fname, ext, engine='dot'):
+    import graphviz as gv
+    dg = gv.Digraph(filename=out_fname, format=ext, engine=engine)
+    for dep_name, depdep_names in deps.items():
         dg.node(dep_name)
-        for depdep_name in dep_spec.deps:
+        for depdep_name in depdep_names:
             dg.edge(dep_name, depdep_name)
-            parent_map[depdep_name] += 1
     dg.render()
-    return parent_map
-
 
-def main(argv):
-    parser = argparse.ArgumentParser()
-    parser.add_argument('env', help='environment name, or environment.yml file')
-    args = parser.parse_args(argv[1:])
 
-    print('Loading dependencies from env "{}"...'.format(args.env),
-          file=sys.stderr)
-    all_deps, conda_meta_dpath, channels, env_name = parse_deps(args.env)
-    args.env_name = env_name
-
-    print('Parsing conda metadata...', file=sys.stderr)
-    update_deps_with_conda_meta(args.env_name, conda_meta_dpath, all_deps)
+def write_deps_graph(deps, out_fname, fmt, engine='dot'):
+    """Write the graph of ``deps``, which maps package names to the names of
+    their dependencies, to "<out_fname>.<fmt>", and return that path.
+    graphviz is only needed for formats other than DOT and JSON.
+    """
+    fpath = '{}.{}'.format(out_fname, fmt)
+    if fmt == 'json':
+        with io.open(fpath, 'w', encoding='utf-8') as fp:
+            fp.write(json.dumps(deps, indent=1, sort_keys=True) + '\n')
+    elif fmt == 'dot':
+        with io.open(fpath, 'w', encoding='utf-8') as fp:
+            fp.write('digraph {\n')
+            for dep_name, depdep_names in deps.items():
+                fp.write('\t{}\n'.format(json.dumps(dep_name)))
+                for depdep_name in depdep_names:
+                    fp.write('\t{} -> {}\n'.format(json.dumps(dep_name),
+                                                  json.dumps(depdep_name)))
+            fp.write('}\n')
+    else:
+        render_deps_graph(deps, out_fname, fmt, engine)
+    return fpath
 
-    out_fname = args.env_name + '_graph'
-    ext = 'png'
-    print('Generating dependency graph at "{}.{}"...'.format(out_fname, ext),
-          file=sys.stderr)
-    parent_map = render_deps_graph(all_deps, out_fname, ext)
 
-    print('name: {}_minified'.format(args.env_name))
-    print('channels:')
+def print_env(all_deps, roots, channels, env_name, fp=sys.stdout):
+    print('name: {}_minified'.format(env_name), file=fp)
+    print('channels:', file=fp)
     for channel in channels:
-        print('  - {}'.format(channel))
-    print('dependencies:'.format(args.env_name))
+        print('  - {}'.format(channel), file=fp)
+    print('dependencies:', file=fp)
     pip_deps = []
     for dep_name in all_deps:
-        if dep_name not in parent_map:
+        if dep_name in roots:
             pkgspec = all_deps[dep_name]
             if pkgspec.from_pip:
                 pip_deps.append(dep_name)
             else:
                 if pkgspec.version:
-                    print('  - {}={}'.format(dep_name, pkgspec.version))
+                    print('  - {}={}'.format(dep_name, pkgspec.version), file=fp)
                 else:
-                    print('  - {}'.format(dep_name))
-    print('  - pip:')
+                    print('  - {}'.format(dep_name), file=fp)
+    print('  - pip:', file=fp)
     for dep_name in pip_deps:
-        print('    - {}'.format(dep_name))
+        print('    - {}'.format(dep_name), file=fp)
+
+
+def print_report(results, n_files, n_parsed, fp=sys.stdout):
+    """Print a summary of the environments minimized by ``minimize_envs``."""
+    width = max([len('environment')] + [len(env_name) for _, _, env_name, _ in results])
+    row = '{:<{}}  {:>8}  {:>5}  {:>5}  {:>6}'
+    print(row.format('environment', width, 'packages', 'kept', 'pip', 'cycles'), file=fp)
+    kept_counts = Counter()
+    for all_deps, _, env_name, graph in results:
+        roots = graph.roots()
+        kept_counts.update(roots)
+        n_pip = sum(1 for pkgspec in all_deps.values() if pkgspec.from_pip)
+        print(row.format(env_name, width, len(all_deps), len(roots), n_pip,
+                         len(graph.cycles())), file=fp)
+    print('', file=fp)
+    print('{} environments, {} conda-meta files, {} parsed'.format(
+        len(results), n_files, n_parsed), file=fp)
+    print('Most commonly kept packages (number of environments):', file=fp)
+    for name, count in kept_counts.most_common(10):
+        print('  {}: {}'.format(name, count), file=fp)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('envs', nargs='+', metavar='env', help='environment name or prefix, or environment.yml file')
+    parser.add_argument('-o', '--output-dir', help='minimize all the environments at once, reading each package\'s conda-meta only once across them, write them to <OUTPUT_DIR>/<env>.yml and print a report (implies --direct and --no-cache)')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of processes used to parse conda metadata, and by --output-dir to read the environments (default: %(default)s)')
+    parser.add_argument('-d', '--direct', action='store_true', help='read the environment\'s conda-meta and site-packages directories instead of running "conda env export" (ignored for environment.yml files)')
+    parser.add_argument('-w', '--why', action='append', default=[], metavar='PACKAGE', help='explain why PACKAGE is installed, i.e. which packages that are kept depend on it (can be given multiple times)')
+    parser.add_argument('-g', '--graph', choices=GRAPH_FORMATS, help='also write the dependency graph to <env>_graph.<GRAPH> once the environment is printed; formats other than dot and json are rendered by graphviz, which can be slow for large environments')
+    parser.add_argument('--layout', choices=('dot', 'sfdp'), default='dot', help='graphviz layout engine used to render the graph; sfdp is much faster for large graphs (default: %(default)s)')
+    parser.add_argument('--reduce', action='store_true', help='only draw the dependencies which are not also indirect dependencies')
+    parser.add_argument('--cache', default=CACHE_DPATH, help='directory in which to cache a snapshot of each environment, which is reused until the environment changes (default: %(default)s)')
+    parser.add_argument('--no-cache', action='store_true', help='do not use or update environment snapshots')
+    args = parser.parse_args(argv[1:])
+
+    if args.output_dir is not None:
+        if args.why:
+            parser.error('--why cannot be used with --output-dir')
+        if not os.path.isdir(args.output_dir):
+            os.makedirs(args.output_dir)
+        print('Reading {} envs...'.format(len(args.envs)), file=sys.stderr)
+        results, n_files, n_parsed = minimize_envs(args.envs, jobs=args.jobs)
+        # Their files would overwrite each other's
+        envs_by_name = {}
+        for env, (_, _, env_name, _) in zip(args.envs, results):
+            if env_name in envs_by_name:
+                parser.error('"{}" and "{}" are both named "{}"'.format(
+                    envs_by_name[env_name], env, env_name))
+            envs_by_name[env_name] = env
+        for all_deps, channels, env_name, graph in results:
+            with open(os.path.join(args.output_dir, env_name + '.yml'), 'w') as fp:
+                print_env(all_deps, set(graph.roots()), channels, env_name, fp)
+        print_report(results, n_files, n_parsed)
+        sys.stdout.flush()
+        if args.graph is not None:
+            for all_deps, channels, env_name, graph in results:
+                deps = graph.reduced_deps() if args.reduce else graph.adjacency()
+                write_deps_graph(deps, os.path.join(args.output_dir, env_name + '_graph'),
+                                 args.graph, engine=args.layout)
+        return
+    if len(args.envs) > 1:
+        parser.error('--output-dir is required to minimize several environments')
+    args.env = args.envs[0]
+
+    args.direct = args.direct and not os.path.isfile(args.env)
+    snapshot = None
+    if not args.no_cache:
+        snapshot = EnvSnapshot(args.cache, args.env, direct=args.direct)
+    meta_cache = snapshot.meta_cache if snapshot is not None else None
+    cached = snapshot.load() if snapshot is not None else None
+    if cached is not None:
+        print('Using snapshot of env "{}"...'.format(args.env), file=sys.stderr)
+        all_deps, conda_meta_dpath, channels, env_name = cached
+        args.env_name = env_name
+    elif args.direct:
+        print('Reading env "{}"...'.format(args.env), file=sys.stderr)
+        all_deps, conda_meta_dpath, channels, env_name = read_env(
+            args.env, meta_cache=meta_cache, jobs=args.jobs)
+        args.env_name = env_name
+        if snapshot is not None:
+            snapshot.save(all_deps, conda_meta_dpath, channels, env_name)
+    else:
+        print('Loading dependencies from env "{}"...'.format(args.env),
+              file=sys.stderr)
+        all_deps, conda_meta_dpath, channels, env_name = parse_deps(args.env)
+        args.env_name = env_name
+
+        print('Parsing conda metadata...', file=sys.stderr)
+        update_deps_with_conda_meta(
+            args.env_name, conda_meta_dpath, all_deps, meta_cache=meta_cache,
+            jobs=args.jobs)
+        update_deps_with_pip_meta(os.path.dirname(conda_meta_dpath), all_deps)
+        if snapshot is not None:
+            snapshot.save(all_deps, conda_meta_dpath, channels, env_name)
+
+    graph = DepGraph(all_deps)
+    roots = set(graph.roots())
+    for name in args.why:
+        if name not in graph.index:
+            print('{} is not installed'.format(name), file=sys.stderr)
+            continue
+        print('{} is installed because of:'.format(name), file=sys.stderr)
+        for path in graph.why(name):
+            print('  ' + format_path(path), file=sys.stderr)
+
+    print_env(all_deps, roots, channels, args.env_name)
+    sys.stdout.flush()
+
+    if args.graph is not None:
+        out_fname = args.env_name + '_graph'
+        print('Generating dependency graph at "{}.{}"...'.format(out_fname, args.graph),
+              file=sys.stderr)
+        deps = graph.reduced_deps() if args.reduce else graph.adjacency()
+        write_deps_graph(deps, out_fname, args.graph, engine=args.layout)
 
 
 if __name__ == '__main__':
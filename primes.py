@@ -8,15 +8,121 @@ Should work in both Python 2 and Python 3.
 
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
+import argparse
 import base64
-import numba
+import contextlib
+import functools
 import numpy as np
+import os
 from six.moves import range
+import struct
 import subprocess
+import sys
+import time
+try:
+    import fcntl
+    msvcrt = None
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
 
 
+# numba is imported on first use of a compiled function (False if missing)
+_numba = None
 
-@numba.njit
+# (name, function, options, fallback) of each function decorated with ``_jit``
+_JIT_FUNCS = []
+
+# Replaced by ``numba.prange`` once numba is loaded
+prange = range
+
+# Bytes of bit-packed sieve per segment; 256 KiB (~4M integers) fits in L2
+_SEGMENT_BYTES = 1 << 18
+
+# ``_CLEAR_BIT[k]`` clears bit ``k`` of a byte
+_CLEAR_BIT = np.array([0xff ^ (1 << k) for k in range(8)], dtype=np.uint8)
+
+# ``_POPCOUNT[b]`` is the number of set bits in byte ``b``
+_POPCOUNT = np.array([bin(b).count('1') for b in range(256)], dtype=np.uint8)
+
+# Prime table files start with a magic string and their bound (little endian)
+_TABLE_MAGIC = b'PRIMETB1'
+_TABLE_HEADER = struct.Struct('<8sQ')
+
+# Bytes of prime table bitmap per entry of its ``pi()`` index
+_TABLE_BLOCK = 1 << 12
+
+# uint64 constants, so that numba doesn't promote mixed arithmetic to float
+_U0, _U1, _U2, _U32 = [np.uint64(k) for k in (0, 1, 2, 32)]
+_MASK32 = np.uint64(0xffffffff)
+
+# Miller-Rabin bases which are deterministic for all 64-bit integers
+_MR_BASES = np.array([2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37], np.uint64)
+
+# Products accumulated between gcds in Pollard's rho
+_RHO_BATCH = 128
+
+# Trial division by primes below this bound comes before Pollard's rho
+_TRIAL_BOUND = 1 << 12
+_TRIAL_PRIMES = None
+
+
+
+def _load_numba():
+    """Import numba the first time a compiled function is called, and replace
+    every ``@_jit`` function of this module with its compiled version (cached
+    on disk, so later processes skip the compilation). Without numba, use the
+    fallback functions, or else run the Python code with NumPy scalars.
+    Return the numba module, or False if it is not installed.
+    """
+    global _numba
+    if _numba is None:
+        try:
+            import numba
+        except ImportError:
+            numba = False
+        mod_globals = globals()
+        if numba:
+            mod_globals['prange'] = numba.prange
+        for name, func, options, fallback in _JIT_FUNCS:
+            if numba:
+                mod_globals[name] = numba.njit(cache=True, **options)(func)
+            else:
+                mod_globals[name] = _ignore_overflow(fallback or func)
+        _numba = numba
+    return _numba
+
+
+
+def _ignore_overflow(func):
+    """Wrap ``func`` so that uint64 wraparound doesn't warn, as in numba.
+    """
+    @functools.wraps(func)
+    def wrapper(*args):
+        with np.errstate(over='ignore'):
+            return func(*args)
+    return wrapper
+
+
+
+def _jit(fallback=None, **options):
+    """Decorator for functions to be compiled with ``numba.njit(**options)``
+    (or replaced by ``fallback`` if numba is not installed) on first call.
+    """
+    def decorator(func):
+        _JIT_FUNCS.append((func.__name__, func, options, fallback))
+
+        @functools.wraps(func)
+        def stub(*args):
+            _load_numba()
+            return globals()[func.__name__](*args)
+        return stub
+    return decorator
+
+
+
+@_jit()
 def primes(n):
     """Return an array of prime numbers that are less than n. Uses the "Sieve of
     Eratosthenes" algorithm.
@@ -33,6 +139,772 @@ def primes(n):
 
 
 
+def _mark_segment_numpy(lo, hi, base_primes, bits):
+    """NumPy version of ``_mark_segment()``, for when numba is missing.
+    """
+    nbits = (hi - lo + 1) // 2
+    sieve = np.ones(nbits, np.bool_)
+    for p in base_primes.tolist():
+        if p * p >= hi:
+            break
+        start = p * p
+        if start < lo:
+            start = ((lo + p - 1) // p) * p
+            if start % 2 == 0:
+                start += p
+        sieve[(start - lo) // 2::p] = False
+    packed = np.packbits(sieve, bitorder='little')
+    bits[:packed.shape[0]] = packed
+    return int(np.count_nonzero(sieve))
+
+
+
+def _collect_segment_numpy(lo, hi, bits, out):
+    """NumPy version of ``_collect_segment()``, for when numba is missing.
+    """
+    nbits = (hi - lo + 1) // 2
+    unpacked = np.unpackbits(bits[:(nbits + 7) // 8], bitorder='little')[:nbits]
+    found = np.flatnonzero(unpacked)
+    out[:found.shape[0]] = lo + 2 * found
+
+
+
+@_jit(fallback=_mark_segment_numpy)
+def _mark_segment(lo, hi, base_primes, bits):
+    """Sieve the odd numbers in ``[lo, hi)`` (``lo`` odd and >= 3) into the
+    bit-packed array ``bits``, where bit ``k`` stands for ``lo + 2*k``, and
+    return how many primes it contains.
+    """
+    nbits = (hi - lo + 1) // 2
+    nbytes = (nbits + 7) // 8
+    bits[:nbytes] = 0xff
+    for j in range(base_primes.shape[0]):
+        p = base_primes[j]
+        if p * p >= hi:
+            break
+        start = p * p
+        if start < lo:
+            start = ((lo + p - 1) // p) * p
+            if start % 2 == 0:
+                start += p
+        for i in range((start - lo) // 2, nbits, p):
+            bits[i >> 3] &= _CLEAR_BIT[i & 7]
+
+    count = 0
+    for i in range(nbits):
+        if bits[i >> 3] & (1 << (i & 7)):
+            count += 1
+    return count
+
+
+
+@_jit(fallback=_collect_segment_numpy)
+def _collect_segment(lo, hi, bits, out):
+    """Write the primes marked by ``_mark_segment(lo, hi, ...)`` in ``bits``
+    to the start of ``out``.
+    """
+    nbits = (hi - lo + 1) // 2
+    count = 0
+    for i in range(nbits):
+        if bits[i >> 3] & (1 << (i & 7)):
+            out[count] = lo + 2 * i
+            count += 1
+
+
+
+@_jit()
+def _sieve_segment(lo, hi, base_primes, bits):
+    """Return the primes in ``[lo, hi)`` (``lo`` odd and >= 3), using ``bits``
+    as the sieve buffer.
+    """
+    res = np.empty(_mark_segment(lo, hi, base_primes, bits), np.int64)
+    _collect_segment(lo, hi, bits, res)
+    return res
+
+
+
+@_jit(parallel=True)
+def _sieve_segments_parallel(lo, hi, span, base_primes, bits):
+    """Return the primes in ``[lo, hi)`` (``lo`` odd and >= 3), sieving the
+    consecutive segments of ``span`` integers concurrently; row ``k`` of the
+    2D array ``bits`` is the sieve buffer of segment ``k``.
+    """
+    nseg = bits.shape[0]
+    counts = np.zeros(nseg, np.int64)
+    for k in prange(nseg):
+        seg_lo = lo + k * span
+        if seg_lo < hi:
+            counts[k] = _mark_segment(seg_lo, min(seg_lo + span, hi),
+                                      base_primes, bits[k])
+    offsets = np.zeros(nseg + 1, np.int64)
+    offsets[1:] = np.cumsum(counts)
+    res = np.empty(offsets[nseg], np.int64)
+    for k in prange(nseg):
+        seg_lo = lo + k * span
+        if seg_lo < hi:
+            _collect_segment(seg_lo, min(seg_lo + span, hi), bits[k],
+                             res[offsets[k]:offsets[k + 1]])
+    return res
+
+
+
+def _base_primes(hi):
+    """Return the odd primes needed to sieve every number below ``hi``.
+    """
+    bound = int(hi ** 0.5) + 2
+    if bound < 4:
+        return np.empty(0, np.int64)
+    base = primes(bound)
+    return base[1:]
+
+
+
+def _iter_segments(lo, hi, segment_bytes=_SEGMENT_BYTES, workers=1):
+    """Yield arrays with the primes in ``[lo, hi)``, one per sieve segment of
+    ``segment_bytes`` bytes (each byte covers 16 integers). Only the base
+    primes below ``sqrt(hi)`` and a single segment buffer are kept in memory.
+
+    If ``hi`` is None, segments are yielded indefinitely and the base primes
+    are extended (doubling their reach) whenever a segment needs more.
+
+    If ``workers > 1``, batches of ``workers`` consecutive segments are sieved
+    concurrently (with one buffer per worker) and yielded as one array.
+    """
+    lo = max(lo, 2)
+    if hi is not None and lo >= hi:
+        return
+    if lo == 2:
+        yield np.array([2], np.int64)
+        lo = 3
+    if lo % 2 == 0:
+        lo += 1
+    bits = np.empty((workers, segment_bytes), np.uint8)
+    span = 16 * segment_bytes
+    base_hi = 0
+    seg_lo = lo
+    while hi is None or seg_lo < hi:
+        seg_hi = seg_lo + workers * span
+        if hi is not None:
+            seg_hi = min(seg_hi, hi)
+        if seg_hi > base_hi:
+            base_hi = seg_hi if hi is not None else max(seg_hi, 4 * base_hi)
+            base_primes = _base_primes(base_hi)
+        if workers > 1:
+            res = _sieve_segments_parallel(seg_lo, seg_hi, span, base_primes,
+                                           bits)
+        else:
+            res = _sieve_segment(seg_lo, seg_hi, base_primes, bits[0])
+        if res.shape[0]:
+            yield res
+        seg_lo = seg_hi
+
+
+
+def iter_primes(start=2, stop=None, chunk=None):
+    """Lazily generate the prime numbers ``p`` such that ``start <= p < stop``
+    (without an upper bound if ``stop`` is None), in increasing order.
+
+    If ``chunk`` is None, yield each prime as a Python ``int``. Otherwise,
+    yield NumPy arrays of the primes in successive windows of roughly
+    ``chunk`` integers. Segments are only sieved as they are consumed, so
+    stopping early costs at most one extra window and memory stays constant.
+
+    e.g. ``list(itertools.islice(iter_primes(), 10))`` or
+    ``sum(int(c.sum()) for c in iter_primes(stop=10**9, chunk=10**7))``.
+    """
+    segment_bytes = _SEGMENT_BYTES
+    if chunk is not None:
+        segment_bytes = max(1, -(-chunk // 16))
+    for seg in _iter_segments(start, stop, segment_bytes):
+        if chunk is not None:
+            yield seg
+        else:
+            for p in seg.tolist():
+                yield p
+
+
+
+def primes_range(lo, hi, segment_bytes=_SEGMENT_BYTES, workers=1):
+    """Return an array of prime numbers ``p`` such that ``lo <= p < hi``. Uses
+    a segmented, bit-packed (odd numbers only) "Sieve of Eratosthenes", so
+    apart from the result the memory used is O(sqrt(hi) + segment_bytes).
+
+    If ``workers > 1``, that many segments are sieved at a time on separate
+    threads (see ``numba.set_num_threads``); the result is the same.
+
+    ``primes_range(0, n)`` is identical to ``primes(n)`` for ``n >= 3``.
+    """
+    chunks = list(_iter_segments(lo, hi, segment_bytes, workers))
+    if not chunks:
+        return np.empty(0, np.int64)
+    return np.concatenate(chunks)
+
+
+
+def parallel_primes(n, workers=None):
+    """Return an array of prime numbers that are less than n, like
+    ``primes(n)``, sieving independent segments on ``workers`` threads (all
+    of numba's threads by default). Without numba, sieve on one thread.
+    """
+    numba = _load_numba()
+    if not numba:
+        return primes_range(0, n)
+    if workers is None:
+        workers = numba.config.NUMBA_NUM_THREADS
+    prev_workers = numba.get_num_threads()
+    numba.set_num_threads(min(workers, numba.config.NUMBA_NUM_THREADS))
+    try:
+        return primes_range(0, n, workers=workers)
+    finally:
+        numba.set_num_threads(prev_workers)
+
+
+
+class PrimeTable(object):
+    """Table of the primes below ``bound``, persisted at ``path`` as a
+    bit-packed bitmap of the odd numbers (bit ``k`` stands for ``2*k + 1``,
+    except bit 0 which stands for 2), plus an index at ``path + '.idx'`` with
+    the number of primes before each block of ``_TABLE_BLOCK`` bytes.
+
+    Both files are opened with ``np.memmap``, so ``is_prime()``, ``pi()``,
+    ``nth_prime()`` and ``primes_range()`` only read the pages they need,
+    and no sieving (or JIT compilation) happens when a table is reopened.
+    Queries past ``bound`` extend the files by sieving just the new range.
+
+    Tables can be shared by several processes: they are created and extended
+    while holding a lock on ``path + '.lock'``, and only ever grow past the
+    bound that readers have mapped.
+    """
+    def __init__(self, path, bound=0):
+        self.path = path
+        self.index_path = path + '.idx'
+        with self._lock():
+            if not os.path.isfile(self.path):
+                # The bitmap last, since its existence means the table exists
+                with open(self.index_path, 'wb') as fp:
+                    fp.write(np.zeros(1, np.uint64).tobytes())
+                with open(self.path, 'wb') as fp:
+                    fp.write(_TABLE_HEADER.pack(_TABLE_MAGIC, 0))
+        self._open()
+        self.extend(bound)
+
+    @contextlib.contextmanager
+    def _lock(self):
+        """Hold an exclusive lock on the table files, as long as the context.
+        """
+        with open(self.path + '.lock', 'a+b') as lock_fp:
+            if fcntl is not None:
+                fcntl.flock(lock_fp.fileno(), fcntl.LOCK_EX)
+                # Closing the file releases the lock
+                yield
+                return
+            # Lock the first byte of the file; LK_LOCK only retries for about
+            # 10 seconds before failing
+            lock_fp.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock_fp.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except (IOError, OSError):
+                    pass
+            try:
+                yield
+            finally:
+                lock_fp.seek(0)
+                msvcrt.locking(lock_fp.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _open(self):
+        with open(self.path, 'rb') as fp:
+            magic, bound = _TABLE_HEADER.unpack(fp.read(_TABLE_HEADER.size))
+        if magic != _TABLE_MAGIC:
+            raise ValueError('"{}" is not a prime table'.format(self.path))
+        self.bound = bound
+        self._index = np.memmap(self.index_path, np.uint64, mode='r',
+                                shape=(bound // (16 * _TABLE_BLOCK) + 1,))
+        if bound:
+            self._bits = np.memmap(self.path, np.uint8, mode='r',
+                                   offset=_TABLE_HEADER.size,
+                                   shape=(bound // 16,))
+        else:
+            self._bits = np.empty(0, np.uint8)
+
+    def extend(self, bound):
+        """Sieve the numbers from the current bound up to ``bound`` (rounded
+        up to a whole index block) and append them to the table files.
+        """
+        span = 16 * _TABLE_BLOCK
+        bound = -(-bound // span) * span
+        if bound <= self.bound:
+            return
+        with self._lock():
+            # Another process may have extended the table since it was opened
+            self._open()
+            if bound > self.bound:
+                self._append(bound)
+        self._open()
+
+    def _append(self, bound):
+        """Sieve the numbers from the current bound up to ``bound`` into the
+        table files, with the lock held.
+        """
+        span = 16 * _TABLE_BLOCK
+        old_bound = self.bound
+        total = int(self._index[-1])
+        self._bits = self._index = None
+        base_primes = _base_primes(bound)
+        bits = np.empty(_SEGMENT_BYTES, np.uint8)
+        with open(self.path, 'r+b') as fp, open(self.index_path, 'r+b') as idx_fp:
+            # Discard anything left over from an interrupted extend()
+            fp.seek(_TABLE_HEADER.size + old_bound // 16)
+            fp.truncate()
+            idx_fp.seek(8 * (old_bound // span + 1))
+            idx_fp.truncate()
+            for seg_lo in range(old_bound, bound, 16 * _SEGMENT_BYTES):
+                seg_hi = min(seg_lo + 16 * _SEGMENT_BYTES, bound)
+                nbytes = (seg_hi - seg_lo) // 16
+                # When seg_lo is 0, 1 is left marked, and stands for 2
+                _mark_segment(seg_lo + 1, seg_hi, base_primes, bits)
+                counts = _POPCOUNT[bits[:nbytes]].reshape(-1, _TABLE_BLOCK)
+                cum_counts = total + np.cumsum(counts.sum(axis=1, dtype=np.uint64),
+                                               dtype=np.uint64)
+                total = int(cum_counts[-1])
+                fp.write(bits[:nbytes].tobytes())
+                idx_fp.write(cum_counts.tobytes())
+            # Only publish the new bound once the data is written
+            fp.flush()
+            idx_fp.flush()
+            fp.seek(0)
+            fp.write(_TABLE_HEADER.pack(_TABLE_MAGIC, bound))
+
+    def _ensure(self, bound):
+        if bound > self.bound:
+            self.extend(max(bound, 2 * self.bound))
+
+    def is_prime(self, x):
+        """Return whether ``x`` is prime.
+        """
+        if x < 3:
+            return x == 2
+        if x % 2 == 0:
+            return False
+        self._ensure(x + 1)
+        k = x // 2
+        return bool(self._bits[k >> 3] & (1 << (k & 7)))
+
+    def pi(self, x):
+        """Return the number of primes less than or equal to ``x``.
+        """
+        if x < 2:
+            return 0
+        self._ensure(x + 1)
+        nbits = (x + 1) // 2
+        block, rem_bits = divmod(nbits, 8 * _TABLE_BLOCK)
+        start = block * _TABLE_BLOCK
+        nbytes, rem = divmod(rem_bits, 8)
+        count = int(self._index[block])
+        count += int(_POPCOUNT[self._bits[start:start + nbytes]].sum(dtype=np.int64))
+        if rem:
+            count += int(_POPCOUNT[self._bits[start + nbytes] & ((1 << rem) - 1)])
+        return count
+
+    def nth_prime(self, k):
+        """Return the ``k``-th prime number, counting from ``nth_prime(1) == 2``.
+        """
+        if k < 1:
+            raise ValueError('k must be a positive integer')
+        if int(self._index[-1]) < k:
+            # p_k < k * (ln(k) + ln(ln(k))) for k >= 6
+            self._ensure(int(k * (np.log(k) + np.log(np.log(k)))) + 1
+                         if k >= 6 else 16)
+        block = int(np.searchsorted(self._index, k, side='left')) - 1
+        start = block * _TABLE_BLOCK
+        bits = np.unpackbits(self._bits[start:start + _TABLE_BLOCK],
+                             bitorder='little')
+        pos = np.flatnonzero(bits)[k - int(self._index[block]) - 1]
+        return max(2 * (8 * start + int(pos)) + 1, 2)
+
+    def primes_range(self, lo, hi):
+        """Return an array of prime numbers ``p`` such that ``lo <= p < hi``.
+        """
+        if hi <= max(lo, 2):
+            return np.empty(0, np.int64)
+        self._ensure(hi)
+        k0 = max(lo // 2, 1)
+        k1 = hi // 2
+        start = k0 >> 3
+        bits = np.unpackbits(self._bits[start:(k1 + 7) >> 3],
+                             bitorder='little')[k0 - 8 * start:k1 - 8 * start]
+        res = 2 * (np.flatnonzero(bits).astype(np.int64) + k0) + 1
+        if lo <= 2:
+            res = np.concatenate([np.array([2], np.int64), res])
+        return res
+
+
+
+@_jit()
+def _mulhi(a, b):
+    """Return the high 64 bits of the 128-bit product of uint64s ``a`` and
+    ``b``.
+    """
+    a_lo = a & _MASK32
+    a_hi = a >> _U32
+    b_lo = b & _MASK32
+    b_hi = b >> _U32
+    lo_hi = a_lo * b_hi
+    cross = ((a_lo * b_lo) >> _U32) + (lo_hi & _MASK32) + a_hi * b_lo
+    return a_hi * b_hi + (lo_hi >> _U32) + (cross >> _U32)
+
+
+
+@_jit()
+def _mont_mul(a, b, n, n_inv):
+    """Return ``a * b / 2**64 mod n`` (Montgomery multiplication), where
+    ``n_inv`` is the inverse of the odd modulus ``n`` modulo ``2**64``.
+    """
+    hi = _mulhi(a, b)
+    m_hi = _mulhi((a * b) * n_inv, n)
+    res = hi - m_hi
+    if hi < m_hi:
+        res += n
+    return res
+
+
+
+@_jit()
+def _mont_setup(n):
+    """Return ``(n_inv, one, r2)`` for Montgomery arithmetic modulo the odd
+    ``n``: the inverse of ``n`` modulo ``2**64``, and ``2**64`` and
+    ``2**128`` modulo ``n``.
+    """
+    n_inv = n
+    for _ in range(5):
+        n_inv *= _U2 - n * n_inv
+    one = (_U0 - n) % n
+    r2 = one
+    for _ in range(64):
+        doubled = r2 + r2
+        if doubled < r2 or doubled >= n:
+            doubled -= n
+        r2 = doubled
+    return n_inv, one, r2
+
+
+
+@_jit()
+def _gcd(a, b):
+    while b:
+        a, b = b, a % b
+    return a
+
+
+
+@_jit()
+def _is_prime_u64(n):
+    """Deterministic Miller-Rabin test for a uint64 ``n``, using the first
+    12 primes as bases, which is exact for all 64-bit integers.
+    """
+    if n < _U2:
+        return False
+    for j in range(_MR_BASES.shape[0]):
+        if n == _MR_BASES[j]:
+            return True
+        if n % _MR_BASES[j] == _U0:
+            return False
+    n_inv, one, r2 = _mont_setup(n)
+    minus_one = n - one
+    d = n - _U1
+    s = 0
+    while d & _U1 == _U0:
+        d >>= _U1
+        s += 1
+    for j in range(_MR_BASES.shape[0]):
+        base = _mont_mul(_MR_BASES[j], r2, n, n_inv)
+        x = one
+        e = d
+        while e:
+            if e & _U1:
+                x = _mont_mul(x, base, n, n_inv)
+            base = _mont_mul(base, base, n, n_inv)
+            e >>= _U1
+        if x == one or x == minus_one:
+            continue
+        for _ in range(s - 1):
+            x = _mont_mul(x, x, n, n_inv)
+            if x == minus_one:
+                break
+        else:
+            return False
+    return True
+
+
+
+@_jit()
+def _pollard_brent(n):
+    """Return a non-trivial factor of the odd composite uint64 ``n``, using
+    Brent's variant of Pollard's rho algorithm in Montgomery form.
+    """
+    n_inv, one, _ = _mont_setup(n)
+    c = _U1
+    while True:
+        y = one + one
+        q = one
+        g = _U1
+        r = 1
+        x = y
+        ys = y
+        while g == _U1:
+            x = y
+            for _ in range(r):
+                y = _mont_mul(y, y, n, n_inv) + c
+                if y >= n:
+                    y -= n
+            k = 0
+            while k < r and g == _U1:
+                ys = y
+                for _ in range(min(_RHO_BATCH, r - k)):
+                    y = _mont_mul(y, y, n, n_inv) + c
+                    if y >= n:
+                        y -= n
+                    q = _mont_mul(q, x - y if x > y else y - x, n, n_inv)
+                g = _gcd(q, n)
+                k += _RHO_BATCH
+            r *= 2
+        if g == n:
+            # The batched product hit 0; redo the last batch one step at a time
+            g = _U1
+            while g == _U1:
+                ys = _mont_mul(ys, ys, n, n_inv) + c
+                if ys >= n:
+                    ys -= n
+                g = _gcd(x - ys if x > ys else ys - x, n)
+        if g != n:
+            return g
+        c += _U1
+
+
+
+@_jit()
+def _factorize_u64(n, trial_primes, out):
+    """Write the prime factors of a uint64 ``n`` (with multiplicity, in
+    increasing order) to the start of ``out`` and return how many there are.
+    ``trial_primes`` are the uint64 primes to try dividing by first.
+    """
+    count = 0
+    if n < _U2:
+        return count
+    for j in range(trial_primes.shape[0]):
+        p = trial_primes[j]
+        if p * p > n:
+            break
+        while n % p == _U0:
+            out[count] = p
+            count += 1
+            n //= p
+    limit = trial_primes[trial_primes.shape[0] - 1]
+    stack = np.empty(64, np.uint64)
+    top = 0
+    if n > _U1:
+        stack[0] = n
+        top = 1
+    while top:
+        top -= 1
+        m = stack[top]
+        if m < limit * limit or _is_prime_u64(m):
+            out[count] = m
+            count += 1
+        else:
+            d = _pollard_brent(m)
+            stack[top] = d
+            stack[top + 1] = m // d
+            top += 2
+    out[:count].sort()
+    return count
+
+
+
+@_jit(parallel=True)
+def _is_prime_many(arr, out):
+    for i in prange(arr.shape[0]):
+        out[i] = _is_prime_u64(arr[i])
+
+
+
+@_jit(parallel=True)
+def _factorize_many(arr, trial_primes, factors, counts):
+    for i in prange(arr.shape[0]):
+        counts[i] = _factorize_u64(arr[i], trial_primes, factors[i])
+
+
+
+def is_prime_batch(arr):
+    """Return a boolean array telling whether each element of ``arr``
+    (converted to ``np.uint64``) is prime. Uses a deterministic Miller-Rabin
+    test, in parallel over the elements.
+    """
+    arr = np.ascontiguousarray(arr, dtype=np.uint64)
+    out = np.empty(arr.shape, np.bool_)
+    _is_prime_many(arr.ravel(), out.ravel())
+    return out
+
+
+
+def _trial_primes():
+    """Return the (cached) uint64 array of primes used for trial division.
+    """
+    global _TRIAL_PRIMES
+    if _TRIAL_PRIMES is None:
+        _TRIAL_PRIMES = primes(_TRIAL_BOUND).astype(np.uint64)
+    return _TRIAL_PRIMES
+
+
+
+def factorize_batch(arr, chunk=1 << 16):
+    """Factorize each element of the 1D array ``arr`` (converted to
+    ``np.uint64``), in parallel over the elements, using trial division by the
+    primes below ``_TRIAL_BOUND`` followed by Pollard's rho algorithm.
+
+    Return ``(factors, offsets)``, where the prime factors of ``arr[i]`` (with
+    multiplicity, in increasing order; none for 0 and 1) are
+    ``factors[offsets[i]:offsets[i + 1]]``. Elements are processed ``chunk``
+    at a time, to bound the scratch space.
+    """
+    arr = np.ascontiguousarray(arr, dtype=np.uint64).ravel()
+    trial_primes = _trial_primes()
+    scratch = np.empty((min(chunk, arr.shape[0]), 64), np.uint64)
+    counts = np.empty(arr.shape[0], np.int64)
+    chunks = []
+    for lo in range(0, arr.shape[0], chunk):
+        hi = min(lo + chunk, arr.shape[0])
+        _factorize_many(arr[lo:hi], trial_primes, scratch, counts[lo:hi])
+        mask = np.arange(64) < counts[lo:hi, None]
+        chunks.append(scratch[:hi - lo][mask])
+    offsets = np.zeros(arr.shape[0] + 1, np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    if not chunks:
+        return np.empty(0, np.uint64), offsets
+    return np.concatenate(chunks), offsets
+
+
+
+def _measure(func, *args):
+    """Return the result, wall-clock time and peak traced memory (bytes) of
+    calling ``func(*args)``.
+    """
+    import tracemalloc
+    tracemalloc.start()
+    start = time.time()
+    res = func(*args)
+    elapsed = time.time() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return res, elapsed, peak
+
+
+
+def benchmark_sieve(max_exp=10, max_bytes=2 ** 31):
+    """Compare time and peak memory of ``primes(n)`` against the segmented
+    sieve for ``n = 10**3 .. 10**max_exp``. The segmented sieve only counts
+    the primes, since for large ``n`` the result alone would not fit in
+    memory. ``primes(n)`` is skipped once it would need more than
+    ``max_bytes``.
+    """
+    count_segmented = lambda n: sum(seg.shape[0] for seg in _iter_segments(0, n))
+    # Compile both code paths before timing
+    primes(100)
+    count_segmented(100)
+    print('{:>14} {:>12} {:>10} {:>12} {:>10} {:>12}'.format(
+        'n', 'pi(n)', 'sieve (s)', 'sieve mem', 'segm (s)', 'segm mem'))
+    for exp in range(3, max_exp + 1):
+        n = 10 ** exp
+        count, seg_time, seg_peak = _measure(count_segmented, n)
+        if (n // 2) * 8 <= max_bytes:
+            _, time_, peak = _measure(primes, n)
+            full = '{:>10.3f} {:>12}'.format(time_, peak)
+        else:
+            full = '{:>10} {:>12}'.format('-', '-')
+        print('{:>14} {:>12} {} {:>10.3f} {:>12}'.format(
+            n, count, full, seg_time, seg_peak))
+
+
+
+def benchmark_parallel(n=10 ** 10, max_workers=None):
+    """Time counting the primes below ``n`` with the segmented sieve on 1, 2,
+    4, ... up to ``max_workers`` threads (all of numba's threads by default),
+    and print the speedup relative to a single thread.
+    """
+    numba = _load_numba()
+    if not numba:
+        raise RuntimeError('numba is required for the parallel benchmark')
+    if max_workers is None:
+        max_workers = numba.config.NUMBA_NUM_THREADS
+    count_parallel = lambda n, workers: sum(
+        seg.shape[0] for seg in _iter_segments(0, n, workers=workers))
+    prev_workers = numba.get_num_threads()
+    workers_list = sorted(set([2 ** k for k in range(max_workers.bit_length())] +
+                              [max_workers]))
+    print('{:>8} {:>12} {:>10} {:>8}'.format('workers', 'pi(n)', 'time (s)',
+                                             'speedup'))
+    base_time = None
+    try:
+        for workers in workers_list:
+            numba.set_num_threads(min(workers, numba.config.NUMBA_NUM_THREADS))
+            # Compile before timing
+            count_parallel(100, workers)
+            count, time_, _ = _measure(count_parallel, n, workers)
+            if base_time is None:
+                base_time = time_
+            print('{:>8} {:>12} {:>10.3f} {:>8.2f}'.format(
+                workers, count, time_, base_time / time_))
+    finally:
+        numba.set_num_threads(prev_workers)
+
+
+
+def benchmark_batch(size=10 ** 6, seed=0):
+    """Print the throughput (numbers per second) of ``is_prime_batch()`` on
+    ``size`` random 64-bit integers, and of ``factorize_batch()`` on random
+    32-bit and 64-bit integers (``size // 100`` of the latter).
+    """
+    rng = np.random.RandomState(seed)
+    cases = [
+        ('is_prime_batch', is_prime_batch, 64, size),
+        ('factorize_batch', factorize_batch, 32, size),
+        ('factorize_batch', factorize_batch, 64, max(size // 100, 1)),
+    ]
+    print('{:>16} {:>5} {:>10} {:>10} {:>14}'.format(
+        'function', 'bits', 'size', 'time (s)', 'numbers/s'))
+    for name, func, bits, n in cases:
+        arr = rng.randint(0, 2 ** 32, size=(n, 2)).astype(np.uint64)
+        arr = (arr[:, 0] << np.uint64(32)) | arr[:, 1]
+        arr >>= np.uint64(64 - bits)
+        # Compile before timing
+        func(arr[:10])
+        start = time.time()
+        func(arr)
+        elapsed = time.time() - start
+        print('{:>16} {:>5} {:>10} {:>10.3f} {:>14.0f}'.format(
+            name, bits, n, elapsed, n / elapsed))
+
+
+
+def benchmark_startup(runs=3):
+    """Print the time to ``import primes`` and the latency of the first
+    ``primes()`` call in ``runs`` fresh Python processes. The first run
+    includes numba compilation, unless it is already cached on disk.
+    """
+    code = ('import time; start = time.time(); import primes; '
+            'imported = time.time(); primes.primes(1000); '
+            'print(imported - start, time.time() - imported)')
+    print('{:>4} {:>12} {:>16}'.format('run', 'import (s)', 'first call (s)'))
+    for run in range(runs):
+        out = subprocess.check_output(
+            [sys.executable, '-c', code], universal_newlines=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+        import_time, call_time = map(float, out.split())
+        print('{:>4} {:>12.3f} {:>16.3f}'.format(run, import_time, call_time))
+
+
+
 def decode(co_msg):
     """Sample usage of ``primes()``, for decoding and decrypting a string of
     data. This is a bad example of cryptography, and should not be used in
@@ -46,3 +918,31 @@ def decode(co_msg):
     msg = subprocess.check_output('openssl aes-256-cbc -d -in msg.enc -pass file:{}'.format(keyf), shell=True, universal_newlines=True)
     print(msg)
     return msg
+
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Prime number utilities.')
+    parser.add_argument('-b', '--benchmark', choices=['sieve', 'parallel', 'batch', 'startup'], help=(
+        'Run a benchmark and print the results on STDOUT'
+    ))
+    parser.add_argument('--max-exp', type=int, default=10, help=(
+        'Largest power of 10 to benchmark (default: %(default)s)'
+    ))
+    parser.add_argument('-w', '--workers', type=int, help=(
+        'Largest number of threads to benchmark (default: all)'
+    ))
+    args = parser.parse_args(argv[1:])
+
+    if args.benchmark == 'sieve':
+        benchmark_sieve(args.max_exp)
+    elif args.benchmark == 'parallel':
+        benchmark_parallel(10 ** args.max_exp, args.workers)
+    elif args.benchmark == 'batch':
+        benchmark_batch()
+    elif args.benchmark == 'startup':
+        benchmark_startup()
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
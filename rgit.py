@@ -10,13 +10,28 @@ import sys
 import argparse
 import requests
 import json
-import shutil
 import os
 import re
+import hashlib
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+try:
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    from urlparse import urlparse, parse_qs
 
 import git    # conda install -c conda-forge gitpython
 
 
+API_URL = 'https://api.github.com'
+PER_PAGE = 100
+GRAPHQL_BATCH = 50
+CACHE_DPATH = os.path.join(os.path.expanduser('~'), '.cache', 'rgit')
+STORE_DPATH = os.path.join(CACHE_DPATH, 'objects.git')
+
+
 class Record(dict):
     """
     A container class that allows us to abstract away the GitHub API responses.
@@ -87,26 +102,183 @@ class DisplayProgress(git.RemoteProgress):
         print('.', end='', flush=True, file=sys.stderr)
 
 
-def clone_repo(remote_url, dest_dpath):
-    progDisplay = DisplayProgress()
-    print('Cloning {} into {}'.format(remote_url, dest_dpath), file=sys.stderr)
-    git.Repo.clone_from(remote_url, dest_dpath+'.tmp', progress=progDisplay)
-    shutil.move(dest_dpath+'.tmp', dest_dpath)
+def open_store(store_dpath):
+    """
+    The bare repository in which the objects of all checked out PRs are kept,
+    whatever repo (or fork) they come from. PRs are checked out as worktrees
+    of it, so they share its objects rather than each being a full clone.
+    """
+    try:
+        return git.Repo(store_dpath)
+    except git.exc.NoSuchPathError:
+        print('Creating object store at "{}"'.format(store_dpath), file=sys.stderr)
+        return git.Repo.init(store_dpath, bare=True, mkdir=True)
+
+
+def fetch_pr(store, repo_name, remote_url, pr_id, depth=None, partial=True):
+    """
+    Fetch only the head of PR ``pr_id`` of ``repo_name`` into ``store``, and
+    return its commit. With ``partial``, file contents are only downloaded
+    when they are checked out (which also makes the remote a promisor
+    remote, so that they can be); ``depth`` limits the history fetched.
+    """
+    if repo_name not in [remote.name for remote in store.remotes]:
+        store.create_remote(repo_name, remote_url)
+    ref = 'refs/remotes/{}/pull/{}'.format(repo_name, pr_id)
+    options = {}
+    if partial:
+        options['filter'] = 'blob:none'
+    if depth is not None:
+        options['depth'] = depth
+    print('Fetching PR #{} of {}'.format(pr_id, repo_name), end='', file=sys.stderr)
+    store.remote(repo_name).fetch('+refs/pull/{}/head:{}'.format(pr_id, ref),
+                                  progress=DisplayProgress(), **options)
     print('', file=sys.stderr)
-    repo = git.Repo(dest_dpath)
-    return repo
+    return store.git.rev_parse(ref)
 
 
-def checkout_pr(repo, pr_record):
-    repo.git.checkout('master')
-    repo.git.fetch('origin', 'pull/' + pr_record['id'] + '/head:' + pr_record['branch'])
-    print('Checking out branch "{}"'.format(pr_record['branch']), file=sys.stderr)
-    repo.git.checkout(pr_record['branch'])
+def checkout_worktree(store, dest_dpath, branch, commit):
+    """
+    Check out ``commit`` as ``branch`` in a worktree of ``store`` at
+    ``dest_dpath``, which may already exist.
+    """
+    try:
+        repo = git.Repo(dest_dpath)
+        # e.g. a full clone made by earlier versions of rgit, which does not
+        # have the objects fetched into the store
+        assert os.path.realpath(repo.common_dir) == os.path.realpath(store.common_dir), \
+            '"{}" is not a worktree of "{}", move it away first'.format(dest_dpath, store.common_dir)
+        print('Found existing worktree at "{}"'.format(dest_dpath), file=sys.stderr)
+        repo.git.checkout('-B', branch, commit)
+    except git.exc.NoSuchPathError:
+        dest_parent_dpath = os.path.dirname(dest_dpath)
+        if not os.path.isdir(dest_parent_dpath):
+            os.makedirs(dest_parent_dpath)
+        # Forget about worktrees whose directories have been deleted
+        store.git.worktree('prune')
+        store.git.worktree('add', '-B', branch, dest_dpath, commit)
+        repo = git.Repo(dest_dpath)
+    print('Checked out branch "{}" at "{}"'.format(branch, dest_dpath), file=sys.stderr)
+    return repo
 
 
-def prepare_session():
+class ResponseCache(object):
+    """
+    On-disk cache of GET responses, as one JSON file per URL (and
+    credentials) in ``dpath``. Cached responses younger than ``ttl`` seconds
+    are used without any request (as are all of them when ``offline``); older
+    ones are revalidated with their ETag / Last-Modified date, and reused if
+    the server answers "304 Not Modified" (which GitHub does not count
+    against the rate limit).
+    """
+    # Headers which no longer apply to the decoded body that is stored
+    DROPPED_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding')
+
+    def __init__(self, dpath, ttl=0, offline=False):
+        self.dpath = dpath
+        self.ttl = ttl
+        self.offline = offline
+        self.stats = {'hits': 0, 'revalidated': 0, 'misses': 0}
+        self._lock = threading.Lock()
+        if not os.path.isdir(dpath):
+            os.makedirs(dpath)
+
+    def count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def _fpath(self, request):
+        key = request.url + '\n' + request.headers.get('Authorization', '')
+        return os.path.join(self.dpath, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def load(self, request):
+        try:
+            with open(self._fpath(request), 'r') as fp:
+                return json.load(fp)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def save(self, request, entry):
+        fd, tmp_fpath = tempfile.mkstemp(suffix='.tmp', dir=self.dpath)
+        with os.fdopen(fd, 'w') as fp:
+            json.dump(entry, fp)
+        getattr(os, 'replace', os.rename)(tmp_fpath, self._fpath(request))
+
+    def is_fresh(self, entry):
+        return self.offline or time.time() - entry['fetched_at'] < self.ttl
+
+    @classmethod
+    def make_entry(cls, response):
+        headers = dict((key, value) for key, value in response.headers.items()
+                       if key.lower() not in cls.DROPPED_HEADERS)
+        return {
+            'headers': headers,
+            'body': response.content.decode('utf-8'),
+            'fetched_at': time.time(),
+        }
+
+    @staticmethod
+    def make_response(entry, request):
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = 'OK'
+        response.headers = requests.structures.CaseInsensitiveDict(entry['headers'])
+        response._content = entry['body'].encode('utf-8')
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        return response
+
+
+class CachingAdapter(requests.adapters.HTTPAdapter):
+    """
+    Transport adapter which serves GET requests through a ``ResponseCache``.
+    """
+    def __init__(self, cache, **kwargs):
+        super(CachingAdapter, self).__init__(**kwargs)
+        self.cache = cache
+
+    def send(self, request, **kwargs):
+        if request.method != 'GET':
+            return super(CachingAdapter, self).send(request, **kwargs)
+
+        entry = self.cache.load(request)
+        if entry is not None and self.cache.is_fresh(entry):
+            self.cache.count('hits')
+            return self.cache.make_response(entry, request)
+        if self.cache.offline:
+            raise requests.ConnectionError('{} is not cached, and offline'.format(request.url))
+        if entry is not None:
+            headers = entry['headers']
+            if 'ETag' in headers:
+                request.headers['If-None-Match'] = headers['ETag']
+            if 'Last-Modified' in headers:
+                request.headers['If-Modified-Since'] = headers['Last-Modified']
+
+        response = super(CachingAdapter, self).send(request, **kwargs)
+        if response.status_code == 304 and entry is not None:
+            self.cache.count('revalidated')
+            entry['fetched_at'] = time.time()
+            self.cache.save(request, entry)
+            return self.cache.make_response(entry, request)
+        self.cache.count('misses')
+        if response.status_code == 200:
+            try:
+                self.cache.save(request, self.cache.make_entry(response))
+            except UnicodeDecodeError:
+                pass
+        return response
+
+
+def prepare_session(pool_size=10, cache=None):
     import getpass
     session = requests.Session()
+    if cache is None:
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size)
+    else:
+        adapter = CachingAdapter(cache, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
     print('GitHub Username: ', end='', file=sys.stderr)
     gh_username = input()
     gh_password = getpass.getpass(prompt='Password: ', stream=sys.stderr)
@@ -114,72 +286,303 @@ def prepare_session():
     return session
 
 
-def gh_list(thing, session=None):
-    records = []
-
-    if re.search(r'/pulls/\d+/comments$', thing):
-        args.list = re.sub(r'/pulls/(\d+/comments)$', r'/issues/\1', thing, count=1)
-        # print('Warning: GitHub API treats PR comments as issue comments. Assuming you meant "{}"...'.format(thing), file=sys.stderr)
-    url = 'https://api.github.com/repos/' + thing
-    # print('GET Request: "{}"...'.format(url), file=sys.stderr)
+def gh_get(url, session=None, params=None):
     if session is None:
-        resp = requests.get(url)
+        resp = requests.get(url, params=params)
     else:
-        resp = session.get(url)
-    assert resp.status_code == 200, 'Error during GET request to {}'.format(url)
+        resp = session.get(url, params=params)
+    assert resp.status_code == 200, 'Error during GET request to {}'.format(resp.url)
+    return resp
+
+
+def page_count(resp):
+    """
+    Number of pages of a paginated GitHub API response, from the "last" link
+    of its Link header. This is None if there is a "next" link but no "last"
+    one, in which case the pages have to be followed one by one.
+    """
+    if 'last' not in resp.links:
+        return None if 'next' in resp.links else 1
+    query = parse_qs(urlparse(resp.links['last']['url']).query)
+    return int(query['page'][0])
+
+
+def make_records(thing, data):
+    records = []
+    if isinstance(data, dict):
+        data = [data]
 
     if '/comment' in thing:
         # Collect metadata about comments
-        comment_data = resp.json()
-        if isinstance(comment_data, dict):
-            comment_data = [comment_data]
-        for comment in comment_data:
+        for comment in data:
             record = CommentRecord(comment)
             records.append(record)
 
     elif '/pull' in thing:
         # Collect metadata about pull requests
-        pr_data = resp.json()
-        if isinstance(pr_data, dict):
-            pr_data = [pr_data]
-        for pr in pr_data:
+        for pr in data:
             record = PullRequestRecord(pr)
             records.append(record)
 
     elif '/issue' in thing:
         # Collect metadata about issues
-        issue_data = resp.json()
-        if isinstance(issue_data, dict):
-            issue_data = [issue_data]
-        for issue in issue_data:
+        for issue in data:
             record = IssueRecord(issue)
             records.append(record)
 
     return records
 
 
-def gh_checkout(thing, session=None):
-    url = 'https://api.github.com/repos/' + thing
+def gh_iter(thing, session=None, jobs=4, api_url=API_URL):
+    """
+    Generate the records of all pages of ``thing``, in order. The first page
+    tells how many there are, after which the rest are fetched concurrently
+    on ``jobs`` threads, while records are generated as the pages arrive.
+    """
+    if re.search(r'/pulls/\d+/comments$', thing):
+        thing = re.sub(r'/pulls/(\d+/comments)$', r'/issues/\1', thing, count=1)
+        # print('Warning: GitHub API treats PR comments as issue comments. Assuming you meant "{}"...'.format(thing), file=sys.stderr)
+    url = api_url + '/repos/' + thing
+    params = {'per_page': PER_PAGE}
+    # print('GET Request: "{}"...'.format(url), file=sys.stderr)
+    resp = gh_get(url, session, params)
+    for record in make_records(thing, resp.json()):
+        yield record
+
+    n_pages = page_count(resp)
+    if n_pages is None:
+        while 'next' in resp.links:
+            resp = gh_get(resp.links['next']['url'], session)
+            for record in make_records(thing, resp.json()):
+                yield record
+        return
+    if n_pages < 2:
+        return
+
+    with ThreadPoolExecutor(jobs) as executor:
+        futures = [executor.submit(gh_get, url, session, dict(params, page=page))
+                   for page in range(2, n_pages + 1)]
+        try:
+            for future in futures:
+                for record in make_records(thing, future.result().json()):
+                    yield record
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def gh_list(thing, session=None, jobs=4, api_url=API_URL):
+    return list(gh_iter(thing, session, jobs, api_url))
+
+
+GRAPHQL_COMMENTS = '''
+    comments(first: 100, after: $after) {
+        totalCount
+        pageInfo { hasNextPage endCursor }
+        nodes { url body author { login } }
+    }
+'''
+GRAPHQL_COMMON = '''
+    __typename number title url body
+    author { login }
+    milestone { title description dueOn }
+    assignees(first: 100) { nodes { login } }
+    labels(first: 100) { nodes { name } }
+''' + GRAPHQL_COMMENTS
+# The state fields of issues and PRs have different (enum) types, so they
+# need different names to be queried together
+GRAPHQL_ISSUE = GRAPHQL_COMMON + 'issueState: state'
+GRAPHQL_PULL_REQUEST = GRAPHQL_COMMON + '''
+    pullRequestState: state mergedAt headRefName baseRefName
+    baseRepository { owner { login } }
+'''
+GRAPHQL_ITEM = '''
+    __typename
+    ... on Issue { %s }
+    ... on PullRequest { %s }
+''' % (GRAPHQL_ISSUE, GRAPHQL_PULL_REQUEST)
+GRAPHQL_LIST = '''
+query($owner: String!, $name: String!, $first: Int!, $cursor: String, $states: [%s!], $after: String) {
+    repository(owner: $owner, name: $name) {
+        %s(first: $first, after: $cursor, states: $states,
+           orderBy: {field: CREATED_AT, direction: DESC}) {
+            pageInfo { hasNextPage endCursor }
+            nodes { %s }
+        }
+    }
+}
+'''
+GRAPHQL_NUMBERS = '''
+query($owner: String!, $name: String!, $after: String) {
+    repository(owner: $owner, name: $name) { %s }
+}
+'''
+GRAPHQL_MORE_COMMENTS = '''
+query($owner: String!, $name: String!, $number: Int!, $after: String) {
+    repository(owner: $owner, name: $name) {
+        issueOrPullRequest(number: $number) {
+            ... on Issue { %s }
+            ... on PullRequest { %s }
+        }
+    }
+}
+''' % (GRAPHQL_COMMENTS, GRAPHQL_COMMENTS)
+GRAPHQL_STATES = {
+    'issues': {'open': ['OPEN'], 'closed': ['CLOSED'], 'all': None},
+    'pulls': {'open': ['OPEN'], 'closed': ['CLOSED', 'MERGED'], 'all': None},
+}
+
+
+def graphql_url(api_url):
+    # GitHub Enterprise serves REST at /api/v3 and GraphQL at /api/graphql
+    return re.sub(r'/v3/?$', '', api_url) + '/graphql'
+
+
+def gh_graphql(query, variables, session=None, api_url=API_URL):
+    url = graphql_url(api_url)
+    payload = {'query': query, 'variables': variables}
     if session is None:
-        resp = requests.get(url)
+        resp = requests.post(url, json=payload)
     else:
-        resp = session.get(url)
-    assert resp.status_code == 200, 'Error during GET request to {}'.format(url)
+        resp = session.post(url, json=payload)
+    assert resp.status_code == 200, 'Error during POST request to {}'.format(url)
+    result = resp.json()
+    assert not result.get('errors'), 'GraphQL errors from {}: {}'.format(url, result['errors'])
+    return result['data']
+
+
+def graphql_record(node, comments):
+    """
+    Make an ``IssueRecord`` or ``PullRequestRecord`` out of a GraphQL issue /
+    PR node, by rearranging it as the REST API would return it. Its comments,
+    labels, assignees and milestone (which REST does not give for PRs) are
+    included.
+    """
+    is_pr = node['__typename'] == 'PullRequest'
+    state = node['pullRequestState' if is_pr else 'issueState']
+    author = node['author'] or {'login': 'ghost'}
+    milestone = node['milestone']
+    if milestone:
+        milestone = {'title': milestone['title'], 'description': milestone['description'],
+                     'due_on': milestone['dueOn']}
+    rest = {
+        'number': node['number'],
+        'state': 'open' if state == 'OPEN' else 'closed',
+        'title': node['title'],
+        'html_url': node['url'],
+        'milestone': milestone,
+        'user': author,
+        'assignees': node['assignees']['nodes'],
+        'labels': node['labels']['nodes'],
+        'comments': node['comments']['totalCount'],
+        'body': node['body'],
+    }
+    if is_pr:
+        rest['merged_at'] = node['mergedAt']
+        rest['head'] = {'ref': node['headRefName']}
+        rest['base'] = {'label': '{}:{}'.format(node['baseRepository']['owner']['login'],
+                                                node['baseRefName'])}
+        record = PullRequestRecord(rest)
+        issue_record = IssueRecord(rest)
+        for key in ('milestone', 'assignees', 'labels'):
+            record[key] = issue_record[key]
+    else:
+        record = IssueRecord(rest)
+    record['comments'] = [CommentRecord({'html_url': comment['url'],
+                                         'user': comment['author'] or {'login': 'ghost'},
+                                         'body': comment['body']})
+                          for comment in comments]
+    return record
+
+
+def graphql_comments(node, owner, name, session=None, api_url=API_URL):
+    """
+    All comments of a GraphQL issue / PR node, fetching those beyond the
+    first page.
+    """
+    connection = node['comments']
+    comments = list(connection['nodes'])
+    while connection['pageInfo']['hasNextPage']:
+        variables = {'owner': owner, 'name': name, 'number': node['number'],
+                     'after': connection['pageInfo']['endCursor']}
+        data = gh_graphql(GRAPHQL_MORE_COMMENTS, variables, session, api_url)
+        connection = data['repository']['issueOrPullRequest']['comments']
+        comments.extend(connection['nodes'])
+    return comments
+
+
+def gh_graphql_iter(thing, session=None, api_url=API_URL, batch_size=GRAPHQL_BATCH):
+    """
+    Generate issue / PR records with their comments, labels, assignees and
+    milestones, from batched GraphQL queries rather than one REST request per
+    item. ``thing`` lists the (open, or ``?state=closed`` / ``?state=all``)
+    issues or PRs of a repo, ``batch_size`` at a time (e.g.
+    ContinuumIO/elm/pulls), or gives their numbers (e.g.
+    ContinuumIO/elm/pulls/192,193).
+    """
+    match = re.match(r'([^/]+)/([^/]+)/(issues|pulls)(?:/([\d,]+))?(?:\?(.*))?$', thing)
+    assert match, 'Cannot fetch "{}" with GraphQL'.format(thing)
+    owner, name, kind, numbers, query = match.groups()
+
+    if numbers is not None:
+        numbers = [int(number) for number in numbers.split(',') if number]
+        for start in range(0, len(numbers), batch_size):
+            batch = numbers[start:start + batch_size]
+            query = GRAPHQL_NUMBERS % ''.join(
+                'n{0}: issueOrPullRequest(number: {0}) {{ {1} }}\n'.format(number, GRAPHQL_ITEM)
+                for number in batch)
+            data = gh_graphql(query, {'owner': owner, 'name': name}, session, api_url)
+            for number in batch:
+                node = data['repository']['n{}'.format(number)]
+                assert node is not None, 'No issue or PR #{} in {}/{}'.format(number, owner, name)
+                yield graphql_record(node, graphql_comments(node, owner, name, session, api_url))
+        return
+
+    state = parse_qs(query or '').get('state', ['open'])[0]
+    assert state in GRAPHQL_STATES[kind], 'Unknown state "{}"'.format(state)
+    query = GRAPHQL_LIST % ('IssueState' if kind == 'issues' else 'PullRequestState',
+                            'issues' if kind == 'issues' else 'pullRequests',
+                            GRAPHQL_ISSUE if kind == 'issues' else GRAPHQL_PULL_REQUEST)
+    variables = {'owner': owner, 'name': name, 'first': batch_size,
+                 'states': GRAPHQL_STATES[kind][state]}
+    while True:
+        data = gh_graphql(query, variables, session, api_url)
+        connection = data['repository']['issues' if kind == 'issues' else 'pullRequests']
+        for node in connection['nodes']:
+            yield graphql_record(node, graphql_comments(node, owner, name, session, api_url))
+        if not connection['pageInfo']['hasNextPage']:
+            return
+        variables['cursor'] = connection['pageInfo']['endCursor']
+
+
+def print_records(records, fp=sys.stdout):
+    """
+    Print records as a JSON list, like ``print(json.dumps(records, indent=4))``
+    would, but one at a time, as they come.
+    """
+    n_records = 0
+    for record in records:
+        fp.write(',\n    ' if n_records else '[\n    ')
+        fp.write(json.dumps(record, indent=4).replace('\n', '\n    '))
+        fp.flush()
+        n_records += 1
+    fp.write('\n]\n' if n_records else '[]\n')
+
+
+def gh_checkout(thing, session=None, api_url=API_URL, store_dpath=STORE_DPATH,
+                depth=None, partial=True):
+    url = api_url + '/repos/' + thing
+    resp = gh_get(url, session)
 
     pr_info = resp.json()
     pr_record = PullRequestRecord(pr_info)
-    dest_dpath = '/tmp/' + thing
-    try:
-        repo = git.Repo(dest_dpath)
-        print('Found existing repo at "{}"'.format(dest_dpath), file=sys.stderr)
-    except git.exc.NoSuchPathError:
-        dest_parent_dpath = os.path.dirname(dest_dpath)
-        if not os.path.isdir(dest_parent_dpath):
-            os.makedirs(dest_parent_dpath)
-        repo = clone_repo(pr_info['base']['repo']['clone_url'], dest_dpath)
-
-    checkout_pr(repo, pr_record)
-    return repo
+    base_repo = pr_info['base']['repo']
+    store = open_store(store_dpath)
+    commit = fetch_pr(store, base_repo['full_name'], base_repo['clone_url'],
+                      pr_record['id'], depth=depth, partial=partial)
+    # Branch names of different PRs (e.g. "patch-1") can be the same
+    branch = 'pull/{}/{}'.format(base_repo['full_name'], pr_record['id'])
+    return checkout_worktree(store, '/tmp/' + thing, branch, commit)
 
 
 def main(argv):
@@ -187,23 +590,44 @@ def main(argv):
     grp = parser.add_mutually_exclusive_group()
     grp.add_argument('-l', '--list', help='List PRs and/or issues. e.g. ContinuumIO/elm/pulls, ContinuumIO/elm/issues')
     grp.add_argument('-c', '--checkout', help='Checkout a PR based on the ID. e.g. ContinuumIO/elm/pulls/192')
+    parser.add_argument('-g', '--graphql', action='store_true', help='List issues / PRs together with their comments, labels, assignees and milestones, in batched GraphQL queries. e.g. -g -l ContinuumIO/elm/pulls, -g -l ContinuumIO/elm/issues/12,15?state=all')
+    parser.add_argument('--store', default=STORE_DPATH, help='Bare repository in which the objects of checked out PRs are shared, each PR being a worktree of it (default: %(default)s)')
+    parser.add_argument('--depth', type=int, help='Only fetch this many commits of history when checking out a PR')
+    parser.add_argument('--full', action='store_true', help='Fetch all file contents when checking out a PR, rather than only those checked out')
+    parser.add_argument('-j', '--jobs', type=int, default=4, help='Number of pages fetched concurrently when listing (default: %(default)s)')
+    parser.add_argument('--api-url', default=API_URL, help='Base URL of the GitHub API (default: %(default)s)')
+    parser.add_argument('--cache', default=CACHE_DPATH, help='Directory in which to cache API responses, which are then revalidated rather than fetched again (default: %(default)s)')
+    parser.add_argument('--no-cache', action='store_true', help='Do not cache API responses')
+    parser.add_argument('--cache-ttl', type=float, default=0, help='Use cached API responses younger than this many seconds without revalidating them (default: %(default)s)')
+    parser.add_argument('--offline', action='store_true', help='Only use cached API responses, however old')
     # TODO: Add "respond" feature
     # grp.add_argument('-r', '--respond', help='Respond to a PR comment-thread or issue-thread. e.g. ContinuumIO/elm/pulls/192, ContinuumIO/elm/issues/192')
     args = parser.parse_args(argv[1:])
 
-    session = prepare_session()
+    cache = None
+    if not args.no_cache:
+        cache = ResponseCache(args.cache, ttl=args.cache_ttl, offline=args.offline)
+    session = prepare_session(pool_size=max(args.jobs, 10), cache=cache)
 
-    if args.list is not None:
-        records = gh_list(args.list, session=session)
-        print(json.dumps(records, indent=4))
+    if args.list is not None and args.graphql:
+        print_records(gh_graphql_iter(args.list, session=session, api_url=args.api_url))
+
+    elif args.list is not None:
+        print_records(gh_iter(args.list, session=session, jobs=args.jobs,
+                              api_url=args.api_url))
 
     elif args.checkout is not None:
-        gh_checkout(args.checkout, session=session)
+        gh_checkout(args.checkout, session=session, api_url=args.api_url,
+                    store_dpath=args.store, depth=args.depth, partial=not args.full)
 
     # TODO: Add "respond" feature
     # elif args.respond is not None:
     #     pass
 
+    if cache is not None:
+        print('API response cache: {hits} hits, {revalidated} revalidated, '
+              '{misses} misses'.format(**cache.stats), file=sys.stderr)
+
 
 if __name__ == '__main__':
     sys.exit(main(sys.argv))
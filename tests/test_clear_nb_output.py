@@ -0,0 +1,288 @@
+"""
+Tests of clear_nb_output.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import copy
+import io
+import json
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import clear_nb_output
+
+
+def sample_notebook():
+    """Notebook with outputs holding escapes, non-ASCII and non-BMP
+    characters, floats and nested values.
+    """
+    text = 'caf\xe9 \U0001f600 "quoted" \\ \x7f\t/ end\n'
+    return {
+        'cells': [
+            {'cell_type': 'markdown', 'metadata': {}, 'source': ['# ' + text]},
+            {'cell_type': 'code', 'execution_count': 3, 'metadata': {'scrolled': True},
+             'outputs': [
+                 {'output_type': 'stream', 'name': 'stdout', 'text': [text] * 3},
+                 {'output_type': 'execute_result', 'execution_count': 3,
+                  'metadata': {}, 'data': {'text/plain': [text],
+                                           'image/png': 'iVBORw0KGgo=' * 20,
+                                           'application/json': {
+                                               'x': [1.5, 1e100, -0.0, 10, None,
+                                                     True, {}, [], [[{'a': ''}]]]}}},
+             ],
+             'source': ['print(1)']},
+            {'cell_type': 'code', 'execution_count': None, 'metadata': {},
+             'outputs': [], 'source': []},
+            {'cell_type': 'code', 'execution_count': 4, 'metadata': {},
+             'outputs': [{'output_type': 'error', 'ename': 'E', 'evalue': text,
+                          'traceback': []}], 'source': 'x'},
+        ],
+        'metadata': {'kernelspec': {'name': 'python3'}, 'widgets': {'state': {}}},
+        'nbformat': 4,
+        'nbformat_minor': 5,
+    }
+
+
+def sample_sources():
+    """The sample notebook as written by Jupyter, by this script, and
+    compactly with unusual escapes, number formats and whitespace.
+    """
+    nb_json = sample_notebook()
+    jupyter = json.dumps(nb_json, indent=1, sort_keys=True, ensure_ascii=False) + '\n'
+    this_script = json.dumps(nb_json, indent=4)
+    escaped = json.dumps(nb_json, separators=(',', ':')).replace('/', '\\/')
+    escaped = escaped.replace('1e+100', '1.0E100').replace(':[', ' :\n\t[ ')
+    escaped = escaped.replace('caf', '\\u0063af')
+    return [jupyter, this_script, escaped]
+
+
+class StreamTest(unittest.TestCase):
+    def clear(self, source, stream, policy=None, chunk_size=1 << 16):
+        removed = defaultdict(int)
+        dest_fp = io.StringIO()
+        if stream:
+            clear_nb_output.clear_notebook_stream(io.StringIO(source), dest_fp, policy,
+                                                  removed, chunk_size=chunk_size)
+        else:
+            clear_nb_output.clear_notebook(io.StringIO(source), dest_fp, policy, removed)
+        return dest_fp.getvalue(), dict(removed)
+
+    def test_same_as_clear_notebook(self):
+        outputs = [cell['outputs'] for cell in sample_notebook()['cells']
+                   if cell.get('outputs')]
+        expected_removed = {'outputs': sum(len(json.dumps(cell_outputs))
+                                           for cell_outputs in outputs)}
+        for source in sample_sources():
+            self.assertEqual(json.loads(source), sample_notebook())
+            expected = self.clear(source, False)
+            self.assertEqual(expected[1], expected_removed)
+            for chunk_size in [1, 2, 7, 64, 1 << 16]:
+                self.assertEqual(self.clear(source, True, chunk_size=chunk_size),
+                                 expected, chunk_size)
+
+        policy = clear_nb_output.RetentionPolicy(
+            max_output_bytes=200, drop_mimes=['image/*'], max_stream_bytes=40,
+            strip_widgets=True)
+        for source in sample_sources():
+            expected = self.clear(source, False, policy)
+            self.assertEqual(sorted(expected[1]), ['mime', 'size', 'stream', 'widgets'])
+            self.assertEqual(self.clear(source, True, policy, chunk_size=7), expected)
+
+
+class JsonStreamTest(unittest.TestCase):
+    # Escapes (of quotes, backslashes, and \uXXXX ones, including
+    # surrogate pairs) land across chunk boundaries with small chunks
+    TEXT = ('{"a\\"b": "\\\\\\"\\u00e9\\ud83d\\ude00\\/x\xe9\U0001f600",'
+            ' "n" : [1.50, -2e3, 0, true, null, {"k": []}, "\\\\"],'
+            '"" :{},"z":"' + 'y' * 20 + '"}')
+
+    def stream(self, chunk_size):
+        return clear_nb_output.JsonStream(io.StringIO(self.TEXT), chunk_size)
+
+    def test_values(self):
+        expected = json.loads(self.TEXT)
+        for chunk_size in range(1, 12):
+            stream = self.stream(chunk_size)
+            values = dict((key, stream.value()) for key in stream.iter_object())
+            self.assertEqual(values, expected, chunk_size)
+            self.assertEqual(json.dumps(values), json.dumps(expected))
+
+            stream = self.stream(chunk_size)
+            self.assertEqual(stream.value(), expected)
+
+    def test_skip_and_measure(self):
+        expected = json.loads(self.TEXT)
+        for chunk_size in range(1, 12):
+            stream = self.stream(chunk_size)
+            sizes = dict((key, stream.measure()) for key in stream.iter_object())
+            self.assertEqual(sizes, dict((key, len(json.dumps(value)))
+                                         for key, value in expected.items()), chunk_size)
+            self.assertEqual(self.stream(chunk_size).measure(), len(json.dumps(expected)))
+
+            stream = self.stream(chunk_size)
+            items = []
+            for key in stream.iter_object():
+                items.append(key)
+                if key == 'n':
+                    items.append([stream.skip() for _ in stream.iter_array()])
+                else:
+                    items.append(stream.skip())
+            self.assertEqual(items, ['a"b', 29, 'n', [4, 4, 1, 4, 4, 9, 4], '', 2,
+                                     'z', 22])
+
+    def test_errors(self):
+        for text in ['{"a": ', '{"a": "b', '["\\u00', '[1, 2']:
+            for method in ['value', 'skip', 'measure']:
+                stream = clear_nb_output.JsonStream(io.StringIO(text), 2)
+                with self.assertRaises(ValueError):
+                    getattr(stream, method)()
+        # Only values are checked for syntax errors
+        for text in ['{"a" 1}', '[1, }', '[1.2.3]']:
+            stream = clear_nb_output.JsonStream(io.StringIO(text), 2)
+            with self.assertRaises(ValueError):
+                stream.value()
+
+
+class ClearInPlaceTest(unittest.TestCase):
+    def setUp(self):
+        self.dpath = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dpath)
+
+    def write(self, filename, contents):
+        fpath = os.path.join(self.dpath, filename)
+        if not os.path.isdir(os.path.dirname(fpath)):
+            os.makedirs(os.path.dirname(fpath))
+        with io.open(fpath, 'w', encoding='utf-8') as fp:
+            fp.write(contents)
+        return fpath
+
+    def read(self, fpath):
+        with io.open(fpath, 'r', encoding='utf-8') as fp:
+            return fp.read()
+
+    def cleared(self):
+        dest_fp = io.StringIO()
+        clear_nb_output.clear_notebook(io.StringIO(json.dumps(sample_notebook())),
+                                       dest_fp)
+        return dest_fp.getvalue()
+
+    def test_clear_file(self):
+        for stream in [False, True]:
+            fpath = self.write('nb.ipynb', json.dumps(sample_notebook(), indent=1))
+            os.chmod(fpath, 0o640)
+            size_before, size_after, removed = clear_nb_output.clear_file(fpath, stream)
+            self.assertEqual(self.read(fpath), self.cleared())
+            self.assertEqual((size_before, size_after),
+                             (len(json.dumps(sample_notebook(), indent=1).encode('utf-8')),
+                              os.path.getsize(fpath)))
+            self.assertEqual(list(removed), ['outputs'])
+            self.assertEqual(stat.S_IMODE(os.stat(fpath).st_mode), 0o640)
+            self.assertEqual(os.listdir(self.dpath), ['nb.ipynb'])
+
+    def test_already_clear(self):
+        # Clear, and in another layout: left as they are
+        fpaths = [self.write('clear.ipynb', self.cleared()),
+                  self.write('other_layout.ipynb', json.dumps(json.loads(self.cleared())))]
+        # Not found clear by the byte scan, but unchanged once cleared
+        nb_json = json.loads(self.cleared())
+        nb_json['cells'][1]['metadata']['execution_count'] = 1
+        fpaths.append(self.write('unchanged.ipynb',
+                                 clear_nb_output.Serializer().dumps(nb_json)))
+        self.assertTrue(clear_nb_output.needs_clearing(fpaths[-1]))
+        for fpath in fpaths:
+            contents = self.read(fpath)
+            os.utime(fpath, (1000000000, 1000000000))
+            size_before, size_after, removed = clear_nb_output.clear_file(fpath)
+            self.assertEqual((size_before, size_after), (os.path.getsize(fpath), None))
+            self.assertEqual(self.read(fpath), contents)
+            self.assertEqual(os.path.getmtime(fpath), 1000000000)
+        self.assertEqual(sorted(os.listdir(self.dpath)), sorted(map(os.path.basename, fpaths)))
+
+    def test_failure(self):
+        fpath = self.write('truncated.ipynb', '{"cells": [{"outputs": [1], ')
+        for stream in [False, True]:
+            with self.assertRaises(ValueError):
+                clear_nb_output.clear_file(fpath, stream)
+            self.assertEqual(self.read(fpath), '{"cells": [{"outputs": [1], ')
+            # The temporary file was removed
+            self.assertEqual(os.listdir(self.dpath), ['truncated.ipynb'])
+
+    def test_clear_files(self):
+        fpaths = [self.write('a/{}.ipynb'.format(i), json.dumps(sample_notebook()))
+                  for i in range(6)]
+        fpaths.append(self.write('a/clear.ipynb', self.cleared()))
+        fpaths.append(self.write('a/.ipynb_checkpoints/x.ipynb',
+                                 json.dumps(sample_notebook())))
+        fpaths.append(self.write('a/b/bad.ipynb', '{"cells": [{"outputs": [1'))
+        self.assertEqual(sorted(clear_nb_output.iter_notebooks([self.dpath])),
+                         sorted(fpaths[:-2] + fpaths[-1:]))
+        results = sorted(clear_nb_output.clear_files(
+            clear_nb_output.iter_notebooks([self.dpath]), jobs=2, stream=True))
+        self.assertEqual([result[0] for result in results], sorted(fpaths[:-2] + fpaths[-1:]))
+        errors = dict((result[0], result[4]) for result in results)
+        self.assertTrue(errors.pop(fpaths[-1]).startswith('ValueError: '))
+        self.assertEqual(set(errors.values()), set([None]))
+        for fpath in fpaths[:-2]:
+            self.assertEqual(self.read(fpath), self.cleared())
+        self.assertEqual(self.read(fpaths[-2]), json.dumps(sample_notebook()))
+
+
+class RetentionPolicyTest(unittest.TestCase):
+    def apply(self, policy, cell):
+        removed = defaultdict(int)
+        cell = copy.deepcopy(cell)
+        policy.apply_cell(cell, removed)
+        return cell, dict(removed)
+
+    def test_max_stream_bytes_idempotent(self):
+        policy = clear_nb_output.RetentionPolicy(max_stream_bytes=60)
+        for text in ['x' * 1600, ['line\n'] * 400, '\xe9' * 500]:
+            cell = {'cell_type': 'code', 'execution_count': 1, 'metadata': {},
+                    'source': [], 'outputs': [{'output_type': 'stream',
+                                               'name': 'stdout', 'text': text}]}
+            once, removed = self.apply(policy, cell)
+            output_text = once['outputs'][0]['text']
+            joined = ''.join(output_text) if isinstance(text, list) else output_text
+            self.assertLessEqual(len(joined.encode('utf-8')), 60)
+            self.assertTrue(joined.endswith(
+                '\n[... {} bytes truncated]\n'.format(removed['stream'])))
+            self.assertEqual(self.apply(policy, once), (once, {}))
+
+        # A smaller budget truncates further, and keeps counting earlier losses
+        smaller, removed = self.apply(
+            clear_nb_output.RetentionPolicy(max_stream_bytes=40), once)
+        self.assertEqual(smaller['outputs'][0]['text'],
+                         '\xe9' * 6 + '\n[... {} bytes truncated]\n'.format(
+                             1000 - 12))
+        # A budget smaller than the marker only leaves the marker
+        tiny = clear_nb_output.RetentionPolicy(max_stream_bytes=5)
+        marker, _ = self.apply(tiny, cell)
+        self.assertEqual(marker['outputs'][0]['text'], '[... 1000 bytes truncated]\n')
+        self.assertEqual(self.apply(tiny, marker), (marker, {}))
+
+
+class SerializerTest(unittest.TestCase):
+    @unittest.skipIf(clear_nb_output._load_orjson() is None, 'orjson is not installed')
+    def test_backends_agree(self):
+        # Control characters, DEL, non-ASCII and non-BMP characters
+        text = ''.join(chr(code) for code in range(0x80))
+        text += '\xa0\xff\u2028\uffff\U0001f600\U0010ffff'
+        obj = {'cells': [{'source': [text, '"\\/'], 'outputs': [],
+                          'metadata': {text: 1, 'z': None, 'a': [True, False, -1]}}],
+               'nbformat': 4}
+        for layout in clear_nb_output.Serializer.LAYOUTS:
+            expected = clear_nb_output.Serializer(layout, 'json').dumps(obj, level=1)
+            self.assertEqual(
+                clear_nb_output.Serializer(layout, 'orjson').dumps(obj, level=1),
+                expected, layout)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,353 @@
+"""
+Tests of import_utils.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import csv
+import importlib.util
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import import_utils
+
+
+class ExtractImportsFastTest(unittest.TestCase):
+    def assertSameImports(self, contents):
+        expected = import_utils.extract_imports(contents)
+        self.assertEqual(import_utils.extract_imports_fast(contents), expected)
+        return expected
+
+    def test_string_line_continuation(self):
+        # A backslash-newline inside a quoted string must not make the
+        # scanner take the closing quote of a triple-quoted string for an
+        # opening one
+        contents = ('s = \'a\\\nb"\', """\n"""\n'
+                    'import os\n'
+                    'x = """\n"""\n')
+        self.assertEqual(self.assertSameImports(contents), [('os', 4, 0)])
+
+        contents = ('s = "a\\\nb\'", \'\'\'\n\'\'\'\n'
+                    'from glob import glob\n'
+                    'import random\n')
+        self.assertEqual(self.assertSameImports(contents),
+                         [('glob', 4, 0), ('random', 5, 0)])
+
+
+class ImportStoreTest(unittest.TestCase):
+    ROWS = [('os', 'a.py', 1, 0), ('numpy', 'a.py', 3, 4), ('os', 'b/c.py', 2, 0),
+            ('caf\xe9', 'b/d\xe9,"x".py', 10, 8)]
+
+    def setUp(self):
+        self.store = import_utils.ImportStore()
+        self.store.add(*self.ROWS[0])
+        self.store.add_file_imports('a.py', [self.ROWS[1][:1] + self.ROWS[1][2:]])
+        self.store.add_file_imports('b/c.py', [self.ROWS[2][:1] + self.ROWS[2][2:]])
+        self.store.add(*self.ROWS[3])
+
+    def test_interning(self):
+        self.assertEqual(len(self.store), 4)
+        self.assertEqual(list(self.store.rows()), self.ROWS)
+        self.assertEqual(self.store.modules, ['os', 'numpy', 'caf\xe9'])
+        self.assertEqual(self.store.paths, ['a.py', 'b/c.py', 'b/d\xe9,"x".py'])
+        with self.store.column('module_id') as module_ids:
+            self.assertEqual(module_ids.tolist(), [0, 1, 0, 2])
+            self.assertTrue(module_ids.readonly)
+
+    def test_export(self):
+        dpath = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dpath)
+        self.store.export(os.path.join(dpath, 'imports.JSON'))
+        with open(os.path.join(dpath, 'imports.JSON'), encoding='utf-8') as fp:
+            data = json.load(fp)
+        self.assertEqual(data, {'modules': ['os', 'numpy', 'caf\xe9'],
+                                'paths': ['a.py', 'b/c.py', 'b/d\xe9,"x".py'],
+                                'module_id': [0, 1, 0, 2], 'path_id': [0, 0, 1, 2],
+                                'lineno': [1, 3, 2, 10], 'col_offset': [0, 4, 0, 8]})
+
+        self.store.export(os.path.join(dpath, 'imports.csv'))
+        with open(os.path.join(dpath, 'imports.csv'), encoding='utf-8', newline='') as fp:
+            rows = list(csv.reader(fp))
+        self.assertEqual(rows, [['module', 'filepath', 'lineno', 'col_offset']] +
+                         [[str(value) for value in row] for row in self.ROWS])
+
+        with self.assertRaises(ValueError):
+            self.store.export(os.path.join(dpath, 'imports.txt'))
+        self.assertEqual(sorted(os.listdir(dpath)), ['imports.JSON', 'imports.csv'])
+
+    @unittest.skipIf(importlib.util.find_spec('pyarrow') is None, 'pyarrow is not installed')
+    def test_export_parquet(self):
+        import pyarrow.parquet as pq
+        dpath = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dpath)
+        self.store.export(os.path.join(dpath, 'imports.parquet'))
+        table = pq.read_table(os.path.join(dpath, 'imports.parquet'))
+        self.assertEqual(table.column_names, ['module', 'filepath', 'lineno', 'col_offset'])
+        self.assertEqual([tuple(row[name] for name in table.column_names)
+                          for row in table.to_pylist()], self.ROWS)
+
+
+class ScanFilesTest(unittest.TestCase):
+    def setUp(self):
+        self.dpath = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dpath)
+        self.cache_path = os.path.join(self.dpath, 'cache.json')
+        self.filepaths = []
+        for i in range(50):
+            fpath = os.path.join(self.dpath, 'mod{}.py'.format(i))
+            with open(fpath, 'w') as fp:
+                fp.write('import os\ntry:\n    import mod{}\nexcept ImportError:\n'
+                         '    pass\n'.format((i + 1) % 50))
+            self.filepaths.append(fpath)
+        # Count the files which are parsed (in this process)
+        self.n_parsed = 0
+        parse_source = import_utils.parse_source
+
+        def counting_parse_source(contents):
+            self.n_parsed += 1
+            return parse_source(contents)
+        import_utils.parse_source = counting_parse_source
+        self.addCleanup(setattr, import_utils, 'parse_source', parse_source)
+
+    def scan(self, filepaths=None, jobs=1, graph=None):
+        """Scan the files with the cache, as main does, and return the rows
+        found and the number of cache hits.
+        """
+        cache = import_utils.ImportCache(self.cache_path)
+        import_lister = import_utils.ImportLister()
+        n_files = import_utils.scan_files(filepaths or self.filepaths, import_lister,
+                                          cache=cache, jobs=jobs, graph=graph)
+        cache.save()
+        rows = list(import_lister.imports.rows())
+        self.assertEqual(n_files, len(set(fpath for _, fpath, _, _ in rows)))
+        return rows, cache.hits
+
+    def expected_rows(self):
+        return [row for fpath in self.filepaths
+                for row in [('os', fpath, 1, 0),
+                            ('mod{}'.format((int(os.path.basename(fpath)[3:-3]) + 1) % 50),
+                             fpath, 3, 4)]]
+
+    def touch(self, fpath):
+        stat = os.stat(fpath)
+        os.utime(fpath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    def test_hits(self):
+        self.assertEqual(self.scan(), (self.expected_rows(), 0))
+        self.assertEqual(self.n_parsed, 50)
+
+        self.n_parsed = 0
+        self.assertEqual(self.scan(), (self.expected_rows(), 50))
+        self.assertEqual(self.n_parsed, 0)
+
+        # A file whose mtime changed is read again, but only parsed if its
+        # content changed
+        self.touch(self.filepaths[3])
+        with open(self.filepaths[7], 'a') as fp:
+            fp.write('import json\n')
+        self.touch(self.filepaths[7])
+        rows, hits = self.scan()
+        self.assertEqual(hits, 49)
+        self.assertEqual(self.n_parsed, 1)
+        expected = self.expected_rows()
+        expected.insert(16, ('json', self.filepaths[7], 6, 0))
+        self.assertEqual(rows, expected)
+        # and the refreshed entries match the files' stat again
+        cache = import_utils.ImportCache(self.cache_path)
+        for fpath in self.filepaths[3], self.filepaths[7]:
+            self.assertIsNotNone(cache.get(fpath, os.stat(fpath)))
+
+    def test_deps(self):
+        self.scan()
+        self.n_parsed = 0
+        # Entries without dependencies are parsed again for the graph
+        graph = import_utils.ImportGraph()
+        self.assertEqual(self.scan(graph=graph), (self.expected_rows(), 0))
+        self.assertEqual(self.n_parsed, 50)
+        self.assertEqual(graph.edges['mod0'], {'mod1'})
+
+        self.n_parsed = 0
+        graph = import_utils.ImportGraph()
+        self.assertEqual(self.scan(graph=graph), (self.expected_rows(), 50))
+        self.assertEqual(self.n_parsed, 0)
+        self.assertEqual(graph.edges['mod49'], {'mod0'})
+        # and can be used without the graph
+        self.assertEqual(self.scan(), (self.expected_rows(), 50))
+
+    def test_jobs_order(self):
+        # Cached and uncached files interleaved, and missing files
+        self.scan(self.filepaths[::3])
+        filepaths = self.filepaths[:]
+        filepaths.insert(10, os.path.join(self.dpath, 'missing.py'))
+        rows, hits = self.scan(filepaths, jobs=2)
+        self.assertEqual(rows, self.expected_rows())
+        self.assertEqual(hits, 17)
+        self.assertEqual(self.scan(filepaths, jobs=3), (self.expected_rows(), 50))
+
+
+class IgnoreRulesTest(unittest.TestCase):
+    def assertIgnored(self, lines, expected, is_dir=False):
+        base_dpath = os.path.join(os.sep, 'project')
+        rules = import_utils.IgnoreRules().extended(base_dpath, lines)
+        for rel_path, ignored in expected.items():
+            path = os.path.join(base_dpath, *rel_path.split('/'))
+            self.assertEqual(rules.is_ignored(path, is_dir), ignored, rel_path)
+
+    def test_wildcards(self):
+        # "*" and "?" do not match "/"
+        self.assertIgnored(['a/*.py'], {'a/b.py': True, 'a/b/c.py': False,
+                                        'b/a/b.py': False})
+        self.assertIgnored(['a?c/d'], {'abc/d': True, 'a/c/d': False})
+        self.assertIgnored(['[!a]x/y'], {'bx/y': True, 'ax/y': False})
+
+    def test_double_star(self):
+        self.assertIgnored(['**/foo/bar'], {'foo/bar': True, 'x/y/foo/bar': True,
+                                            'x/foo/baz': False})
+        self.assertIgnored(['a/**/b'], {'a/b': True, 'a/x/y/b': True, 'b': False})
+        self.assertIgnored(['a/**'], {'a/x': True, 'a/x/y': True, 'a': False})
+
+    def test_unanchored(self):
+        self.assertIgnored(['*.pyc', '!keep.pyc'], {'a.pyc': True, 'x/y/a.pyc': True,
+                                                    'x/keep.pyc': False})
+        self.assertIgnored(['build/'], {'build': True, 'x/build': True}, is_dir=True)
+        self.assertIgnored(['build/'], {'build': False})
+        self.assertIgnored(['/build'], {'build': True, 'x/build': False})
+
+    def test_get_filepaths(self):
+        dpath = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dpath)
+        for rel_path in ['a/b.py', 'a/b/c.py', 'a/b/d.py', 'e.py']:
+            fpath = os.path.join(dpath, *rel_path.split('/'))
+            if not os.path.isdir(os.path.dirname(fpath)):
+                os.makedirs(os.path.dirname(fpath))
+            open(fpath, 'w').close()
+        with open(os.path.join(dpath, '.gitignore'), 'w') as fp:
+            fp.write('a/*.py\n**/b/d.py\n')
+        filepaths = import_utils.get_filepaths([dpath])
+        self.assertEqual(sorted(os.path.relpath(fpath, dpath).replace(os.sep, '/')
+                                for fpath in filepaths),
+                         ['a/b/c.py', 'e.py'])
+
+
+class ModuleIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.dpath = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dpath)
+        self.index_path = os.path.join(self.dpath, 'modules.json')
+        self.entry = os.path.join(self.dpath, 'site-packages')
+        os.makedirs(os.path.join(self.entry, 'some_pkg'))
+        open(os.path.join(self.entry, 'some_pkg', '__init__.py'), 'w').close()
+        open(os.path.join(self.entry, 'some_module.py'), 'w').close()
+        self.addCleanup(setattr, sys, 'path', sys.path[:])
+        sys.path.append(self.entry)
+
+    def touch(self, path):
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    def test_no_rescan(self):
+        index = import_utils.ModuleIndex(self.index_path)
+        self.assertEqual(index.n_rescanned, len(sys.path))
+        self.assertTrue({'some_pkg', 'some_module', 'sys'} <= index.modules)
+        self.assertFalse(index.modules & {'not_installed'})
+
+        unchanged = import_utils.ModuleIndex(self.index_path)
+        self.assertEqual(unchanged.n_rescanned, 0)
+        self.assertEqual(unchanged.modules, index.modules)
+
+        # Only the entry which changed is rescanned
+        open(os.path.join(self.entry, 'other_module.py'), 'w').close()
+        self.touch(self.entry)
+        changed = import_utils.ModuleIndex(self.index_path)
+        self.assertEqual(changed.n_rescanned, 1)
+        self.assertEqual(changed.modules, index.modules | {'other_module'})
+
+        sys.path.remove(self.entry)
+        removed = import_utils.ModuleIndex(self.index_path)
+        self.assertEqual(removed.n_rescanned, 0)
+        self.assertFalse(removed.modules & {'some_pkg', 'some_module', 'other_module'})
+
+    def test_exclusions(self):
+        imports = import_utils.ImportStore()
+        for module in ['os', 'sys', 'some_pkg', 'not_installed']:
+            imports.add(module, 'a.py', 1, 0)
+        index = import_utils.ModuleIndex(self.index_path)
+        self.assertEqual(sorted(import_utils.collect_non_builtins(imports, False, True)),
+                         ['not_installed', 'some_pkg'])
+        self.assertEqual(sorted(import_utils.collect_non_builtins(
+            imports, True, False, module_index=index)), ['not_installed'])
+
+
+class ImportGraphTest(unittest.TestCase):
+    SOURCES = {
+        'app.py': 'import pkg.sub.mod\nfrom pkg import util\nimport json\n',
+        'pkg/__init__.py': '',
+        'pkg/util.py': 'from . import helpers\nfrom .sub import mod as m\n',
+        'pkg/helpers.py': 'from ...too_far import x\nfrom .missing import y\n',
+        'pkg/sub/__init__.py': 'from .mod import f\n',
+        'pkg/sub/mod.py': 'from .. import util\nfrom ..helpers import *\n',
+    }
+
+    def setUp(self):
+        self.dpath = os.path.realpath(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.dpath)
+        filepaths = []
+        for rel_path, source in sorted(self.SOURCES.items()):
+            fpath = os.path.join(self.dpath, *rel_path.split('/'))
+            if not os.path.isdir(os.path.dirname(fpath)):
+                os.makedirs(os.path.dirname(fpath))
+            with open(fpath, 'w') as fp:
+                fp.write(source)
+            filepaths.append(fpath)
+        self.graph = import_utils.ImportGraph()
+        import_utils.scan_files(filepaths, import_utils.ImportLister(), graph=self.graph)
+
+    def test_module_name(self):
+        for rel_path, expected in [('app.py', ('app', False)),
+                                   ('pkg/__init__.py', ('pkg', True)),
+                                   ('pkg/sub/mod.py', ('pkg.sub.mod', False))]:
+            fpath = os.path.join(self.dpath, *rel_path.split('/'))
+            self.assertEqual(self.graph.module_name(fpath), expected + (self.dpath,))
+
+    def test_resolve(self):
+        # Relative imports, from packages and modules, imports of parent
+        # packages and of submodules by name, and relative imports beyond
+        # the top-level package
+        self.assertEqual(self.graph.edges, {
+            'app': {'pkg', 'pkg.sub', 'pkg.sub.mod', 'pkg.util'},
+            'pkg': set(),
+            'pkg.util': {'pkg', 'pkg.helpers', 'pkg.sub', 'pkg.sub.mod'},
+            'pkg.helpers': {'pkg'},
+            'pkg.sub': {'pkg', 'pkg.sub.mod'},
+            'pkg.sub.mod': {'pkg', 'pkg.util', 'pkg.helpers'},
+        })
+
+    def test_importers(self):
+        self.assertEqual(self.graph.importers('pkg.helpers'),
+                         {'app', 'pkg.util', 'pkg.sub', 'pkg.sub.mod'})
+        # Modules in the same cycle import each other, but not themselves
+        self.assertEqual(self.graph.importers('pkg.util'),
+                         {'app', 'pkg.sub', 'pkg.sub.mod'})
+        self.assertEqual(self.graph.importers('app'), set())
+        self.assertEqual(self.graph.importers('json'), set())
+
+    def test_critical_path(self):
+        cycle = ['pkg.sub', 'pkg.sub.mod', 'pkg.util']
+        self.assertEqual(self.graph.critical_path('app'), [
+            (['app'], 1), (cycle, 3), (['pkg.helpers'], 1), (['pkg'], 1)])
+        self.assertEqual(self.graph.critical_path('pkg.sub.mod'), [
+            (cycle, 3), (['pkg.helpers'], 1), (['pkg'], 1)])
+        self.assertEqual(self.graph.critical_path('pkg'), [(['pkg'], 1)])
+        # The costliest chain, rather than the longest one
+        costs = {'app': 10, 'pkg': 100, 'pkg.helpers': 1, 'pkg.util': 5}
+        self.assertEqual(self.graph.critical_path('pkg.util', costs), [
+            (cycle, 5), (['pkg.helpers'], 1), (['pkg'], 100)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,548 @@
+"""
+Tests of minimize_conda_env.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import minimize_conda_env
+from minimize_conda_env import PackageSpec
+
+
+def make_deps(packages):
+    """Package specs from (name, dependencies) pairs, the names of pip
+    packages starting with "pip:".
+    """
+    all_deps = OrderedDict()
+    for name, deps in packages:
+        from_pip = name.startswith('pip:')
+        if from_pip:
+            name = name[len('pip:'):]
+        all_deps[name] = PackageSpec(name, '1.0', from_pip=from_pip)
+        all_deps[name].deps = deps
+    return all_deps
+
+
+def write_conda_meta(prefix, name, version, build, depends, schannel='conda-forge',
+                     n_paths=0, pkgs_dpath=None):
+    """Write the conda-meta file of a package the way conda does, with
+    sorted keys and ``n_paths`` entries in paths_data (which follows link).
+    """
+    dist_name = '{}-{}-{}'.format(name, version, build)
+    if pkgs_dpath is None:
+        pkgs_dpath = os.path.join(os.path.dirname(prefix), 'pkgs')
+    paths = ['lib/{}/file{}.py'.format(name, i) for i in range(n_paths)]
+    meta = {
+        'build': build,
+        'channel': 'https://conda.anaconda.org/' + schannel,
+        'depends': depends,
+        'files': paths,
+        'link': {'source': os.path.join(pkgs_dpath, dist_name), 'type': 1},
+        'name': name,
+        'paths_data': {'paths': [{'_path': path, 'path_type': 'hardlink'}
+                                 for path in paths],
+                       'paths_version': 1},
+        'schannel': schannel,
+        'url': 'https://conda.anaconda.org/{}/linux-64/{}.tar.bz2'.format(
+            schannel, dist_name),
+        'version': version,
+    }
+    conda_meta_dpath = os.path.join(prefix, 'conda-meta')
+    if not os.path.isdir(conda_meta_dpath):
+        os.makedirs(conda_meta_dpath)
+    fpath = os.path.join(conda_meta_dpath, dist_name + '.json')
+    with open(fpath, 'w') as fp:
+        json.dump(meta, fp, indent=2, sort_keys=True)
+    return fpath
+
+
+def write_dist_info(prefix, name, version, requires=(), installer='pip'):
+    """Write the *.dist-info directory of a Python package."""
+    dist_info_dpath = os.path.join(prefix, 'lib', 'python3.9', 'site-packages',
+                                   '{}-{}.dist-info'.format(name, version))
+    os.makedirs(dist_info_dpath)
+    with open(os.path.join(dist_info_dpath, 'INSTALLER'), 'w') as fp:
+        fp.write(installer + '\n')
+    with open(os.path.join(dist_info_dpath, 'METADATA'), 'w') as fp:
+        fp.write('Metadata-Version: 2.1\nName: {}\nVersion: {}\n'.format(name, version))
+        for require in requires:
+            fp.write('Requires-Dist: {}\n'.format(require))
+        fp.write('\nDescription\nRequires-Dist: not-a-header\n')
+    return dist_info_dpath
+
+
+def write_env(prefix):
+    """A small environment, with a package installed by pip."""
+    write_conda_meta(prefix, 'python', '3.9.7', 'h12debd9_1',
+                     ['openssl >=1.1.1l,<1.1.2a', 'ca-certificates'], schannel='pkgs/main')
+    write_conda_meta(prefix, 'openssl', '1.1.1l', 'h7f8727e_0', ['ca-certificates'],
+                     schannel='pkgs/main')
+    write_conda_meta(prefix, 'ca-certificates', '2021.10.26', 'h06a4308_2', [])
+    write_conda_meta(prefix, 'six', '1.16.0', 'pyhd3eb1b0_0', ['python'])
+    write_dist_info(prefix, 'six', '1.16.0', installer='conda')
+    write_dist_info(prefix, 'my_pkg', '0.1', ['six (>=1.0)', 'futures ; python_version < "3"',
+                                               'pytest ; extra == "test"'])
+
+
+class FakeCondaTestCase(unittest.TestCase):
+    """Environments in a temporary directory, with a base environment at
+    ``root_prefix`` and a home directory of their own.
+    """
+    def setUp(self):
+        self.dpath = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dpath)
+        self.root_prefix = os.path.join(self.dpath, 'miniconda3')
+        os.makedirs(os.path.join(self.root_prefix, 'conda-meta'))
+        self.home_dpath = os.path.join(self.dpath, 'home')
+        os.makedirs(self.home_dpath)
+        for key, value in [('HOME', self.home_dpath), ('CONDA_ROOT', self.root_prefix),
+                           ('CONDARC', ''), ('CONDA_ENVS_PATH', ''),
+                           ('CONDA_ENVS_DIRS', '')]:
+            self.addCleanup(self.restore_environ, key, os.environ.get(key))
+            os.environ[key] = value
+
+    @staticmethod
+    def restore_environ(key, value):
+        if value is None:
+            os.environ.pop(key, None)
+        else:
+            os.environ[key] = value
+
+    def count_parsed(self):
+        """List the names of the conda-meta files parsed in ``self.parsed``
+        (in this process only).
+        """
+        self.parsed = []
+        read_conda_meta = minimize_conda_env.read_conda_meta
+
+        def counting_read_conda_meta(fpath):
+            self.parsed.append(os.path.basename(fpath))
+            return read_conda_meta(fpath)
+        minimize_conda_env.read_conda_meta = counting_read_conda_meta
+        self.addCleanup(setattr, minimize_conda_env, 'read_conda_meta', read_conda_meta)
+
+
+class DepGraphTest(unittest.TestCase):
+    ALL_DEPS = make_deps([
+        ('tool-a', ['tool-b', 'python']),
+        ('pandas', ['numpy >=1.20', 'python', 'python-dateutil', 'Pandas']),
+        ('numpy', ['python >=3.8,<3.12', 'libblas', '__glibc >=2.17']),
+        ('python', ['openssl >=1.1', 'ca-certificates', 'libffi', 'libffi']),
+        ('openssl', ['ca-certificates']),
+        ('ca-certificates', ['openssl']),
+        ('libffi', []),
+        ('libblas', ['libopenblas']),
+        ('libopenblas', []),
+        ('python-dateutil', ['python', 'six']),
+        ('six', ['python']),
+        ('tool-b', ['tool-a']),
+        ('pip:my_pkg', ['Python_Dateutil >=2.8', 'numpy']),
+    ])
+
+    def setUp(self):
+        self.graph = minimize_conda_env.DepGraph(self.ALL_DEPS)
+
+    def test_adjacency(self):
+        adjacency = self.graph.adjacency()
+        # Uninstalled (virtual) packages, self-dependencies and duplicates
+        # are left out, and pip names are matched to conda names
+        self.assertEqual(adjacency['numpy'], ['python', 'libblas'])
+        self.assertEqual(adjacency['pandas'], ['numpy', 'python', 'python-dateutil'])
+        self.assertEqual(adjacency['python'], ['openssl', 'ca-certificates', 'libffi'])
+        self.assertEqual(adjacency['my_pkg'], ['python-dateutil', 'numpy'])
+        self.assertEqual(adjacency['libffi'], [])
+
+    def test_cycles(self):
+        self.assertEqual(sorted(self.graph.cycles()),
+                         [['openssl', 'ca-certificates'], ['tool-a', 'tool-b']])
+        # Dependencies come before the packages which depend on them
+        component = self.graph.component
+        for v in range(len(self.graph.names)):
+            for w in self.graph.targets[self.graph.offsets[v]:self.graph.offsets[v + 1]]:
+                self.assertLessEqual(component[w], component[v])
+
+    def test_roots(self):
+        # The cycle which nothing depends on is kept through its first
+        # package, the one which python depends on is not kept at all
+        self.assertEqual(self.graph.roots(), ['tool-a', 'pandas', 'my_pkg'])
+        reordered = OrderedDict(sorted(self.ALL_DEPS.items(),
+                                       key=lambda item: item[0] != 'tool-b'))
+        self.assertEqual(minimize_conda_env.DepGraph(reordered).roots(),
+                         ['tool-b', 'pandas', 'my_pkg'])
+        self.assertEqual(minimize_conda_env.DepGraph({}).roots(), [])
+
+    def test_reduced_deps(self):
+        reduced = self.graph.reduced_deps()
+        self.assertEqual(sorted(reduced['pandas']), ['numpy', 'python-dateutil'])
+        # One edge to the cycle
+        self.assertEqual(sorted(reduced['python']), ['libffi', 'openssl'])
+        self.assertEqual(sorted(reduced['my_pkg']), ['numpy', 'python-dateutil'])
+        self.assertEqual(reduced['tool-a'], ['python'])
+        self.assertEqual(reduced['openssl'], [])
+        self.assertEqual(reduced['ca-certificates'], [])
+        self.assertEqual(reduced['libblas'], ['libopenblas'])
+
+    def test_path(self):
+        self.assertEqual(self.graph.path('pandas', 'openssl'),
+                         [('pandas', ()), ('python', ()), ('openssl', ('>=1.1',))])
+        self.assertEqual(self.graph.path('my_pkg', 'six'),
+                         [('my_pkg', ()), ('python-dateutil', ('>=2.8',)), ('six', ())])
+        self.assertEqual(self.graph.path('ca-certificates', 'openssl'),
+                         [('ca-certificates', ()), ('openssl', ())])
+        self.assertEqual(self.graph.path('six', 'six'), [('six', ())])
+        self.assertIsNone(self.graph.path('python', 'six'))
+        self.assertIsNone(self.graph.path('libffi', 'python'))
+
+    def test_why(self):
+        self.assertEqual(self.graph.why('six'), [
+            [('pandas', ()), ('python-dateutil', ()), ('six', ())],
+            [('my_pkg', ()), ('python-dateutil', ('>=2.8',)), ('six', ())]])
+        self.assertEqual(self.graph.why('libopenblas'), [
+            [('pandas', ()), ('numpy', ('>=1.20',)), ('libblas', ()), ('libopenblas', ())],
+            [('my_pkg', ()), ('numpy', ()), ('libblas', ()), ('libopenblas', ())]])
+        self.assertEqual(self.graph.why('tool-b'), [[('tool-a', ()), ('tool-b', ())]])
+        self.assertEqual(self.graph.why('pandas'), [[('pandas', ())]])
+        self.assertEqual(len(self.graph.why('ca-certificates')), 3)
+
+    def test_long_chains(self):
+        # Deeper than the recursion limit
+        n = 5000
+        names = ['p{}'.format(i) for i in range(n)]
+        chain = make_deps([(name, [next_name]) for name, next_name
+                           in zip(names, names[1:] + [names[0]])])
+        graph = minimize_conda_env.DepGraph(chain)
+        self.assertEqual(graph.cycles(), [names])
+        self.assertEqual(graph.roots(), ['p0'])
+
+        chain[names[-1]].deps = []
+        graph = minimize_conda_env.DepGraph(chain)
+        self.assertEqual(graph.cycles(), [])
+        self.assertEqual(graph.roots(), ['p0'])
+        self.assertEqual(graph.reduced_deps(), graph.adjacency())
+        self.assertEqual(len(graph.path('p0', names[-1])), n)
+
+
+class CondaMetaTest(FakeCondaTestCase):
+    def setUp(self):
+        super(CondaMetaTest, self).setUp()
+        self.prefix = os.path.join(self.root_prefix, 'envs', 'test')
+        write_env(self.prefix)
+        write_conda_meta(self.prefix, 'python-dateutil', '2.8.2', 'pyhd3eb1b0_0',
+                         ['python >=3.6', 'six >=1.5'], n_paths=100)
+        self.conda_meta_dpath = os.path.join(self.prefix, 'conda-meta')
+
+    def listed_deps(self):
+        # What an environment.yml file lists, without the packages it
+        # leaves out
+        all_deps = OrderedDict()
+        for name, version in [('python', '3.9.7=h12debd9_1'),
+                              ('python-dateutil', '2.8.2=pyhd3eb1b0_0'),
+                              ('six', '1.16.0=pyhd3eb1b0_0')]:
+            all_deps[name] = PackageSpec(name, version)
+        return all_deps
+
+    def test_read_conda_meta(self):
+        fpath = write_conda_meta(self.prefix, 'tzdata', '2021e', 'hda174b7_0', [],
+                                 schannel='caf\xe9')
+        self.assertEqual(minimize_conda_env.read_conda_meta(fpath), {
+            'name': 'tzdata',
+            'source': os.path.join(self.root_prefix, 'envs', 'pkgs',
+                                   'tzdata-2021e-hda174b7_0'),
+            'schannel': 'caf\xe9',
+            'depends': [],
+        })
+
+    def test_unlisted_packages_skipped(self):
+        self.count_parsed()
+        all_deps = self.listed_deps()
+        meta_cache = {}
+        addl_deps = minimize_conda_env.update_deps_with_conda_meta(
+            'test', self.conda_meta_dpath, all_deps, meta_cache=meta_cache)
+        self.assertEqual(sorted(self.parsed), ['python-3.9.7-h12debd9_1.json',
+                                               'python-dateutil-2.8.2-pyhd3eb1b0_0.json',
+                                               'six-1.16.0-pyhd3eb1b0_0.json'])
+        self.assertEqual(sorted(meta_cache), sorted(self.parsed))
+        self.assertEqual(addl_deps, set(['openssl', 'ca-certificates', 'python', 'six']))
+        self.assertEqual(all_deps['python-dateutil'].deps,
+                         {'python': ('>=3.6',), 'six': ('>=1.5',)})
+        self.assertEqual(all_deps['six'].channel, 'conda-forge')
+
+        del self.parsed[:]
+        minimize_conda_env.update_deps_with_conda_meta(
+            'test', self.conda_meta_dpath, self.listed_deps(), meta_cache=meta_cache)
+        self.assertEqual(self.parsed, [])
+
+    def test_jobs(self):
+        expected = self.listed_deps()
+        minimize_conda_env.update_deps_with_conda_meta('test', self.conda_meta_dpath,
+                                                       expected)
+        for meta_cache in [None, {}]:
+            all_deps = self.listed_deps()
+            minimize_conda_env.update_deps_with_conda_meta(
+                'test', self.conda_meta_dpath, all_deps, meta_cache=meta_cache, jobs=2)
+            self.assertEqual(
+                dict((name, pkgspec.to_dict()) for name, pkgspec in all_deps.items()),
+                dict((name, pkgspec.to_dict()) for name, pkgspec in expected.items()))
+        self.assertEqual(sorted(meta_cache), ['python-3.9.7-h12debd9_1.json',
+                                              'python-dateutil-2.8.2-pyhd3eb1b0_0.json',
+                                              'six-1.16.0-pyhd3eb1b0_0.json'])
+
+
+class EnvSnapshotTest(FakeCondaTestCase):
+    def setUp(self):
+        super(EnvSnapshotTest, self).setUp()
+        self.prefix = os.path.join(self.root_prefix, 'envs', 'test')
+        write_env(self.prefix)
+        self.cache_dpath = os.path.join(self.dpath, 'cache')
+        self.count_parsed()
+
+    def read(self):
+        """Read the environment as main does, through its snapshot."""
+        snapshot = minimize_conda_env.EnvSnapshot(self.cache_dpath, self.prefix,
+                                                  direct=True)
+        cached = snapshot.load()
+        if cached is not None:
+            return cached, True
+        result = minimize_conda_env.read_env(self.prefix, meta_cache=snapshot.meta_cache)
+        snapshot.save(*result)
+        return result, False
+
+    def assertSameResult(self, result, expected):
+        self.assertEqual(
+            dict((name, pkgspec.to_dict()) for name, pkgspec in result[0].items()),
+            dict((name, pkgspec.to_dict()) for name, pkgspec in expected[0].items()))
+        self.assertEqual(result[1:], expected[1:])
+
+    def touch(self, fpath, delta=10):
+        mtime = os.path.getmtime(fpath) + delta
+        os.utime(fpath, (mtime, mtime))
+
+    def test_reuse(self):
+        result, cached = self.read()
+        self.assertFalse(cached)
+        self.assertEqual(len(self.parsed), 4)
+        self.assertEqual(result[0]['python'].deps,
+                         {'openssl': ('>=1.1.1l,<1.1.2a',), 'ca-certificates': ()})
+        self.assertEqual(result[0]['my-pkg'].deps, {'six': ('>=1.0',)})
+        self.assertEqual(result[2], ['conda-forge', 'defaults'])
+
+        snapshot_result, cached = self.read()
+        self.assertTrue(cached)
+        self.assertEqual(len(self.parsed), 4)
+        self.assertSameResult(snapshot_result, result)
+
+    def test_conda_meta_changed(self):
+        self.read()
+        del self.parsed[:]
+        fpath = write_conda_meta(self.prefix, 'six', '1.16.0', 'pyhd3eb1b0_0',
+                                 ['python', 'ca-certificates'])
+        self.touch(fpath)
+        result, cached = self.read()
+        self.assertFalse(cached)
+        # Only the file which changed is parsed again
+        self.assertEqual(self.parsed, ['six-1.16.0-pyhd3eb1b0_0.json'])
+        self.assertEqual(result[0]['six'].deps, {'python': (), 'ca-certificates': ()})
+        self.assertSameResult(self.read()[0], result)
+
+        # Removed and added packages
+        os.remove(fpath)
+        fpath = write_conda_meta(self.prefix, 'six', '1.17.0', 'pyhd8ed1ab_0', ['python'])
+        self.touch(os.path.dirname(fpath))
+        result, cached = self.read()
+        self.assertFalse(cached)
+        self.assertEqual(self.parsed[1:], ['six-1.17.0-pyhd8ed1ab_0.json'])
+        self.assertEqual(result[0]['six'].version, '1.17.0=pyhd8ed1ab_0')
+        snapshot = minimize_conda_env.EnvSnapshot(self.cache_dpath, self.prefix, direct=True)
+        self.assertEqual(sorted(snapshot.meta_cache),
+                         ['ca-certificates-2021.10.26-h06a4308_2.json',
+                          'openssl-1.1.1l-h7f8727e_0.json',
+                          'python-3.9.7-h12debd9_1.json',
+                          'six-1.17.0-pyhd8ed1ab_0.json'])
+
+    def test_site_packages_changed(self):
+        self.read()
+        site_packages_dpath = os.path.join(self.prefix, 'lib', 'python3.9', 'site-packages')
+        write_dist_info(self.prefix, 'other_pkg', '2.0')
+        self.touch(site_packages_dpath)
+        result, cached = self.read()
+        self.assertFalse(cached)
+        self.assertTrue(result[0]['other-pkg'].from_pip)
+        # but the conda-meta files were not parsed again
+        self.assertEqual(len(self.parsed), 4)
+
+    def test_direct_and_export_snapshots(self):
+        self.read()
+        snapshot = minimize_conda_env.EnvSnapshot(self.cache_dpath, self.prefix)
+        self.assertIsNone(snapshot.load())
+        self.assertEqual(snapshot.meta_cache, {})
+
+
+class EnvPrefixTest(FakeCondaTestCase):
+    def make_prefix(self, *path):
+        prefix = os.path.join(self.dpath, *path)
+        os.makedirs(os.path.join(prefix, 'conda-meta'))
+        return prefix
+
+    def test_envs_dirs(self):
+        env_prefix = minimize_conda_env.env_prefix
+        root_env = self.make_prefix('miniconda3', 'envs', 'test')
+        self.assertEqual(env_prefix('test'), root_env)
+        self.assertEqual(env_prefix('base'), self.root_prefix)
+        self.assertEqual(env_prefix(root_env), root_env)
+
+        # envs_dirs of .condarc come first, then $CONDA_ENVS_PATH
+        condarc_env = self.make_prefix('condarc_envs', 'test')
+        os.environ['CONDARC'] = os.path.join(self.dpath, 'condarc')
+        with open(os.environ['CONDARC'], 'w') as fp:
+            fp.write('envs_dirs:\n  - {}\nchannels:\n  - conda-forge\n'.format(
+                os.path.dirname(condarc_env)))
+        env_var_env = self.make_prefix('env_var_envs', 'test')
+        os.environ['CONDA_ENVS_PATH'] = os.path.dirname(env_var_env)
+        self.assertEqual(env_prefix('test'), condarc_env)
+        shutil.rmtree(condarc_env)
+        self.assertEqual(env_prefix('test'), env_var_env)
+        shutil.rmtree(env_var_env)
+        self.assertEqual(env_prefix('test'), root_env)
+        shutil.rmtree(root_env)
+        with self.assertRaises(ValueError):
+            env_prefix('test')
+
+        home_env = self.make_prefix('home', '.conda', 'envs', 'test')
+        self.assertEqual(env_prefix('test'), home_env)
+
+    def test_environments_txt(self):
+        prefix = self.make_prefix('elsewhere', 'test')
+        other_prefix = self.make_prefix('elsewhere', 'other')
+        os.makedirs(os.path.join(self.home_dpath, '.conda'))
+        with open(os.path.join(self.home_dpath, '.conda', 'environments.txt'), 'w') as fp:
+            fp.write('{}\n{}\n{}\n'.format(self.root_prefix, os.path.join(
+                self.dpath, 'removed', 'test'), prefix))
+        self.assertEqual(minimize_conda_env.env_prefix('test'), prefix)
+        # Only the environments listed there
+        with self.assertRaises(ValueError):
+            minimize_conda_env.env_prefix('other')
+        self.assertEqual(minimize_conda_env.env_prefix(other_prefix), other_prefix)
+
+    def test_list_env(self):
+        prefix = os.path.join(self.root_prefix, 'envs', 'test')
+        write_env(prefix)
+        all_deps, conda_meta_dpath, channels, env_name = minimize_conda_env.list_env('test')
+        self.assertEqual(conda_meta_dpath, os.path.join(prefix, 'conda-meta'))
+        self.assertEqual(channels, ['defaults'])
+        self.assertEqual(env_name, 'test')
+        self.assertEqual(sorted(all_deps), ['ca-certificates', 'my-pkg', 'openssl',
+                                            'python', 'six'])
+        self.assertEqual(all_deps['python'].version, '3.9.7=h12debd9_1')
+        self.assertFalse(all_deps['six'].from_pip)
+        self.assertEqual((all_deps['my-pkg'].version, all_deps['my-pkg'].from_pip),
+                         ('0.1', True))
+        # Given by prefix, the environment is named after its directory
+        self.assertEqual(minimize_conda_env.list_env(prefix)[3], 'test')
+
+        all_deps, _, channels, _ = minimize_conda_env.read_env('test')
+        self.assertEqual(all_deps['openssl'].path,
+                         os.path.join(self.root_prefix, 'envs', 'pkgs',
+                                      'openssl-1.1.1l-h7f8727e_0'))
+        self.assertEqual(all_deps['six'].channel, 'conda-forge')
+        self.assertEqual(channels, ['conda-forge', 'defaults'])
+        # Markers are evaluated for the Python of the environment, and
+        # extras are left out
+        self.assertEqual(all_deps['my-pkg'].deps, {'six': ('>=1.0',)})
+        roots = minimize_conda_env.DepGraph(all_deps).roots()
+        self.assertEqual(roots, ['my-pkg'])
+
+
+class MinimizeEnvsTest(FakeCondaTestCase):
+    def setUp(self):
+        super(MinimizeEnvsTest, self).setUp()
+        self.envs_dpath = os.path.join(self.root_prefix, 'envs')
+        self.pkgs_dpath = os.path.join(self.envs_dpath, 'pkgs')
+
+    def test_read_package_key(self):
+        prefix = os.path.join(self.envs_dpath, 'test')
+        fpath = write_conda_meta(prefix, 'six', '1.16.0', 'pyhd3eb1b0_0', ['python'])
+        source = os.path.join(self.pkgs_dpath, 'six-1.16.0-pyhd3eb1b0_0')
+        self.assertEqual(minimize_conda_env.read_package_key(fpath), source)
+        # link is out of the tail when it is followed by a long paths_data
+        fpath = write_conda_meta(prefix, 'six', '1.16.0', 'pyhd3eb1b0_0', ['python'],
+                                 n_paths=200)
+        self.assertGreater(os.path.getsize(fpath), 4 * minimize_conda_env.CONDA_META_TAIL_SIZE)
+        self.assertEqual(minimize_conda_env.read_package_key(fpath),
+                         'https://conda.anaconda.org/conda-forge/linux-64/'
+                         'six-1.16.0-pyhd3eb1b0_0.tar.bz2')
+        self.assertEqual(minimize_conda_env.read_package_key(fpath, tail_size=1 << 20),
+                         source)
+
+        with open(fpath, 'w') as fp:
+            json.dump({'depends': [], 'link': {'type': 1}, 'name': 'six',
+                       'url': 'https://example.com/\\"six\\".tar.bz2'}, fp, sort_keys=True)
+        self.assertEqual(minimize_conda_env.read_package_key(fpath),
+                         'https://example.com/\\"six\\".tar.bz2')
+        with open(fpath, 'w') as fp:
+            json.dump({'depends': [], 'name': 'six'}, fp)
+        self.assertIsNone(minimize_conda_env.read_package_key(fpath))
+
+    def write_envs(self):
+        one = os.path.join(self.envs_dpath, 'one')
+        write_env(one)
+        write_conda_meta(one, 'numpy', '1.21.2', 'py39h20f2e39_0', ['python >=3.9'],
+                         n_paths=300)
+        two = os.path.join(self.envs_dpath, 'two')
+        write_conda_meta(two, 'python', '3.9.7', 'h12debd9_1',
+                         ['openssl >=1.1.1l,<1.1.2a', 'ca-certificates'], schannel='pkgs/main')
+        write_conda_meta(two, 'openssl', '1.1.1l', 'h7f8727e_0', ['ca-certificates'],
+                         schannel='pkgs/main')
+        write_conda_meta(two, 'ca-certificates', '2021.10.26', 'h06a4308_2', [])
+        write_conda_meta(two, 'six', '1.17.0', 'pyhd8ed1ab_0', ['python'])
+        write_conda_meta(two, 'requests', '2.26.0', 'pyhd3eb1b0_0', ['python', 'six'])
+        # The same build, from another package cache
+        write_conda_meta(two, 'numpy', '1.21.2', 'py39h20f2e39_0', ['python >=3.9'],
+                         n_paths=300, pkgs_dpath=os.path.join(self.dpath, 'other_pkgs'))
+
+    def test_dedup(self):
+        self.write_envs()
+        results, n_files, n_parsed = minimize_conda_env.minimize_envs(['one', 'two'])
+        self.assertEqual((n_files, n_parsed), (11, 7))
+        one_deps, one_channels, one_name, one_graph = results[0]
+        two_deps, _, two_name, two_graph = results[1]
+        self.assertEqual((one_name, two_name), ('one', 'two'))
+        self.assertEqual(one_channels, ['conda-forge', 'defaults'])
+        self.assertEqual(one_graph.roots(), ['numpy', 'my-pkg'])
+        self.assertEqual(two_graph.roots(), ['numpy', 'requests'])
+        self.assertEqual(two_deps['six'].version, '1.17.0=pyhd8ed1ab_0')
+        self.assertEqual(two_deps['requests'].deps, {'python': (), 'six': ()})
+        # Identified by URL, numpy is the build of the first package cache
+        self.assertEqual(two_deps['numpy'].path,
+                         os.path.join(self.pkgs_dpath, 'numpy-1.21.2-py39h20f2e39_0'))
+        self.assertEqual(one_deps['numpy'].deps, {'python': ('>=3.9',)})
+
+        report = io.StringIO()
+        minimize_conda_env.print_report(results, n_files, n_parsed, fp=report)
+        self.assertIn('2 environments, 11 conda-meta files, 7 parsed\n', report.getvalue())
+        self.assertIn('  numpy: 2\n', report.getvalue())
+
+    def test_jobs(self):
+        self.write_envs()
+        results, n_files, n_parsed = minimize_conda_env.minimize_envs(['one', 'two'])
+        parallel_results, parallel_n_files, parallel_n_parsed = \
+            minimize_conda_env.minimize_envs(['one', 'two'], jobs=2)
+        self.assertEqual((parallel_n_files, parallel_n_parsed), (n_files, n_parsed))
+        for (all_deps, channels, env_name, graph), expected in zip(parallel_results, results):
+            self.assertEqual(
+                dict((name, pkgspec.to_dict()) for name, pkgspec in all_deps.items()),
+                dict((name, pkgspec.to_dict()) for name, pkgspec in expected[0].items()))
+            self.assertEqual((channels, env_name, graph.roots()),
+                             (expected[1], expected[2], expected[3].roots()))
+
+
+if __name__ == '__main__':
+    unittest.main()
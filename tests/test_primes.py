@@ -0,0 +1,255 @@
+"""
+Tests of primes, against the plain sieve of ``primes()``.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import itertools
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import primes
+
+
+N = 300000
+PRIMES = primes.primes(N)
+
+
+def expected_range(lo, hi):
+    return PRIMES[(PRIMES >= lo) & (PRIMES < hi)]
+
+
+def _extend_table(args):
+    path, bounds = args
+    table = primes.PrimeTable(path)
+    return [(table.extend(bound), table.pi(bound - 1))[1] for bound in bounds]
+
+
+class PrimesRangeTest(unittest.TestCase):
+    def assertPrimesRange(self, lo, hi, **kwargs):
+        res = primes.primes_range(lo, hi, **kwargs)
+        self.assertEqual(res.dtype, np.int64)
+        np.testing.assert_array_equal(res, expected_range(lo, hi),
+                                      'lo={}, hi={}, {}'.format(lo, hi, kwargs))
+
+    def test_same_as_primes(self):
+        for n in [3, 4, 5, 100, 1000, N]:
+            np.testing.assert_array_equal(primes.primes_range(0, n), primes.primes(n))
+
+    def test_segment_edges(self):
+        # One byte of segment covers 16 integers
+        for segment_bytes in [1, 2, 3, 64]:
+            span = 16 * segment_bytes
+            for hi in [span - 1, span, span + 1, 4 * span, 4 * span + 3, 5000]:
+                self.assertPrimesRange(0, hi, segment_bytes=segment_bytes)
+            for lo in [span - 1, span, span + 1, 3 * span + 2]:
+                self.assertPrimesRange(lo, 5000, segment_bytes=segment_bytes)
+
+    def test_bounds(self):
+        for lo in [0, 1, 2, 3, 4, 97, 98]:
+            for hi in [0, 2, 3, 4, 5, 97, 98, 100, 1000]:
+                self.assertPrimesRange(lo, hi)
+                self.assertPrimesRange(lo, hi, segment_bytes=1)
+        self.assertPrimesRange(1000, 10)
+
+
+class IterPrimesTest(unittest.TestCase):
+    def test_bounded(self):
+        for start, stop in [(2, 1000), (0, 3), (3, 4), (90, 98), (1000, 10), (0, N)]:
+            primes_list = list(primes.iter_primes(start, stop))
+            self.assertTrue(all(type(p) is int for p in primes_list))
+            self.assertEqual(primes_list, expected_range(start, stop).tolist())
+
+    def test_chunks(self):
+        chunks = list(primes.iter_primes(10, 5000, chunk=100))
+        self.assertGreater(len(chunks), 10)
+        np.testing.assert_array_equal(np.concatenate(chunks), expected_range(10, 5000))
+
+    def test_unbounded(self):
+        first = list(itertools.islice(primes.iter_primes(), len(PRIMES)))
+        self.assertEqual(first, PRIMES.tolist())
+        # Small windows, which need the base primes to be extended many times
+        gen = primes.iter_primes(start=1000, chunk=16)
+        chunks = list(itertools.islice(gen, 500))
+        gen.close()
+        res = np.concatenate(chunks)
+        np.testing.assert_array_equal(res, expected_range(1000, res[-1] + 1))
+
+
+class ParallelPrimesTest(unittest.TestCase):
+    def test_workers(self):
+        # Batches of segments in which the last ones are partial or empty
+        for workers in [2, 3, 8]:
+            for segment_bytes in [1, 5, 64]:
+                for lo, hi in [(0, 5000), (3, 16 * segment_bytes * workers + 1),
+                               (1001, 1002), (0, N)]:
+                    np.testing.assert_array_equal(
+                        primes.primes_range(lo, hi, segment_bytes, workers=workers),
+                        expected_range(lo, hi))
+
+    def test_parallel_primes(self):
+        for workers in [None, 1, 4]:
+            np.testing.assert_array_equal(primes.parallel_primes(N, workers), PRIMES)
+
+
+class PrimeTableTest(unittest.TestCase):
+    # Integers covered by each block of the index
+    SPAN = 16 * primes._TABLE_BLOCK
+
+    def setUp(self):
+        dpath = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dpath)
+        self.path = os.path.join(dpath, 'primes.tbl')
+
+    def read_files(self):
+        with open(self.path, 'rb') as fp:
+            header = primes._TABLE_HEADER.unpack(fp.read(primes._TABLE_HEADER.size))
+            nbytes = len(fp.read())
+        index = np.fromfile(self.path + '.idx', np.uint64)
+        return header, nbytes, index
+
+    def assertTableCorrect(self, table, hi):
+        for x in [0, 1, 2, 3, 4, 5, 9, 97, 100]:
+            self.assertEqual(table.is_prime(x), x in PRIMES, x)
+        # Both sides of each block boundary
+        for x in sorted({0, 1, 2, 3, 10, 1000} |
+                        set(k * self.SPAN + d for k in range(1, hi // self.SPAN)
+                            for d in (-2, -1, 0, 1))):
+            self.assertEqual(table.pi(x), int(np.searchsorted(PRIMES, x, 'right')), x)
+        for k in [1, 2, 3, 100, 6542, 6543, 6544, len(expected_range(0, hi))]:
+            self.assertEqual(table.nth_prime(k), PRIMES[k - 1], k)
+        for lo, hi_ in [(0, 10), (2, 3), (3, 3), (self.SPAN - 7, self.SPAN + 50),
+                        (10, hi)]:
+            np.testing.assert_array_equal(table.primes_range(lo, hi_),
+                                          expected_range(lo, hi_))
+
+    def test_build_and_reopen(self):
+        table = primes.PrimeTable(self.path, 100000)
+        self.assertEqual(table.bound, 2 * self.SPAN)
+        header, nbytes, index = self.read_files()
+        self.assertEqual(header, (primes._TABLE_MAGIC, 2 * self.SPAN))
+        self.assertEqual(nbytes, 2 * self.SPAN // 16)
+        np.testing.assert_array_equal(index, [0, len(expected_range(0, self.SPAN)),
+                                              len(expected_range(0, 2 * self.SPAN))])
+        self.assertTableCorrect(table, table.bound)
+
+        reopened = primes.PrimeTable(self.path)
+        self.assertEqual(reopened.bound, table.bound)
+        self.assertTableCorrect(reopened, table.bound)
+
+    def test_extend(self):
+        table = primes.PrimeTable(self.path)
+        self.assertEqual(table.bound, 0)
+        other = primes.PrimeTable(self.path, 1000)
+        self.assertEqual(other.bound, self.SPAN)
+        # Queries past the bound extend the table
+        self.assertEqual(table.pi(self.SPAN + 1), len(expected_range(0, self.SPAN + 2)))
+        self.assertEqual(table.bound, 2 * self.SPAN)
+        self.assertTableCorrect(table, table.bound)
+
+        # Another table on the same path sees the extended bound, and extends
+        # it further without losing what was already there
+        other.extend(4 * self.SPAN - 100)
+        self.assertEqual(other.bound, 4 * self.SPAN)
+        self.assertTableCorrect(other, 4 * self.SPAN)
+        _, nbytes, index = self.read_files()
+        self.assertEqual(nbytes, 4 * self.SPAN // 16)
+        self.assertEqual(len(index), 5)
+        self.assertEqual(int(index[-1]), len(expected_range(0, 4 * self.SPAN)))
+        self.assertEqual(primes.PrimeTable(self.path).bound, 4 * self.SPAN)
+        # Extending to a bound already reached leaves the files alone
+        table.extend(3 * self.SPAN)
+        self.assertEqual(table.bound, 4 * self.SPAN)
+        self.assertEqual(self.read_files()[1], nbytes)
+
+    def test_concurrent_extend(self):
+        # Processes extending the same table in different steps
+        jobs = [(self.path, range(step, 4 * self.SPAN + 1, step))
+                for step in [self.SPAN // 2, self.SPAN, 3 * self.SPAN // 2, 2 * self.SPAN]]
+        # Forking a process with numba threads running can deadlock
+        pool = multiprocessing.get_context('spawn').Pool(len(jobs))
+        try:
+            results = pool.map(_extend_table, jobs)
+        finally:
+            pool.close()
+            pool.join()
+        for (_, bounds), counts in zip(jobs, results):
+            self.assertEqual(counts, [len(expected_range(0, bound)) for bound in bounds])
+        table = primes.PrimeTable(self.path)
+        self.assertEqual(table.bound, 4 * self.SPAN)
+        self.assertTableCorrect(table, table.bound)
+
+    def test_not_a_table(self):
+        with open(self.path, 'wb') as fp:
+            fp.write(b'x' * 64)
+        with self.assertRaises(ValueError):
+            primes.PrimeTable(self.path)
+
+
+class BatchTest(unittest.TestCase):
+    # Strong pseudoprimes to the first bases (the smallest ones to bases
+    # 2-7, 2-11, 2-13, 2-17 and 2-23), Carmichael numbers and squares of
+    # primes
+    COMPOSITES = [3215031751, 2152302898747, 3474749660383, 341550071728321,
+                  3825123056546413051, 561, 1105, 4294967291 ** 2, 9, 25, 49]
+    # Largest primes below 2**64 and 2**32
+    PRIMES = [2 ** 64 - 59, 2 ** 64 - 83, 2 ** 32 - 5, 2, 3, 5, 37, 41]
+
+    def test_is_prime_batch(self):
+        arr = np.arange(N, dtype=np.uint64)
+        expected = np.zeros(N, np.bool_)
+        expected[PRIMES] = True
+        np.testing.assert_array_equal(primes.is_prime_batch(arr), expected)
+
+        values = self.COMPOSITES + self.PRIMES + [0, 1, 2 ** 64 - 1, 2 ** 64 - 2]
+        self.assertEqual(primes.is_prime_batch(np.array(values, np.uint64)).tolist(),
+                         [False] * len(self.COMPOSITES) + [True] * len(self.PRIMES) +
+                         [False] * 4)
+        self.assertEqual(primes.is_prime_batch(np.array([[2, 4], [5, 6]])).tolist(),
+                         [[True, False], [True, False]])
+
+    def assertFactors(self, values, factors, offsets):
+        self.assertEqual(offsets.shape, (len(values) + 1,))
+        self.assertTrue(primes.is_prime_batch(factors).all())
+        for i, n in enumerate(values):
+            n_factors = [int(f) for f in factors[offsets[i]:offsets[i + 1]]]
+            self.assertEqual(n_factors, sorted(n_factors))
+            if n < 2:
+                self.assertEqual(n_factors, [])
+                continue
+            product = 1
+            for factor in n_factors:
+                product *= factor
+            self.assertEqual(product, int(n), n)
+
+    def test_factorize_batch(self):
+        values = ([0, 1, 2, 3, 4, 12, 2 ** 63, 2 ** 64 - 1, 2 ** 64 - 59,
+                   4294967291 * 4294967279, 2 ** 64 - 83, 3215031751] +
+                  self.COMPOSITES)
+        factors, offsets = primes.factorize_batch(np.array(values, np.uint64))
+        self.assertFactors(values, factors, offsets)
+        self.assertEqual(factors[offsets[7]:offsets[8]].tolist(),
+                         [3, 5, 17, 257, 641, 65537, 6700417])
+        self.assertEqual(factors[offsets[11]:offsets[12]].tolist(),
+                         [151, 751, 28351])
+
+        values = np.random.RandomState(0).randint(0, 2 ** 63, 2000, np.int64)
+        values = values.astype(np.uint64) * np.uint64(2) + np.uint64(1)
+        factors, offsets = primes.factorize_batch(values, chunk=300)
+        self.assertFactors(values, factors, offsets)
+
+    def test_empty(self):
+        factors, offsets = primes.factorize_batch(np.empty(0, np.uint64))
+        self.assertEqual((factors.shape, offsets.tolist()), ((0,), [0]))
+        self.assertEqual(primes.is_prime_batch([]).shape, (0,))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,440 @@
+"""
+Tests of rgit against stub GitHub API servers running on localhost, and
+local bare repositories standing for GitHub remotes.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+
+import git
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import rgit
+
+
+FIXTURES_DPATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def issue(number):
+    return {'number': number, 'state': 'open', 'title': 'Issue {}'.format(number),
+            'html_url': 'https://github.com/o/r/issues/{}'.format(number),
+            'milestone': None, 'user': {'login': 'someone'}, 'assignees': [],
+            'labels': [], 'comments': 0, 'body': ''}
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class RestHandler(BaseHTTPRequestHandler):
+    """
+    Serves ``n_issues`` issues of o/r, ``per_page`` at a time, with a Link
+    header giving the "next" page and, unless ``next_only``, the "last" one.
+    Earlier pages are answered more slowly, so that concurrently fetched
+    pages arrive out of order.
+    """
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        server.requests.append(self.path)
+        if url.path != '/repos/o/r/issues':
+            self.send_response(404)
+            self.end_headers()
+            return
+        per_page = int(query['per_page'][0])
+        page = int(query.get('page', ['1'])[0])
+        n_pages = max(1, -(-server.n_issues // per_page))
+        time.sleep(0.02 * (n_pages - page))
+        first = (page - 1) * per_page + 1
+        data = [issue(number) for number in
+                range(first, min(first + per_page, server.n_issues + 1))]
+
+        page_url = 'http://{}:{}/repos/o/r/issues?per_page={}&page='.format(
+            server.server_address[0], server.server_address[1], per_page)
+        links = []
+        if page < n_pages:
+            links.append('<{}{}>; rel="next"'.format(page_url, page + 1))
+            if not server.next_only:
+                links.append('<{}{}>; rel="last"'.format(page_url, n_pages))
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if links:
+            self.send_header('Link', ', '.join(links))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class GraphQLHandler(BaseHTTPRequestHandler):
+    """
+    Answers GraphQL queries with the recorded responses of the fixtures of
+    ``server.fixtures`` whose variables are those of the query, and which
+    are about the same part of the schema (``query_contains``).
+    """
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        payload = json.loads(body.decode('utf-8'))
+        server.requests.append(payload)
+        for fixture in server.fixtures:
+            if (fixture['variables'] == payload['variables'] and
+                    fixture['query_contains'] in payload['query']):
+                response = fixture['response']
+                break
+        else:
+            response = {'errors': [{'message': 'No recorded response'}]}
+        body = json.dumps(response).encode('utf-8')
+        self.send_response(200 if self.path == '/graphql' else 404)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class CacheHandler(BaseHTTPRequestHandler):
+    """
+    Serves version ``server.version`` of a resource at any path, with an
+    ETag and a Last-Modified date, and answers "304 Not Modified" to
+    requests for the current version.
+    """
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append((self.path, dict(self.headers)))
+        etag = '"v{}"'.format(server.version)
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        body = json.dumps({'path': self.path, 'version': server.version}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', 'Thu, 01 Oct 2026 00:00:00 GMT')
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StubServerTestCase(unittest.TestCase):
+    handler = None
+
+    def start_server(self, **attrs):
+        server = StubServer(('127.0.0.1', 0), self.handler)
+        server.requests = []
+        for key, value in attrs.items():
+            setattr(server, key, value)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server, 'http://{}:{}'.format(*server.server_address)
+
+    def setUp(self):
+        # Proxies from the environment must not be used for localhost
+        self.session = requests.Session()
+        self.session.trust_env = False
+        self.addCleanup(self.session.close)
+
+
+class GhIterTest(StubServerTestCase):
+    handler = RestHandler
+
+    def test_page_count(self):
+        server, api_url = self.start_server(n_issues=250, next_only=False)
+        resp = rgit.gh_get(api_url + '/repos/o/r/issues', self.session,
+                           {'per_page': rgit.PER_PAGE})
+        self.assertEqual(rgit.page_count(resp), 3)
+
+        server.n_issues = 20
+        resp = rgit.gh_get(api_url + '/repos/o/r/issues', self.session,
+                           {'per_page': rgit.PER_PAGE})
+        self.assertEqual(rgit.page_count(resp), 1)
+
+        server.n_issues, server.next_only = 250, True
+        resp = rgit.gh_get(api_url + '/repos/o/r/issues', self.session,
+                           {'per_page': rgit.PER_PAGE})
+        self.assertIsNone(rgit.page_count(resp))
+
+    def test_last_link(self):
+        server, api_url = self.start_server(n_issues=450, next_only=False)
+        records = rgit.gh_list('o/r/issues', self.session, jobs=4, api_url=api_url)
+        self.assertEqual([record['id'] for record in records],
+                         [str(number) for number in range(1, 451)])
+        # Each page is fetched once, the first one without a page number
+        pages = sorted(parse_qs(urlparse(path).query).get('page', ['1'])[0]
+                       for path in server.requests)
+        self.assertEqual(pages, ['1', '2', '3', '4', '5'])
+
+    def test_next_links_only(self):
+        server, api_url = self.start_server(n_issues=250, next_only=True)
+        records = rgit.gh_list('o/r/issues', self.session, jobs=4, api_url=api_url)
+        self.assertEqual([record['id'] for record in records],
+                         [str(number) for number in range(1, 251)])
+        self.assertEqual(len(server.requests), 3)
+
+    def test_single_page(self):
+        server, api_url = self.start_server(n_issues=3, next_only=False)
+        records = rgit.gh_list('o/r/issues', self.session, api_url=api_url)
+        self.assertEqual([record['id'] for record in records], ['1', '2', '3'])
+        self.assertEqual(len(server.requests), 1)
+
+
+class GhGraphQLIterTest(StubServerTestCase):
+    handler = GraphQLHandler
+
+    def setUp(self):
+        super(GhGraphQLIterTest, self).setUp()
+        with open(os.path.join(FIXTURES_DPATH, 'graphql.json'), 'r') as fp:
+            fixtures = json.load(fp)
+        self.server, self.api_url = self.start_server(fixtures=fixtures)
+
+    def test_list(self):
+        records = list(rgit.gh_graphql_iter('o/r/pulls?state=all', self.session,
+                                            self.api_url, batch_size=2))
+        self.assertEqual([record['id'] for record in records], ['1', '2', '3'])
+        self.assertEqual([record['state'] for record in records],
+                         ['open', 'closed', 'closed'])
+        self.assertEqual([record['merged'] for record in records],
+                         [False, True, False])
+        self.assertEqual(records[2]['user'], 'ghost')
+
+        first = records[0]
+        self.assertEqual(first['branch'], 'feature-1')
+        self.assertEqual(first['base_branch'], 'o:master')
+        self.assertEqual(first['labels'], ['enhancement'])
+        self.assertEqual(first['assignees'], ['alice'])
+        self.assertEqual(first['milestone'], {'title': 'v1.0',
+                                              'description': 'First release',
+                                              'due_on': '2026-12-01T00:00:00Z'})
+        self.assertEqual(first['n_comments'], '2')
+        # The second page of comments is fetched separately
+        self.assertEqual([(comment['creator'], comment['body']) for comment in first['comments']],
+                         [('alice', 'Comment 1'), ('ghost', 'Comment 2')])
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_numbers(self):
+        records = list(rgit.gh_graphql_iter('o/r/issues/5,6', self.session,
+                                            self.api_url))
+        self.assertEqual([(record['id'], record['state']) for record in records],
+                         [('5', 'open'), ('6', 'closed')])
+        self.assertEqual([record['labels'] for record in records], [['bug'], ['bug']])
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_graphql_url(self):
+        self.assertEqual(rgit.graphql_url('https://api.github.com'),
+                         'https://api.github.com/graphql')
+        self.assertEqual(rgit.graphql_url('https://github.example.com/api/v3'),
+                         'https://github.example.com/api/graphql')
+
+
+class ResponseCacheTest(StubServerTestCase):
+    handler = CacheHandler
+
+    def setUp(self):
+        super(ResponseCacheTest, self).setUp()
+        self.server, self.api_url = self.start_server(version=1)
+        self.cache_dpath = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dpath)
+
+    def cached_session(self, cache, auth=None):
+        session = requests.Session()
+        session.trust_env = False
+        session.mount('http://', rgit.CachingAdapter(cache))
+        session.auth = auth
+        self.addCleanup(session.close)
+        return session
+
+    def get(self, session, path='/repos/o/r'):
+        return rgit.gh_get(self.api_url + path, session).json()
+
+    def test_revalidation(self):
+        cache = rgit.ResponseCache(self.cache_dpath)
+        session = self.cached_session(cache)
+        self.assertEqual(self.get(session), {'path': '/repos/o/r', 'version': 1})
+        self.assertNotIn('If-None-Match', self.server.requests[0][1])
+
+        # Unchanged: the cached body is reused after a "304 Not Modified"
+        self.assertEqual(self.get(session), {'path': '/repos/o/r', 'version': 1})
+        headers = self.server.requests[1][1]
+        self.assertEqual(headers['If-None-Match'], '"v1"')
+        self.assertEqual(headers['If-Modified-Since'], 'Thu, 01 Oct 2026 00:00:00 GMT')
+
+        # Changed: the new version replaces the cached one
+        self.server.version = 2
+        self.assertEqual(self.get(session), {'path': '/repos/o/r', 'version': 2})
+        self.assertEqual(self.get(session), {'path': '/repos/o/r', 'version': 2})
+        self.assertEqual(self.server.requests[3][1]['If-None-Match'], '"v2"')
+        self.assertEqual(cache.stats, {'hits': 0, 'revalidated': 2, 'misses': 2})
+
+    def test_ttl(self):
+        cache = rgit.ResponseCache(self.cache_dpath, ttl=60)
+        session = self.cached_session(cache)
+        self.get(session)
+        self.server.version = 2
+        # Still fresh: served from the cache without any request
+        self.assertEqual(self.get(session), {'path': '/repos/o/r', 'version': 1})
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(cache.stats, {'hits': 1, 'revalidated': 0, 'misses': 1})
+
+        # Expired: revalidated
+        cache.ttl = 0
+        self.assertEqual(self.get(session), {'path': '/repos/o/r', 'version': 2})
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_offline(self):
+        self.get(self.cached_session(rgit.ResponseCache(self.cache_dpath)))
+        self.server.version = 2
+
+        cache = rgit.ResponseCache(self.cache_dpath, offline=True)
+        session = self.cached_session(cache)
+        self.assertEqual(self.get(session), {'path': '/repos/o/r', 'version': 1})
+        with self.assertRaises(requests.ConnectionError):
+            self.get(session, '/repos/o/other')
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(cache.stats, {'hits': 1, 'revalidated': 0, 'misses': 0})
+
+    def test_credentials(self):
+        cache = rgit.ResponseCache(self.cache_dpath, ttl=60)
+        alice = self.cached_session(cache, auth=('alice', 'secret'))
+        bob = self.cached_session(cache, auth=('bob', 'secret'))
+        self.get(alice)
+        # Responses are not shared between credentials
+        self.get(bob)
+        self.assertNotIn('If-None-Match', self.server.requests[1][1])
+        self.get(alice)
+        self.get(bob)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(cache.stats, {'hits': 2, 'revalidated': 0, 'misses': 2})
+        self.assertEqual(len(os.listdir(self.cache_dpath)), 2)
+
+
+class CheckoutTest(unittest.TestCase):
+    """
+    Checks out PRs of a local bare repository, with ``refs/pull/N/head``
+    refs like GitHub's, into an object store.
+    """
+    def setUp(self):
+        self.dpath = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dpath)
+        remote_dpath = os.path.join(self.dpath, 'remote.git')
+        self.remote = git.Repo.init(remote_dpath, bare=True, mkdir=True)
+        self.remote.git.config('uploadpack.allowFilter', 'true')
+        self.remote_url = 'file://' + remote_dpath
+        self.work = git.Repo.init(os.path.join(self.dpath, 'work'), mkdir=True)
+        self.commits = {}
+        self.push_pr(1, 'base.txt', 'base')
+        self.push_pr(1, 'one.txt', 'PR 1')
+        self.push_pr(2, 'two.txt', 'PR 2')
+        self.store = rgit.open_store(os.path.join(self.dpath, 'objects.git'))
+
+    def push_pr(self, pr_id, filename, contents):
+        """
+        Commit ``filename`` on top of the head of PR ``pr_id`` (or of the last
+        commit) and push it as the new head of the PR.
+        """
+        fpath = os.path.join(self.work.working_dir, filename)
+        with open(fpath, 'w') as fp:
+            fp.write(contents)
+        actor = git.Actor('Someone', 'someone@example.com')
+        if pr_id in self.commits:
+            self.work.git.checkout('-q', '--detach', self.commits[pr_id])
+        self.work.index.add([fpath])
+        commit = self.work.index.commit(filename, author=actor, committer=actor)
+        self.work.git.push(self.remote.git_dir, 'HEAD:refs/pull/{}/head'.format(pr_id))
+        self.commits[pr_id] = commit.hexsha
+        return commit.hexsha
+
+    def fetch(self, pr_id, **kwargs):
+        return rgit.fetch_pr(self.store, 'o/r', self.remote_url, pr_id, **kwargs)
+
+    def checkout(self, pr_id, commit):
+        return rgit.checkout_worktree(self.store, os.path.join(self.dpath, 'pulls', str(pr_id)),
+                                      'pull/o/r/{}'.format(pr_id), commit)
+
+    def read(self, repo, filename):
+        with open(os.path.join(repo.working_dir, filename), 'r') as fp:
+            return fp.read()
+
+    def test_partial_fetch(self):
+        commit = self.fetch(1)
+        self.assertEqual(commit, self.commits[1])
+        self.assertEqual(self.store.git.config('remote.o/r.promisor'), 'true')
+        # The commits and trees are fetched, but not the file contents
+        missing = self.store.git.rev_list('--objects', '--missing=print', commit).split()
+        self.assertEqual(len([obj for obj in missing if obj.startswith('?')]), 2)
+        self.assertEqual(self.store.git.rev_list('--count', commit), '2')
+
+        # ...which are downloaded when checked out
+        repo = self.checkout(1, commit)
+        self.assertEqual(self.read(repo, 'one.txt'), 'PR 1')
+
+    def test_full_fetch(self):
+        commit = self.fetch(1, partial=False)
+        missing = self.store.git.rev_list('--objects', '--missing=print', commit).split()
+        self.assertFalse([obj for obj in missing if obj.startswith('?')])
+
+    def test_depth(self):
+        commit = self.fetch(1, depth=1)
+        self.assertEqual(self.store.git.rev_list('--count', commit), '1')
+        self.assertTrue(os.path.isfile(os.path.join(self.store.git_dir, 'shallow')))
+
+    def test_worktrees(self):
+        one = self.checkout(1, self.fetch(1))
+        two = self.checkout(2, self.fetch(2))
+        # Both PRs are checked out at once, as worktrees of the store
+        self.assertEqual(self.read(one, 'one.txt'), 'PR 1')
+        self.assertEqual(self.read(two, 'two.txt'), 'PR 2')
+        self.assertFalse(os.path.exists(os.path.join(one.working_dir, 'two.txt')))
+        for repo in (one, two):
+            self.assertEqual(os.path.realpath(repo.common_dir),
+                             os.path.realpath(self.store.common_dir))
+        self.assertEqual(one.active_branch.name, 'pull/o/r/1')
+        self.assertEqual(two.active_branch.name, 'pull/o/r/2')
+
+    def test_refresh(self):
+        repo = self.checkout(1, self.fetch(1))
+        new_commit = self.push_pr(1, 'one.txt', 'PR 1, updated')
+        self.assertEqual(self.fetch(1), new_commit)
+        repo = self.checkout(1, new_commit)
+        self.assertEqual(repo.head.commit.hexsha, new_commit)
+        self.assertEqual(self.read(repo, 'one.txt'), 'PR 1, updated')
+
+    def test_not_a_worktree(self):
+        commit = self.fetch(1)
+        git.Repo.clone_from(self.remote_url, os.path.join(self.dpath, 'pulls', '1'))
+        with self.assertRaises(AssertionError):
+            self.checkout(1, commit)
+
+
+if __name__ == '__main__':
+    unittest.main()